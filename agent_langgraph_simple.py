@@ -3,34 +3,49 @@ Agente de IA para Atendimento de Supermercado usando LangGraph
 Versão com suporte a VISÃO e Pedidos com Comprovante
 """
 
-from typing import Dict, Any, TypedDict, Sequence, List
+from typing import Annotated, Dict, Any, Optional, Tuple, TypedDict, Sequence, List
+from uuid import UUID
 import re
 from langchain_openai import ChatOpenAI
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage, AIMessage, ToolMessage
 from langchain_core.tools import tool
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_core.runnables import RunnableConfig
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_community.callbacks import get_openai_callback
 from langgraph.graph import StateGraph, END
-from langgraph.prebuilt import ToolNode, tools_condition, create_react_agent
+from langgraph.graph.message import add_messages
+from langgraph.prebuilt import ToolNode, tools_condition
 from langgraph.checkpoint.memory import MemorySaver
 from pathlib import Path
+import base64
 import json
+import logging
 import os
+import time
 
 from config.settings import settings
-from config.logger import setup_logger
-from tools.http_tools import estoque, pedidos, alterar, ean_lookup, estoque_preco, busca_lote_produtos, busca_file_search_com_preco
+from config.logger import setup_logger, verbose_sampled
+from config import capture, metrics, tracing
+from tools.http_tools import estoque, pedidos, enviar_pedido, alterar, ean_lookup, estoque_preco, busca_lote_produtos, busca_file_search_com_preco
 from tools.time_tool import get_current_time, search_message_history
 from tools.redis_tools import (
     mark_order_sent, 
     add_item_to_cart, 
+    get_cart,
     get_cart_items, 
     remove_item_from_cart, 
-    clear_cart
+    clear_cart,
+    get_order_phase
 )
+from tools.order_outbox import enqueue_order
+from tools.overrides import ean_overrides
 from memory.limited_postgres_memory import LimitedPostgresChatMessageHistory
+from services import gemini
+from services.media import media_pipeline
+from services.model_router import TIER_FAST, TIER_STRONG, model_router
+from services.resilient_llm import ResilientChatModel
 
 logger = setup_logger(__name__)
 
@@ -47,20 +62,19 @@ def estoque_tool(url: str) -> str:
     return estoque(url)
 
 @tool
-def add_item_tool(telefone: str, produto: str, quantidade: float = 1.0, observacao: str = "", preco: float = 0.0) -> str:
+def add_item_tool(telefone: str, produto: str, quantidade: float = 1.0, observacao: str = "", preco: float = 0.0, ean: str = "") -> str:
     """
     Adicionar um item ao carrinho de compras do cliente.
     USAR IMEDIATAMENTE quando o cliente demonstrar intenção de compra.
+    Informe o EAN quando souber (o mesmo produto soma na mesma linha).
     """
-    item = {
-        "produto": produto,
-        "quantidade": quantidade,
-        "observacao": observacao,
-        "preco": preco
-    }
-    import json as json_lib
-    if add_item_to_cart(telefone, json_lib.dumps(item, ensure_ascii=False)):
-        return f"✅ Item '{produto}' ({quantidade}) adicionado ao carrinho."
+    carrinho = add_item_to_cart(telefone, produto, quantidade=quantidade, preco=preco, observacao=observacao, ean=ean)
+    if carrinho and ean:
+        # Item confirmado: as buscas que trouxeram este EAN viram atalho
+        ean_overrides.learn_from_cart(produto, ean)
+    if carrinho:
+        n_itens, total = carrinho
+        return f"✅ Item '{produto}' ({quantidade}) adicionado ao carrinho. Carrinho: {n_itens} item(ns), total estimado R$ {total:.2f}."
     return "❌ Erro ao adicionar item. Tente novamente."
 
 @tool
@@ -68,29 +82,27 @@ def view_cart_tool(telefone: str) -> str:
     """
     Ver os itens atuais no carrinho do cliente.
     """
-    items = get_cart_items(telefone)
+    cart = get_cart(telefone)
+    items = cart["itens"]
     if not items:
         return "🛒 O carrinho está vazio."
     
     summary = ["🛒 **Carrinho Atual:**"]
-    total_estimado = 0.0
     for i, item in enumerate(items):
         qtd = item.get("quantidade", 1)
         nome = item.get("produto", "?")
         obs = item.get("observacao", "")
-        preco = item.get("preco", 0.0)
-        subtotal = qtd * preco
-        total_estimado += subtotal
+        subtotal = item.get("subtotal", 0.0)
         
-        desc = f"{i+1}. {nome} (x{qtd})"
-        if preco > 0:
+        desc = f"{i+1}. {nome} (x{qtd:g})"
+        if subtotal > 0:
             desc += f" - R$ {subtotal:.2f}"
         if obs:
             desc += f" [Obs: {obs}]"
         summary.append(desc)
     
-    if total_estimado > 0:
-        summary.append(f"\n💰 **Total Estimado:** R$ {total_estimado:.2f}")
+    if cart["total"] > 0:
+        summary.append(f"\n💰 **Total Estimado:** R$ {cart['total']:.2f}")
         
     return "\n".join(summary)
 
@@ -102,8 +114,10 @@ def remove_item_tool(telefone: str, item_index: int) -> str:
     """
     # Converter de 1-based para 0-based
     idx = int(item_index) - 1
-    if remove_item_from_cart(telefone, idx):
-        return f"✅ Item {item_index} removido do carrinho."
+    carrinho = remove_item_from_cart(telefone, idx)
+    if carrinho:
+        n_itens, total = carrinho
+        return f"✅ Item {item_index} removido do carrinho. Restam {n_itens} item(ns), total estimado R$ {total:.2f}."
     return "❌ Erro ao remover item (índice inválido?)."
 
 @tool
@@ -120,21 +134,17 @@ def finalizar_pedido_tool(cliente: str, telefone: str, endereco: str, forma_paga
     - observacao: Observações do pedido (opcional)
     - comprovante: URL do comprovante (opcional)
     """
-    import json as json_lib
-    
     # 1. Obter itens do Redis
     items = get_cart_items(telefone)
     if not items:
         return "❌ O carrinho está vazio! Adicione itens antes de finalizar."
     
-    # 2. Calcular total e formatar itens para API
-    total = 0.0
+    # 2. Formatar itens para API (total já mantido no Redis)
     itens_formatados = []
     
     for item in items:
         preco = item.get("preco", 0.0)
         quantidade = item.get("quantidade", 1.0)
-        total += preco * quantidade
         
         # Formatar item para API (campos corretos)
         itens_formatados.append({
@@ -153,17 +163,29 @@ def finalizar_pedido_tool(cliente: str, telefone: str, endereco: str, forma_paga
         "itens": itens_formatados
     }
     
-    json_body = json_lib.dumps(payload, ensure_ascii=False)
-    
-    # 4. Enviar via HTTP
-    result = pedidos(json_body)
-    
-    # 5. Se sucesso, limpar carrinho e marcar status
-    if "sucesso" in result.lower() or "✅" in result:
-        clear_cart(telefone)
-        mark_order_sent(telefone)
-        
-    return result
+    # 4. Gravar na outbox (idempotente: mesmo carrinho = mesma chave)
+    chave, status, novo = enqueue_order(telefone, payload)
+
+    if status == "unavailable":
+        # Redis fora: envio direto, ainda com a chave de idempotência
+        res = enviar_pedido(payload, idempotency_key=chave)
+        if res.ok:
+            clear_cart(telefone)
+            mark_order_sent(telefone, chave)
+        return res.mensagem
+
+    if status != "pending":
+        # Não entrou na outbox: carrinho fica para o cliente tentar de novo
+        return "❌ Não consegui registrar o pedido agora. Tente novamente em instantes."
+
+    # 5. Pedido registrado: carrinho fica na outbox; confirmação chega por mensagem
+    clear_cart(telefone)
+    mark_order_sent(telefone, chave)
+    if not novo:
+        return (f"⏳ Este pedido (protocolo {chave[:8]}) já está em envio para a loja. "
+                "Diga ao cliente que a confirmação chega em instantes por mensagem.")
+    return (f"⏳ Pedido registrado (protocolo {chave[:8]}) e em envio para a loja. "
+            "Diga ao cliente que o pedido foi recebido e que a confirmação chega em instantes por mensagem.")
 
 @tool
 def alterar_tool(telefone: str, json_body: str) -> str:
@@ -233,6 +255,49 @@ ACTIVE_TOOLS = [
     alterar_tool,
 ]
 
+# Fases do pedido (tools.redis_tools.get_order_phase) -> tools expostas ao LLM.
+# O ToolNode continua com todas: chamada fora da fase ainda executa.
+PHASE_BROWSING = "browsing"
+PHASE_BUILDING = "building"
+PHASE_SENT = "sent"
+
+_SEARCH_TOOLS = {"ean", "estoque", "busca_lote", "estoque_tool", "time_tool"}
+PHASE_TOOLS = {
+    PHASE_BROWSING: _SEARCH_TOOLS | {"add_item_tool", "view_cart_tool"},
+    PHASE_BUILDING: _SEARCH_TOOLS | {"add_item_tool", "view_cart_tool", "remove_item_tool", "finalizar_pedido_tool"},
+    PHASE_SENT: _SEARCH_TOOLS | {"view_cart_tool", "alterar_tool", "search_history_tool"},
+}
+
+# Descrições curtas enviadas ao LLM quando as tools são filtradas por fase
+COMPACT_DESCRIPTIONS = {
+    "ean": "EAN e dados do produto pelo nome.",
+    "estoque": "Preço e estoque pelo EAN (só dígitos).",
+    "busca_lote": "Preço e estoque de vários produtos; nomes separados por vírgula, sem quantidades.",
+    "estoque_tool": "Preço e estoque pela URL de consulta da API de produtos.",
+    "time_tool": "Data e hora atual.",
+    "search_history_tool": "Mensagens anteriores do cliente (keyword opcional).",
+    "add_item_tool": "Adiciona item ao carrinho quando o cliente quer comprar. Informe o EAN se souber.",
+    "view_cart_tool": "Itens e total do carrinho.",
+    "remove_item_tool": "Remove item do carrinho pelo número mostrado no carrinho (1 = primeiro).",
+    "finalizar_pedido_tool": ("Fecha o pedido com os itens do carrinho, depois que o cliente confirmar o total. "
+                              "endereco: rua, número, bairro. forma_pagamento: PIX, DINHEIRO ou CARTAO. "
+                              "comprovante: URL (opcional)."),
+    "alterar_tool": "Altera o pedido já enviado (até 15 min após o envio).",
+}
+
+# Tools que mudam a fase no meio do turno (fase é reavaliada depois delas)
+_PHASE_CHANGING_TOOLS = {"add_item_tool", "remove_item_tool", "finalizar_pedido_tool"}
+
+
+def tools_for_phase(phase: Optional[str], tools: Optional[Sequence[Any]] = None) -> List[Any]:
+    """Tools da fase com descrições curtas; sem fase (ou fase desconhecida), todas como estão."""
+    tools = list(tools or ACTIVE_TOOLS)
+    names = PHASE_TOOLS.get(phase)
+    if names is None:
+        return tools
+    return [t.model_copy(update={"description": COMPACT_DESCRIPTIONS.get(t.name, t.description)})
+            for t in tools if t.name in names]
+
 # ============================================
 # Funções do Grafo
 # ============================================
@@ -282,33 +347,351 @@ def load_system_prompt() -> str:
         logger.error(f"Falha ao carregar prompt: {e}")
         raise
 
-def _build_llm():
-    model = getattr(settings, "llm_model", "gemini-2.0-flash-lite")
+class LimitedGeminiChat(ChatGoogleGenerativeAI):
+    """Gemini com a vaga do limite de chat presa só durante a chamada (try/finally)."""
+
+    def _generate(self, *args: Any, **kwargs: Any):
+        with gemini.chat_slot():
+            return super()._generate(*args, **kwargs)
+
+
+def _build_llm(model: Optional[str] = None, provider: Optional[str] = None):
+    model = model or getattr(settings, "llm_model", "gemini-2.0-flash-lite")
     temp = float(getattr(settings, "llm_temperature", 0.0))
-    provider = getattr(settings, "llm_provider", "google")
+    provider = provider or getattr(settings, "llm_provider", "google")
     
     if provider == "google":
         logger.info(f"🚀 Usando Google Gemini: {model}")
-        return ChatGoogleGenerativeAI(
+        return LimitedGeminiChat(
             model=model,
             google_api_key=settings.google_api_key,
             temperature=temp,
             convert_system_message_to_human=True,  # Necessário para Gemini processar system prompts
+            max_retries=settings.gemini_max_retries,
+            timeout=settings.gemini_timeout,
         )
     else:
         logger.info(f"🚀 Usando OpenAI: {model}")
         return ChatOpenAI(
             model=model,
             openai_api_key=settings.openai_api_key,
+            base_url=settings.openai_base_url or None,
             temperature=temp
         )
 
-def create_agent_with_history():
-    system_prompt = load_system_prompt()
-    llm = _build_llm()
-    memory = MemorySaver()
-    agent = create_react_agent(llm, ACTIVE_TOOLS, prompt=system_prompt, checkpointer=memory)
-    return agent
+class AgentState(TypedDict):
+    messages: Annotated[Sequence[BaseMessage], add_messages]
+
+
+class TurnBudget:
+    """
+    Limites de um turno (AGENT_MAX_*): chamadas ao LLM, tools, tempo e
+    tokens. Conferido antes de cada chamada ao LLM e antes de liberar as
+    tools pedidas; ao estourar, o grafo termina com a melhor resposta parcial.
+    """
+
+    def __init__(self, max_llm_calls: int, max_tool_calls: int, max_seconds: float, max_tokens: int):
+        self.max_llm_calls = max_llm_calls
+        self.max_tool_calls = max_tool_calls
+        self.max_seconds = max_seconds
+        self.max_tokens = max_tokens
+        self.llm_calls = 0
+        self.tool_calls = 0
+        self.tokens = 0
+        self.exhausted: Optional[str] = None
+        self._t0 = time.monotonic()
+
+    @classmethod
+    def from_settings(cls) -> "TurnBudget":
+        return cls(settings.agent_max_llm_calls, settings.agent_max_tool_calls,
+                   settings.agent_max_turn_seconds, settings.agent_max_turn_tokens)
+
+    @property
+    def recursion_limit(self) -> int:
+        # Cada passo = nó do agente + nó das tools; folga para o encerramento
+        return 2 * self.max_llm_calls + 5
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self._t0
+
+    def before_llm(self) -> Optional[str]:
+        """Nome do orçamento estourado (ou None se ainda pode chamar o LLM)."""
+        if self.llm_calls >= self.max_llm_calls:
+            return "llm_calls"
+        if self.elapsed() >= self.max_seconds:
+            return "wall_time"
+        if self.tokens >= self.max_tokens:
+            return "tokens"
+        return None
+
+    def note_llm(self, response: BaseMessage) -> None:
+        self.llm_calls += 1
+        usage = getattr(response, "usage_metadata", None) or {}
+        self.tokens += int(usage.get("input_tokens", 0) or 0) + int(usage.get("output_tokens", 0) or 0)
+
+    def allow_tools(self, n: int) -> bool:
+        if self.tool_calls + n > self.max_tool_calls:
+            return False
+        self.tool_calls += n
+        return True
+
+    def exhaust(self, reason: str) -> None:
+        self.exhausted = reason
+        metrics.BUDGET_EXHAUSTED.labels(reason).inc()
+        logger.warning("⏱️ Orçamento do turno estourado (%s): llm=%d tools=%d tokens=%d %.1fs",
+                       reason, self.llm_calls, self.tool_calls, self.tokens, self.elapsed())
+
+    def summary(self) -> Dict[str, Any]:
+        return {"llm_calls": self.llm_calls, "tool_calls": self.tool_calls, "tokens": self.tokens,
+                "seconds": round(self.elapsed(), 2), "exhausted": self.exhausted}
+
+
+# Orçamento, camada de modelo e fase do pedido do turno em andamento por conversa (thread_id do grafo)
+_turn_budgets: Dict[str, TurnBudget] = {}
+_turn_tiers: Dict[str, str] = {}
+_turn_phases: Dict[str, Optional[str]] = {}
+
+BUDGET_FALLBACK = "Desculpe a demora! 😅 Não consegui concluir agora. Pode me dizer de novo o que você precisa?"
+
+
+def _current_turn(messages: Sequence[BaseMessage]) -> Sequence[BaseMessage]:
+    """Mensagens depois da última HumanMessage (o turno atual)."""
+    for i in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[i], HumanMessage):
+            return messages[i + 1:]
+    return messages
+
+
+def _format_tool_fallback(tool_content: str) -> str:
+    """Resposta a partir do resultado de uma tool quando o LLM não respondeu."""
+    if "PRODUTOS_ENCONTRADOS" in tool_content:
+        # É resultado de busca, formatar como resposta
+        return f"Deixa eu ver aqui... 📝\n\n{tool_content}\n\nQuer que eu coloque algum desses no carrinho?"
+    # Outro tipo de tool, usar direto
+    return tool_content
+
+
+def _partial_answer(messages: Sequence[BaseMessage]) -> str:
+    """Melhor resposta já disponível no turno: texto do modelo, resultado de tool ou aviso."""
+    text = _select_response(messages)
+    if text:
+        return text
+    for msg in reversed(_current_turn(messages)):
+        if isinstance(msg, ToolMessage) and msg.content:
+            return _format_tool_fallback(str(msg.content))
+    return BUDGET_FALLBACK
+
+
+def _build_resilient_llm(model: Optional[str] = None, provider: Optional[str] = None):
+    """Modelo com hedging/failover para o provedor secundário (LLM_FALLBACK_*), se configurado."""
+    primary = _build_llm(model, provider)
+    fallback_provider = (settings.llm_fallback_provider or "").strip()
+    if not fallback_provider:
+        return primary
+    fallback_model = settings.llm_fallback_model or settings.llm_model
+    return ResilientChatModel(
+        primary=primary,
+        secondary=_build_llm(fallback_model, fallback_provider),
+        primary_name=f"{provider or settings.llm_provider}:{model or settings.llm_model}",
+        secondary_name=f"{fallback_provider}:{fallback_model}",
+    )
+
+
+def _phase_for_step(thread_id: str, messages: Sequence[BaseMessage]) -> Optional[str]:
+    """Fase do turno; reavaliada quando o passo anterior adicionou/removeu itens ou fechou o pedido."""
+    phase = _turn_phases.get(thread_id)
+    if phase is None:
+        return None
+    # Resultados de tools do último passo (podem vir várias em paralelo)
+    for msg in reversed(messages):
+        if not isinstance(msg, ToolMessage):
+            break
+        if msg.name in _PHASE_CHANGING_TOOLS:
+            phase = _turn_phases[thread_id] = get_order_phase(thread_id)
+            break
+    return phase
+
+
+def create_agent_with_history(llm=None, tools: Optional[Sequence[Any]] = None):
+    """
+    Grafo ReAct (agente <-> tools) com orçamento por turno, modelo da
+    camada escolhida para o turno e tools da fase do pedido; `llm`/`tools`
+    substituem os padrões (ex: replay com modelo e tools gravados, usado
+    nas duas camadas).
+    """
+    system_message = SystemMessage(content=load_system_prompt())
+    tools = list(tools or ACTIVE_TOOLS)
+    models = {TIER_STRONG: llm or _build_resilient_llm()}
+    models[TIER_FAST] = models[TIER_STRONG]
+    if llm is None and model_router.enabled():
+        models[TIER_FAST] = _build_resilient_llm(settings.llm_fast_model,
+                                                 settings.llm_fast_provider or settings.llm_provider)
+    # Um bind por camada x fase (None = todas as tools, descrições completas)
+    bound = {(tier, phase): model.bind_tools(tools_for_phase(phase, tools))
+             for tier, model in models.items() for phase in (None, *PHASE_TOOLS)}
+
+    def agent_node(state: AgentState, config: RunnableConfig) -> Dict[str, Any]:
+        messages = list(state["messages"])
+        thread_id = (config.get("configurable") or {}).get("thread_id")
+        phase = _phase_for_step(thread_id, messages)
+        llm_with_tools = bound.get((_turn_tiers.get(thread_id, TIER_STRONG), phase), bound[(TIER_STRONG, None)])
+        budget = _turn_budgets.get(thread_id)
+        reason = budget.before_llm() if budget else None
+        if reason:
+            budget.exhaust(reason)
+            return {"messages": [AIMessage(content=_partial_answer(messages))]}
+
+        metrics.TOOL_PHASE.labels(phase or "todas").inc()
+        response = llm_with_tools.invoke([system_message] + messages, config)
+        if budget:
+            budget.note_llm(response)
+            # Tools além do limite: descarta o pedido (sem tool_calls pendentes no histórico)
+            if getattr(response, "tool_calls", None) and not budget.allow_tools(len(response.tool_calls)):
+                budget.exhaust("tool_calls")
+                return {"messages": [AIMessage(content=_partial_answer(messages))]}
+        return {"messages": [response]}
+
+    graph = StateGraph(AgentState)
+    graph.add_node("agent", agent_node)
+    graph.add_node("tools", ToolNode(tools))
+    graph.set_entry_point("agent")
+    graph.add_conditional_edges("agent", tools_condition)
+    graph.add_edge("tools", "agent")
+    return graph.compile(checkpointer=MemorySaver())
+
+class TurnCallbackHandler(BaseCallbackHandler):
+    """
+    Span e métrica de latência por chamada ao LLM e por tool dentro do
+    turno. O span pai é passado explicitamente: os callbacks podem chegar
+    de outras threads.
+    """
+
+    run_inline = True
+
+    def __init__(self, parent: Any, model: str):
+        self.parent = parent
+        self.model = model
+        self._spans: Dict[UUID, Any] = {}
+        self._tokens: Dict[UUID, Any] = {}
+        self._started: Dict[UUID, Tuple[str, float]] = {}
+
+    def _start(self, run_id: UUID, name: str, **attrs: Any) -> Any:
+        sp = tracing.start_span(name, parent=self.parent, **attrs)
+        self._spans[run_id] = sp
+        self._started[run_id] = (name, time.perf_counter())
+        return sp
+
+    def _end(self, run_id: UUID, error: Optional[BaseException] = None) -> None:
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            name, t0 = started
+            elapsed = time.perf_counter() - t0
+            if name == "llm":
+                metrics.LLM_LATENCY.labels(self.model).observe(elapsed)
+            else:
+                metrics.TOOL_LATENCY.labels(name[len("tool."):], "error" if error else "ok").observe(elapsed)
+        token = self._tokens.pop(run_id, None)
+        if token is not None:
+            try:
+                tracing.reset_current(token)
+            except ValueError:
+                pass  # fim da tool em outro contexto
+        sp = self._spans.pop(run_id, None)
+        if sp is None:
+            return
+        if error is not None:
+            sp.fail(error)
+        sp.end()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs: Any) -> None:
+        self._start(run_id, "llm", mensagens=len(messages[0]) if messages else 0)
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, **kwargs: Any) -> None:
+        self._start(run_id, "llm")
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any) -> None:
+        sp = self._spans.get(run_id)
+        if sp is not None:
+            try:
+                usage = getattr(response.generations[0][0].message, "usage_metadata", None) or {}
+                sp.set(input_tokens=usage.get("input_tokens"), output_tokens=usage.get("output_tokens"))
+            except (AttributeError, IndexError):
+                pass
+        self._end(run_id)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, error)
+
+    def on_tool_start(self, serialized, input_str, *, run_id: UUID, **kwargs: Any) -> None:
+        sp = self._start(run_id, f"tool.{(serialized or {}).get('name', '?')}")
+        # A tool roda nesta mesma thread: chamadas HTTP/Redis viram filhas do span da tool
+        self._tokens[run_id] = tracing.set_current(sp)
+
+    def on_tool_end(self, output, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, error)
+
+
+class CaptureCallbackHandler(BaseCallbackHandler):
+    """Registra no TurnRecorder cada chamada ao LLM (resposta, tokens) e cada tool (entrada/saída)."""
+
+    run_inline = True
+
+    def __init__(self, recorder: "capture.TurnRecorder"):
+        self.recorder = recorder
+        self._llm: Dict[UUID, Tuple[int, float]] = {}
+        self._tools: Dict[UUID, Tuple[str, Any, float]] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs: Any) -> None:
+        prompt_chars = sum(len(str(m.content)) for m in (messages[0] if messages else []))
+        self._llm[run_id] = (prompt_chars, time.perf_counter())
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any) -> None:
+        prompt_chars, t0 = self._llm.pop(run_id, (0, time.perf_counter()))
+        try:
+            msg = response.generations[0][0].message
+        except (AttributeError, IndexError):
+            return
+        usage = getattr(msg, "usage_metadata", None) or {}
+        self.recorder.add_llm({
+            "content": msg.content,
+            "tool_calls": [{"tool": tc.get("name"), "args": tc.get("args"), "id": tc.get("id")}
+                           for tc in (getattr(msg, "tool_calls", None) or [])],
+            "prompt_chars": prompt_chars,
+            "input_tokens": usage.get("input_tokens", 0),
+            "output_tokens": usage.get("output_tokens", 0),
+            "ms": round((time.perf_counter() - t0) * 1000, 1),
+        })
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._llm.pop(run_id, None)
+
+    def on_tool_start(self, serialized, input_str, *, run_id: UUID, inputs: Optional[Dict[str, Any]] = None,
+                      **kwargs: Any) -> None:
+        self._tools[run_id] = ((serialized or {}).get("name", "?"), inputs if inputs is not None else input_str,
+                               time.perf_counter())
+
+    def _tool_done(self, run_id: UUID, output: Any, status: str) -> None:
+        started = self._tools.pop(run_id, None)
+        if started is None:
+            return
+        name, tool_input, t0 = started
+        self.recorder.add_tool({
+            "tool": name,
+            "input": tool_input,
+            "output": str(getattr(output, "content", output)),
+            "status": status,
+            "ms": round((time.perf_counter() - t0) * 1000, 1),
+        })
+
+    def on_tool_end(self, output, *, run_id: UUID, **kwargs: Any) -> None:
+        self._tool_done(run_id, output, "ok")
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._tool_done(run_id, f"{type(error).__name__}: {error}", "error")
+
 
 _agent_graph = None
 def get_agent_graph():
@@ -321,26 +704,112 @@ def get_agent_graph():
 # Função Principal
 # ============================================
 
+def _replace_image_in_state(agent, config: Dict[str, Any], result: Any, caption: str, output: str) -> None:
+    """Substitui a HumanMessage com imagem por uma descrição textual curta (mesmo id)."""
+    try:
+        messages = result.get("messages", []) if isinstance(result, dict) else []
+        for msg in reversed(messages):
+            if isinstance(msg, HumanMessage) and isinstance(msg.content, list):
+                text = next((p.get("text", "") for p in msg.content if isinstance(p, dict) and p.get("type") == "text"), caption)
+                resumo = output[:200].replace("\n", " ")
+                descricao = f"{text}\n[Imagem enviada pelo cliente; já analisada. Resposta dada: {resumo}]"
+                agent.update_state(config, {"messages": [HumanMessage(content=descricao, id=msg.id)]})
+                logger.info("🖼️ Imagem substituída por descrição no estado do grafo")
+                break
+    except Exception as e:
+        logger.warning(f"Não foi possível compactar imagem no estado: {e}")
+
+
+def _select_response(messages: Sequence[BaseMessage]) -> str:
+    """
+    Escolhe o texto a enviar: a última AIMessage do turno atual (depois da
+    última HumanMessage) com conteúdo real, sem tool_calls, sem bloco
+    <thinking> puro e sem cara de JSON. Retorna "" se nenhuma servir.
+    """
+    # IMPORTANTE: Encontrar o índice da última HumanMessage (a mensagem atual do usuário)
+    # Só queremos AIMessages que vieram DEPOIS dela (resposta do turno atual)
+    last_human_idx = -1
+    for i, msg in enumerate(messages):
+        if isinstance(msg, HumanMessage):
+            last_human_idx = i
+    
+    # Filtrar apenas mensagens após o último HumanMessage
+    current_turn_messages = messages[last_human_idx + 1:] if last_human_idx >= 0 else messages
+    logger.debug("🔍 Buscando resposta em %d msgs do turno atual (após idx %d)",
+                 len(current_turn_messages), last_human_idx)
+    
+    # Tentar pegar a última mensagem AI do turno atual que tenha conteúdo real
+    for msg in reversed(current_turn_messages):
+        # Verificar se é AIMessage
+        if not isinstance(msg, AIMessage):
+            continue
+        
+        # Ignorar mensagens que são tool calls (não tem resposta textual)
+        if hasattr(msg, 'tool_calls') and msg.tool_calls:
+            logger.debug("⏭️ Pulando AIMessage (é tool_call)")
+            continue
+        
+        # Extrair conteúdo
+        content = msg.content if isinstance(msg.content, str) else str(msg.content)
+        
+        # NOVO: Remover bloco <thinking>...</thinking> antes de processar
+        # O modelo pode incluir o pensamento junto com a resposta
+        clean_content = re.sub(r'<thinking>.*?</thinking>', '', content, flags=re.DOTALL).strip()
+        
+        # Se o conteúdo era APENAS thinking block, clean_content será vazio
+        if not clean_content:
+            logger.debug("⏭️ Pulando AIMessage (apenas bloco <thinking>)")
+            continue
+        
+        # Ignorar mensagens vazias
+        if not clean_content.strip():
+            logger.debug("⏭️ Pulando AIMessage (conteúdo vazio)")
+            continue
+        
+        # Ignorar mensagens que parecem ser dados estruturados
+        if clean_content.strip().startswith(("[", "{")):
+            logger.debug("⏭️ Pulando AIMessage (JSON estruturado)")
+            continue
+        
+        logger.debug("✅ AIMessage selecionada: %.100s...", clean_content)
+        return clean_content
+    return ""
+
+
 def run_agent_langgraph(telefone: str, mensagem: str) -> Dict[str, Any]:
     """
-    Executa o agente. Suporta texto e imagem (via tag [MEDIA_URL: ...]).
+    Executa o agente. Suporta texto e imagem (via tags [IMAGEM: ...] e [MEDIA_URL: ...]).
     """
-    print(f"[AGENT] Telefone: {telefone} | Msg bruta: {mensagem[:50]}...")
+    logger.debug("[AGENT] Telefone: %s | Msg bruta: %.50s...", telefone, mensagem)
+    recorder = capture.start_turn(telefone, mensagem)
     
-    # 1. Extrair URL de imagem se houver (Formato: [MEDIA_URL: https://...])
+    # 1. Extrair mídia para visão
+    #    [IMAGEM: message_id] -> bytes reduzidos do pipeline de mídia (inline)
+    #    [MEDIA_URL: https://...] -> link público (comprovantes/PDF)
     image_url = None
     clean_message = mensagem
     
+    image_match = re.search(r"\[IMAGEM:\s*(.*?)\]", mensagem)
+    if image_match:
+        clean_message = mensagem.replace(image_match.group(0), "").strip()
+        image = media_pipeline.load_image(image_match.group(1).strip())
+        if image:
+            data, mime = image
+            image_url = f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+            logger.info(f"📸 Imagem inline para visão ({len(data) // 1024}KB)")
+        else:
+            clean_message = f"{clean_message} [Imagem recebida - erro ao baixar]".strip()
+    
     # Regex para encontrar a tag de mídia injetada pelo server.py
-    media_match = re.search(r"\[MEDIA_URL:\s*(.*?)\]", mensagem)
-    if media_match:
+    media_match = re.search(r"\[MEDIA_URL:\s*(.*?)\]", clean_message)
+    if media_match and not image_url:
         image_url = media_match.group(1)
         # Remove a tag da mensagem de texto para não confundir o histórico visual
         # Mas mantemos o texto descritivo original
-        clean_message = mensagem.replace(media_match.group(0), "").strip()
-        if not clean_message:
-            clean_message = "Analise esta imagem/comprovante enviada."
+        clean_message = clean_message.replace(media_match.group(0), "").strip()
         logger.info(f"📸 Mídia detectada para visão: {image_url}")
+    if image_url and not clean_message:
+        clean_message = "Analise esta imagem/comprovante enviada."
 
     # 2. Salvar histórico (User)
     history_handler = None
@@ -408,93 +877,70 @@ def run_agent_langgraph(telefone: str, mensagem: str) -> Dict[str, Any]:
 
         # Monta o estado inicial
         initial_state = {"messages": previous_messages + [current_message]}
-        config = {"configurable": {"thread_id": telefone}, "recursion_limit": 100}
+        # Camada do modelo: turno simples -> rápido; mídia, falha anterior ou complexo -> forte
+        state_messages = (current_state.values.get("messages") if current_state and current_state.values
+                          else None) or previous_messages
+        recent_replies = [str(m.content) for m in state_messages[-6:] if isinstance(m, AIMessage) and m.content]
+        tier, tier_reason = model_router.route(telefone, mensagem, recent_replies[-3:])
+        model = model_router.model_for(tier)
+        metrics.TIER_TURNS.labels(tier, tier_reason.split(":")[0]).inc()
+        logger.info("🧭 Modelo do turno: %s (%s: %s)", model, tier, tier_reason)
+        phase = get_order_phase(telefone) if settings.agent_phase_tools else None
+
+        budget = TurnBudget.from_settings()
+        config = {"configurable": {"thread_id": telefone}, "recursion_limit": budget.recursion_limit}
+        config["callbacks"] = [TurnCallbackHandler(tracing.current_span(), model)]
+        if recorder:
+            config["callbacks"].append(CaptureCallbackHandler(recorder))
         
         logger.info("Executando agente...")
         
-        # Contador de tokens (nota: get_openai_callback pode não funcionar 100% com Gemini)
-        with get_openai_callback() as cb:
-            result = agent.invoke(initial_state, config)
-            
-            # Cálculo de custo baseado no provider
-            provider = getattr(settings, "llm_provider", "google")
-            if provider == "google":
-                # Gemini 2.0 Flash-Lite pricing
-                # Input: $0.075 per 1M tokens | Output: $0.30 per 1M tokens
-                input_cost = (cb.prompt_tokens / 1_000_000) * 0.075
-                output_cost = (cb.completion_tokens / 1_000_000) * 0.30
-            else:
-                # OpenAI gpt-4o-mini pricing
-                # Input: $0.15 per 1M tokens | Output: $0.60 per 1M tokens
-                input_cost = (cb.prompt_tokens / 1_000_000) * 0.15
-                output_cost = (cb.completion_tokens / 1_000_000) * 0.60
-            
-            total_cost = input_cost + output_cost
-            
-            # Log de tokens
-            logger.info(f"📊 TOKENS - Prompt: {cb.prompt_tokens} | Completion: {cb.completion_tokens} | Total: {cb.total_tokens}")
-            logger.info(f"💰 CUSTO: ${total_cost:.6f} USD (Input: ${input_cost:.6f} | Output: ${output_cost:.6f})")
+        _turn_budgets[telefone] = budget
+        _turn_tiers[telefone] = tier
+        _turn_phases[telefone] = phase
+        try:
+            # Contador de tokens (nota: get_openai_callback pode não funcionar 100% com Gemini)
+            with get_openai_callback() as cb:
+                result = agent.invoke(initial_state, config)
+        finally:
+            _turn_budgets.pop(telefone, None)
+            _turn_tiers.pop(telefone, None)
+            phase = _turn_phases.pop(telefone, phase)
+            metrics.TIER_LATENCY.labels(tier).observe(budget.elapsed())
+            metrics.TURN_STEPS.labels("llm").observe(budget.llm_calls)
+            metrics.TURN_STEPS.labels("tool").observe(budget.tool_calls)
+            span = tracing.current_span()
+            if span is not None:
+                span.set(model=model, tier=tier, phase=phase or "todas", **{f"budget.{k}": v for k, v in budget.summary().items()})
+            if budget.exhausted:
+                model_router.escalate(telefone, f"orcamento_{budget.exhausted}")
+
+        # Custo pelo preço do modelo em config/pricing.json (+ contadores do /metrics)
+        input_cost, output_cost = metrics.record_tokens(model, cb.prompt_tokens, cb.completion_tokens)
+        total_cost = input_cost + output_cost
+        metrics.TIER_COST.labels(tier).inc(total_cost)
+        
+        # Log de tokens
+        logger.info("📊 TOKENS - Prompt: %d | Completion: %d | Total: %d",
+                    cb.prompt_tokens, cb.completion_tokens, cb.total_tokens)
+        logger.info("💰 CUSTO: $%.6f USD (Input: $%.6f | Output: $%.6f)", total_cost, input_cost, output_cost)
+        turn_tokens = (cb.prompt_tokens, cb.completion_tokens)
         
         # 4. Extrair resposta (com fallback para Gemini empty responses)
         output = ""
         if isinstance(result, dict) and "messages" in result:
             messages = result["messages"]
-            logger.info(f"📨 Total de mensagens no resultado: {len(messages) if messages else 0}")
+            logger.debug("📨 Total de mensagens no resultado: %d", len(messages) if messages else 0)
             if messages:
-                # Log TODAS as mensagens para debug intensivo
-                for i, msg in enumerate(messages):
-                    msg_type = type(msg).__name__
-                    has_tool_calls = hasattr(msg, 'tool_calls') and msg.tool_calls
-                    content_preview = str(msg.content)[:150] if msg.content else "(vazio)"
-                    logger.info(f"📝 Msg[{i}] type={msg_type} tool_calls={has_tool_calls} content={content_preview}")
-                
-                # IMPORTANTE: Encontrar o índice da última HumanMessage (a mensagem atual do usuário)
-                # Só queremos AIMessages que vieram DEPOIS dela (resposta do turno atual)
-                last_human_idx = -1
-                for i, msg in enumerate(messages):
-                    if isinstance(msg, HumanMessage):
-                        last_human_idx = i
+                # Dump de TODAS as mensagens: todo turno em DEBUG, amostra dos turnos em INFO
+                if logger.isEnabledFor(logging.DEBUG) or verbose_sampled():
+                    for i, msg in enumerate(messages):
+                        has_tool_calls = bool(getattr(msg, 'tool_calls', None))
+                        content_preview = str(msg.content)[:150] if msg.content else "(vazio)"
+                        logger.info("📝 Msg[%d] type=%s tool_calls=%s content=%s",
+                                     i, type(msg).__name__, has_tool_calls, content_preview)
                 
-                # Filtrar apenas mensagens após o último HumanMessage
-                current_turn_messages = messages[last_human_idx + 1:] if last_human_idx >= 0 else messages
-                logger.info(f"🔍 Buscando resposta em {len(current_turn_messages)} msgs do turno atual (após idx {last_human_idx})")
-                
-                # Tentar pegar a última mensagem AI do turno atual que tenha conteúdo real
-                for msg in reversed(current_turn_messages):
-                    # Verificar se é AIMessage
-                    if not isinstance(msg, AIMessage):
-                        continue
-                    
-                    # Ignorar mensagens que são tool calls (não tem resposta textual)
-                    if hasattr(msg, 'tool_calls') and msg.tool_calls:
-                        logger.info(f"⏭️ Pulando AIMessage (é tool_call)")
-                        continue
-                    
-                    # Extrair conteúdo
-                    content = msg.content if isinstance(msg.content, str) else str(msg.content)
-                    
-                    # NOVO: Remover bloco <thinking>...</thinking> antes de processar
-                    # O modelo pode incluir o pensamento junto com a resposta
-                    clean_content = re.sub(r'<thinking>.*?</thinking>', '', content, flags=re.DOTALL).strip()
-                    
-                    # Se o conteúdo era APENAS thinking block, clean_content será vazio
-                    if not clean_content:
-                        logger.info(f"⏭️ Pulando AIMessage (apenas bloco <thinking>)")
-                        continue
-                    
-                    # Ignorar mensagens vazias
-                    if not clean_content.strip():
-                        logger.info(f"⏭️ Pulando AIMessage (conteúdo vazio)")
-                        continue
-                    
-                    # Ignorar mensagens que parecem ser dados estruturados
-                    if clean_content.strip().startswith(("[", "{")):
-                        logger.info(f"⏭️ Pulando AIMessage (JSON estruturado)")
-                        continue
-                    
-                    logger.info(f"✅ AIMessage selecionada: {clean_content[:100]}...")
-                    output = clean_content
-                    break
+                output = _select_response(messages)
         
         # Fallback se ainda estiver vazio
         if not output or not output.strip():
@@ -514,23 +960,24 @@ def run_agent_langgraph(telefone: str, mensagem: str) -> Dict[str, Any]:
                     tool_content = str(last_tool_msg.content)
                     logger.info(f"🔧 Usando ToolMessage como fallback: {tool_content[:100]}...")
                     
-                    # Formatar a resposta baseada no conteúdo da tool
-                    if "PRODUTOS_ENCONTRADOS" in tool_content:
-                        # É resultado de busca, formatar como resposta
-                        output = f"Deixa eu ver aqui... 📝\n\n{tool_content}\n\nQuer que eu coloque algum desses no carrinho?"
-                    else:
-                        # Outro tipo de tool, usar direto
-                        output = tool_content
+                    output = _format_tool_fallback(tool_content)
                 else:
                     # Não encontrou ToolMessage, usar fallback genérico
                     logger.warning("⚠️ Resposta vazia do LLM e nenhum ToolMessage encontrado")
+                    model_router.escalate(telefone, "resposta_vazia")
                     output = "Desculpe, não consegui processar sua solicitação. Pode repetir?"
             else:
                 output = "Desculpe, não consegui processar sua solicitação. Pode repetir?"
                 logger.warning("⚠️ Resposta vazia do LLM, usando fallback")
+                model_router.escalate(telefone, "resposta_vazia")
         
+        # Imagem já analisada: troca o conteúdo multimodal por texto no estado do grafo
+        # para não reenviar os bytes nos próximos turnos
+        if image_url:
+            _replace_image_in_state(agent, config, result, clean_message, output)
+
         logger.info("✅ Agente executado")
-        logger.info(f"💬 RESPOSTA: {output[:200]}{'...' if len(output) > 200 else ''}")
+        logger.info("💬 RESPOSTA: %.200s%s", output, "..." if len(output) > 200 else "")
         
         # 5. Salvar histórico (IA)
         if history_handler:
@@ -539,11 +986,17 @@ def run_agent_langgraph(telefone: str, mensagem: str) -> Dict[str, Any]:
             except Exception as e:
                 logger.error(f"Erro DB AI: {e}")
 
+        if recorder:
+            recorder.finish(output, model=model, input_tokens=turn_tokens[0], output_tokens=turn_tokens[1])
         return {"output": output, "error": None}
         
     except Exception as e:
         logger.error(f"Falha agente: {e}", exc_info=True)
-        return {"output": "Tive um problema técnico, tente novamente.", "error": str(e)}
+        output = "Tive um problema técnico, tente novamente."
+        model_router.escalate(telefone, "erro")
+        if recorder:
+            recorder.finish(output, error=str(e), model=settings.llm_model)
+        return {"output": output, "error": str(e)}
 
 def get_session_history(session_id: str) -> LimitedPostgresChatMessageHistory:
     return LimitedPostgresChatMessageHistory(
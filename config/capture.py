@@ -0,0 +1,299 @@
+"""
+Gravação de turnos reais para replay offline (CAPTURE_ENABLED)
+
+Cada turno do agente vira uma linha JSON em `CAPTURE_DIR/turns-AAAAMMDD.jsonl.gz`
+com: payloads do webhook que formaram o turno, mensagem enviada ao agente,
+cada chamada ao LLM (mensagem gerada, tool_calls, tokens, tamanho do
+prompt, duração), cada tool (entrada, saída, duração), resposta final,
+tokens do turno e tempo total. scripts/replay.py reexecuta esses turnos
+com modelo e tools simulados e compara os números.
+
+PII sai antes de gravar: o telefone vira um pseudônimo estável
+(hash com CAPTURE_SALT), outros telefones, CPF, e-mails, links e imagens
+inline são trocados por marcadores, e campos de cadastro (nome, endereço,
+comprovante) são removidos e também apagados do texto do mesmo turno.
+Nomes digitados livremente em outros turnos não têm como ser detectados.
+
+A limpeza, a serialização e a compressão rodam numa thread própria; o
+turno só entrega o registro bruto para a fila.
+"""
+import gzip
+import hashlib
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from config.settings import settings
+from config.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+CAPTURE_VERSION = 1
+
+# Campos de cadastro removidos (entrada de tools e payloads do UAZ)
+PII_KEYS = {
+    "cliente", "endereco", "comprovante",
+    "name", "wa_name", "wa_contactName", "pushName", "senderName", "chatName",
+    "image", "imagePreview", "profilePicUrl",
+}
+
+_JID_RE = re.compile(r"\b(\d{8,15})@(s\.whatsapp\.net|c\.us|lid|g\.us)")
+_PHONE_BR_RE = re.compile(r"(?<!\d)55\d{10,11}(?!\d)")
+_PHONE_FMT_RE = re.compile(r"(?<![\w])(?:\+?55\s?)?\(?\d{2}\)?\s?9?\d{4}[-\s]\d{4}(?!\d)")
+_CPF_RE = re.compile(r"(?<!\d)\d{3}\.\d{3}\.\d{3}-\d{2}(?!\d)")
+# Como o cliente digita: CPF ou telefone (DDD + número) só com dígitos.
+# EAN tem 8/13 dígitos; o pseudônimo (tel_...) é protegido pelo "_" antes.
+_BARE_DIGITS_RE = re.compile(r"(?<![\w.,])\d{10,11}(?!\w|[.,]\d)")
+_EMAIL_RE = re.compile(r"[\w.+-]+@(?!(?:s\.whatsapp\.net|c\.us|g\.us)\b)[\w-]+\.[\w.-]+")
+_DATA_URI_RE = re.compile(r"data:[\w/+.-]+;base64,[A-Za-z0-9+/=]+")
+_URL_RE = re.compile(r"https?://[^\s\]]+")
+
+
+class Scrubber:
+    """Remove PII de um registro de turno mantendo a estrutura."""
+
+    def __init__(self, salt: str):
+        self.salt = salt
+
+    def pseudonym(self, telefone: str) -> str:
+        digits = re.sub(r"\D", "", telefone or "")
+        if not digits:
+            return ""
+        return "tel_" + hashlib.sha256(f"{self.salt}:{digits}".encode()).hexdigest()[:10]
+
+    def text(self, value: str, secrets: List[str]) -> str:
+        for secret in secrets:
+            value = value.replace(secret, "[REMOVIDO]")
+        value = _DATA_URI_RE.sub("[IMAGEM]", value)
+        value = _URL_RE.sub("[URL]", value)
+        value = _JID_RE.sub(lambda m: f"{self.pseudonym(m.group(1))}@{m.group(2)}", value)
+        value = _EMAIL_RE.sub("[EMAIL]", value)
+        value = _CPF_RE.sub("[CPF]", value)
+        value = _PHONE_BR_RE.sub(lambda m: self.pseudonym(m.group(0)), value)
+        value = _BARE_DIGITS_RE.sub(lambda m: "[CPF]" if _is_cpf(m.group(0)) else "[TELEFONE]", value)
+        return _PHONE_FMT_RE.sub("[TELEFONE]", value)
+
+    def value(self, obj: Any, secrets: List[str]) -> Any:
+        if isinstance(obj, str):
+            return self.text(obj, secrets)
+        if isinstance(obj, dict):
+            return {k: ("[REMOVIDO]" if k in PII_KEYS and obj[k] else self.value(v, secrets)) for k, v in obj.items()}
+        if isinstance(obj, (list, tuple)):
+            return [self.value(v, secrets) for v in obj]
+        return obj
+
+    def record(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        telefone = str(record.get("telefone") or "")
+        # Valores de cadastro vistos no turno saem de todo texto do registro (maiores primeiro)
+        secrets = sorted({s for s in _collect_pii(record) if len(s) >= 4}, key=len, reverse=True)
+        digits = re.sub(r"\D", "", telefone)
+        # Telefone do turno (com ou sem o 55) vira o pseudônimo antes dos padrões genéricos
+        if digits:
+            record = _replace_exact(record, digits, self.pseudonym(digits))
+            if digits.startswith("55") and len(digits) > 11:
+                record = _replace_exact(record, digits[2:], self.pseudonym(digits))
+        return self.value(record, secrets)
+
+
+def _is_cpf(digits: str) -> bool:
+    """Dígitos verificadores de CPF (11 dígitos, não todos iguais)."""
+    if len(digits) != 11 or len(set(digits)) == 1:
+        return False
+    nums = [int(d) for d in digits]
+    for size in (9, 10):
+        check = sum(n * w for n, w in zip(nums[:size], range(size + 1, 1, -1))) * 10 % 11 % 10
+        if check != nums[size]:
+            return False
+    return True
+
+
+def _collect_pii(obj: Any) -> List[str]:
+    found: List[str] = []
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            if k in PII_KEYS and isinstance(v, str) and v.strip():
+                found.append(v.strip())
+            else:
+                found.extend(_collect_pii(v))
+    elif isinstance(obj, (list, tuple)):
+        for v in obj:
+            found.extend(_collect_pii(v))
+    return found
+
+
+def _replace_exact(obj: Any, old: str, new: str) -> Any:
+    if isinstance(obj, str):
+        return obj.replace(old, new)
+    if isinstance(obj, dict):
+        return {k: _replace_exact(v, old, new) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_replace_exact(v, old, new) for v in obj]
+    return obj
+
+
+class TurnRecorder:
+    """Acumula o que acontece num turno; `finish()` manda para gravação."""
+
+    def __init__(self, telefone: str, mensagem: str, inbound: List[Dict[str, Any]]):
+        self.telefone = telefone
+        self.mensagem = mensagem
+        self.inbound = inbound
+        self.llm_calls: List[Dict[str, Any]] = []
+        self.tool_calls: List[Dict[str, Any]] = []
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add_llm(self, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self.llm_calls.append(entry)
+
+    def add_tool(self, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self.tool_calls.append(entry)
+
+    def finish(self, output: str, error: Optional[str] = None, model: str = "",
+               input_tokens: int = 0, output_tokens: int = 0) -> None:
+        _writer.put({
+            "v": CAPTURE_VERSION,
+            "ts": datetime.fromtimestamp(self.started_at).isoformat(timespec="seconds"),
+            "telefone": self.telefone,
+            "model": model,
+            "inbound": self.inbound,
+            "mensagem": self.mensagem,
+            "llm": self.llm_calls,
+            "tools": self.tool_calls,
+            "output": output,
+            "error": error,
+            "tokens": {"input": input_tokens, "output": output_tokens},
+            "wall_ms": round((time.perf_counter() - self._t0) * 1000, 1),
+        })
+
+
+class CaptureWriter:
+    """Limpa e grava turnos em JSONL gzip (um membro gzip por lote) numa thread dedicada."""
+
+    def __init__(self, directory: str, salt: str):
+        self.directory = Path(directory)
+        self.scrubber = Scrubber(salt)
+        self._queue: "queue.SimpleQueue[Dict[str, Any]]" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.written = 0
+        self.failed = 0
+        self._pending = 0
+        self._idle = threading.Condition()
+
+    def put(self, record: Dict[str, Any]) -> None:
+        self._ensure_started()
+        with self._idle:
+            self._pending += 1
+        self._queue.put(record)
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Espera a fila esvaziar (replay/encerramento). False se estourou o tempo."""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="capture-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                lines = [json.dumps(self.scrubber.record(r), ensure_ascii=False, default=str,
+                                    separators=(",", ":")) for r in batch]
+                self.directory.mkdir(parents=True, exist_ok=True)
+                path = self.directory / f"turns-{datetime.now():%Y%m%d}.jsonl.gz"
+                # Modo append cria um membro gzip novo: arquivo válido mesmo se o processo cair
+                with gzip.open(path, "at", encoding="utf-8") as fh:
+                    fh.write("\n".join(lines) + "\n")
+                self.written += len(batch)
+            except Exception as e:
+                self.failed += len(batch)
+                logger.error(f"Falha ao gravar captura ({len(batch)} turnos): {e}")
+            with self._idle:
+                self._pending -= len(batch)
+                self._idle.notify_all()
+
+
+# ============================================
+# Payloads do webhook por telefone (até o turno começar)
+# ============================================
+
+_MAX_PHONES = 1000
+_MAX_PAYLOADS = 20
+_inbound: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+_inbound_lock = threading.Lock()
+
+_writer = CaptureWriter(settings.capture_dir, settings.capture_salt or os.urandom(16).hex())
+if settings.capture_enabled and not settings.capture_salt:
+    logger.warning("⚠️ CAPTURE_SALT vazio: pseudônimos de telefone mudam a cada reinício")
+
+
+def enabled() -> bool:
+    return settings.capture_enabled
+
+
+def note_inbound(telefone: str, payload: Dict[str, Any]) -> None:
+    """Guarda o payload do webhook para o próximo turno desse telefone."""
+    if not settings.capture_enabled:
+        return
+    with _inbound_lock:
+        pending = _inbound.setdefault(telefone, [])
+        if len(pending) < _MAX_PAYLOADS:
+            pending.append(payload)
+        _inbound.move_to_end(telefone)
+        while len(_inbound) > _MAX_PHONES:
+            _inbound.popitem(last=False)
+
+
+def start_turn(telefone: str, mensagem: str) -> Optional[TurnRecorder]:
+    """Recorder do turno (None se a captura está desligada ou o turno não foi sorteado)."""
+    if not settings.capture_enabled:
+        return None
+    with _inbound_lock:
+        inbound = _inbound.pop(telefone, [])
+    if random.random() >= settings.capture_sample_rate:
+        return None
+    return TurnRecorder(telefone, mensagem, inbound)
+
+
+def flush(timeout: float = 10.0) -> bool:
+    return _writer.flush(timeout)
+
+
+def writer_stats() -> Dict[str, Any]:
+    return {"enabled": settings.capture_enabled, "written": _writer.written, "failed": _writer.failed,
+            "dir": str(_writer.directory)}
+
+
+def read_turns(paths: List[str]) -> List[Dict[str, Any]]:
+    """Lê turnos gravados (.jsonl.gz ou .jsonl) na ordem dos arquivos."""
+    turns = []
+    for path in paths:
+        opener = gzip.open if str(path).endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as fh:
+            for line in fh:
+                if line.strip():
+                    turns.append(json.loads(line))
+    return turns
@@ -1,50 +1,63 @@
 """
 Sistema de Logging para o Agente de Supermercado
+
+Os loggers dos módulos só enfileiram o registro (QueueHandler). Uma única
+thread (QueueListener) por arquivo de log faz a formatação e as escritas
+(JSON com rotação, texto legível com rotação e console), então a
+requisição não espera disco nem stdout.
 """
+import atexit
 import logging
+import queue
+import random
 import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
+from typing import Dict, Optional, Tuple
+
 from pythonjsonlogger import jsonlogger
 
+from config.settings import settings
+
+# Um par (fila, listener) por arquivo de log
+_pipelines: Dict[str, Tuple[QueueHandler, QueueListener]] = {}
+_pipelines_lock = threading.Lock()
 
-def setup_logger(name: str, log_file: str = "logs/agente.log", level: str = "INFO") -> logging.Logger:
+
+class _LazyQueueHandler(QueueHandler):
     """
-    Configura e retorna um logger com formatação JSON e saída para arquivo e console
-    
-    Args:
-        name: Nome do logger
-        log_file: Caminho do arquivo de log
-        level: Nível de logging (DEBUG, INFO, WARNING, ERROR, CRITICAL)
-    
-    Returns:
-        Logger configurado
+    Enfileira o registro sem formatar: a mensagem (%-args) e o traceback só
+    são montados na thread do listener. Apenas `exc_info` vira texto aqui,
+    porque o traceback não sobrevive à troca de thread com segurança.
     """
-    # Criar diretório de logs se não existir
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _build_pipeline(log_file: str) -> Tuple[QueueHandler, QueueListener]:
     log_path = Path(log_file)
     log_path.parent.mkdir(parents=True, exist_ok=True)
-    
-    # Criar logger
-    logger = logging.getLogger(name)
-    logger.setLevel(getattr(logging, level.upper()))
-    
-    # Evitar duplicação de handlers
-    if logger.handlers:
-        return logger
-    
+
     # Formato JSON para arquivo
     json_formatter = jsonlogger.JsonFormatter(
         '%(asctime)s %(name)s %(levelname)s %(message)s',
         datefmt='%Y-%m-%d %H:%M:%S'
     )
-    
+
     # Formato legível para console
     console_formatter = logging.Formatter(
         '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
         datefmt='%Y-%m-%d %H:%M:%S'
     )
-    
-    # Handler para arquivo (JSON)
-    file_handler = logging.FileHandler(log_file, encoding='utf-8')
+
+    # Handler para arquivo (JSON) com rotação
+    file_handler = RotatingFileHandler(log_file, maxBytes=settings.log_max_bytes,
+                                       backupCount=settings.log_backup_count, encoding='utf-8')
     file_handler.setLevel(logging.DEBUG)
     file_handler.setFormatter(json_formatter)
 
@@ -54,18 +67,64 @@ def setup_logger(name: str, log_file: str = "logs/agente.log", level: str = "INF
     console_handler.setFormatter(console_formatter)
 
     # Handler adicional para arquivo em texto legível
-    plain_file = Path(log_file).with_name("agente_plain.log")
-    plain_file_handler = logging.FileHandler(str(plain_file), encoding='utf-8')
+    plain_file = log_path.with_name("agente_plain.log")
+    plain_file_handler = RotatingFileHandler(str(plain_file), maxBytes=settings.log_max_bytes,
+                                             backupCount=settings.log_backup_count, encoding='utf-8')
     plain_file_handler.setLevel(logging.DEBUG)
     plain_file_handler.setFormatter(console_formatter)
-    
-    # Adicionar handlers
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
-    logger.addHandler(plain_file_handler)
-    
+
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    listener = QueueListener(log_queue, file_handler, console_handler, plain_file_handler,
+                             respect_handler_level=True)
+    listener.start()
+    return _LazyQueueHandler(log_queue), listener
+
+
+@atexit.register
+def _stop_listeners() -> None:
+    """Esvazia as filas ao encerrar o processo."""
+    for _, listener in list(_pipelines.values()):
+        if listener._thread is not None:
+            listener.stop()
+
+
+def setup_logger(name: str, log_file: str = "logs/agente.log", level: Optional[str] = None) -> logging.Logger:
+    """
+    Configura e retorna um logger com formatação JSON e saída para arquivo e console
+
+    Args:
+        name: Nome do logger
+        log_file: Caminho do arquivo de log
+        level: Nível de logging (DEBUG, INFO, WARNING, ERROR, CRITICAL); padrão LOG_LEVEL
+
+    Returns:
+        Logger configurado
+    """
+    # Criar logger
+    logger = logging.getLogger(name)
+    logger.setLevel(getattr(logging, (level or settings.log_level).upper(), logging.INFO))
+
+    # Evitar duplicação de handlers
+    if logger.handlers:
+        return logger
+
+    with _pipelines_lock:
+        if log_file not in _pipelines:
+            _pipelines[log_file] = _build_pipeline(log_file)
+        queue_handler, _ = _pipelines[log_file]
+
+    logger.addHandler(queue_handler)
     return logger
 
 
+def verbose_sampled() -> bool:
+    """
+    Sorteio para logs detalhados por mensagem (LOG_VERBOSE_SAMPLE_RATE):
+    decide uma vez por turno se o dump completo vai para o log em INFO
+    (com LOG_LEVEL=DEBUG o dump sai em todo turno).
+    """
+    return random.random() < settings.log_verbose_sample_rate
+
+
 # Logger principal da aplicação
 app_logger = setup_logger("agente_supermercado")
@@ -0,0 +1,184 @@
+"""
+Métricas Prometheus do agente (exportadas em /metrics)
+
+- Histogramas: mensagem -> resposta, espera do buffer, cada chamada ao
+  LLM, cada tool (por nome e resultado), chamadas HTTP externas (por
+  upstream e status) e chamadas ao Gemini.
+- Passos por turno (LLM/tools) e turnos encerrados por cada orçamento
+  (AGENT_MAX_*).
+- Turnos, duração e custo por camada de modelo (fast/strong).
+- Turnos por fase do pedido (conjunto de tools exposto ao LLM).
+- Hedging/failover entre provedores de LLM e saúde de cada um.
+- Contadores de tokens e custo por modelo; preços em USD por 1M tokens
+  vêm de LLM_PRICING_PATH (config/pricing.json), não do código.
+- Gauges (hit ratio dos caches, filas, conversas ativas) são atualizados
+  na hora da coleta por `register_cache` / `on_scrape`.
+
+Sem `prometheus_client` instalado as métricas viram no-op e /metrics
+avisa que o exportador está indisponível.
+"""
+import json
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+from config.settings import settings
+from config.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+try:
+    from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+    PROMETHEUS_AVAILABLE = True
+except ImportError:  # pragma: no cover - dependência opcional
+    PROMETHEUS_AVAILABLE = False
+    CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _NoopMetric:
+    """Substituto quando prometheus_client não está instalado."""
+
+    def labels(self, *args: Any, **kwargs: Any) -> "_NoopMetric":
+        return self
+
+    def observe(self, value: float) -> None:
+        pass
+
+    def inc(self, amount: float = 1) -> None:
+        pass
+
+    def set(self, value: float) -> None:
+        pass
+
+
+def _histogram(name: str, doc: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = ()) -> Any:
+    if not PROMETHEUS_AVAILABLE:
+        return _NoopMetric()
+    kwargs = {"buckets": buckets} if buckets else {}
+    return Histogram(name, doc, labels, **kwargs)
+
+
+def _counter(name: str, doc: str, labels: Tuple[str, ...] = ()) -> Any:
+    return Counter(name, doc, labels) if PROMETHEUS_AVAILABLE else _NoopMetric()
+
+
+def _gauge(name: str, doc: str, labels: Tuple[str, ...] = ()) -> Any:
+    return Gauge(name, doc, labels) if PROMETHEUS_AVAILABLE else _NoopMetric()
+
+
+# Faixas em segundos (o buffer sozinho já segura ~15s)
+_TURN_BUCKETS = (1, 2, 5, 10, 15, 20, 25, 30, 45, 60, 90, 120)
+_STEP_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30)
+
+TURN_LATENCY = _histogram("agent_turn_latency_seconds",
+                          "Primeira mensagem do lote recebida -> resposta entregue", buckets=_TURN_BUCKETS)
+BUFFER_WAIT = _histogram("buffer_wait_seconds", "Espera do buffer por novas mensagens", buckets=_TURN_BUCKETS)
+LLM_LATENCY = _histogram("llm_step_seconds", "Duração de cada chamada ao LLM", ("model",), _STEP_BUCKETS)
+TOOL_LATENCY = _histogram("tool_call_seconds", "Duração de cada tool do agente", ("tool", "status"), _STEP_BUCKETS)
+UPSTREAM_LATENCY = _histogram("upstream_request_seconds", "Chamadas HTTP externas",
+                              ("upstream", "status"), _STEP_BUCKETS)
+GEMINI_LATENCY = _histogram("gemini_request_seconds", "Chamadas ao Gemini (SDK/REST)", ("op", "status"), _STEP_BUCKETS)
+
+TURN_STEPS = _histogram("agent_turn_steps", "Chamadas ao LLM / tools por turno", ("kind",),
+                        (1, 2, 3, 4, 5, 6, 8, 10, 12, 15, 20))
+BUDGET_EXHAUSTED = _counter("agent_budget_exhausted_total", "Turnos encerrados por orçamento", ("budget",))
+
+TIER_TURNS = _counter("agent_tier_turns_total", "Turnos por camada de modelo e motivo da escolha", ("tier", "reason"))
+TIER_LATENCY = _histogram("agent_tier_turn_seconds", "Execução do agente por camada de modelo", ("tier",),
+                          _TURN_BUCKETS)
+TIER_COST = _counter("agent_tier_cost_usd_total", "Custo estimado em USD por camada de modelo", ("tier",))
+
+TOOL_PHASE = _counter("agent_tool_phase_total", "Chamadas ao LLM por fase do pedido (tools expostas)", ("phase",))
+
+LLM_HEDGE = _counter("llm_hedge_total", "Requisições de backup ao LLM e quem respondeu primeiro", ("result",))
+LLM_FAILOVER = _counter("llm_failover_total", "Chamadas desviadas do provedor principal", ("provider", "reason"))
+LLM_PROVIDER_HEALTH = _gauge("llm_provider_health", "Taxa de sucesso recente por provedor/modelo", ("provider",))
+
+LLM_TOKENS = _counter("llm_tokens_total", "Tokens consumidos", ("model", "kind"))
+LLM_COST = _counter("llm_cost_usd_total", "Custo estimado em USD", ("model",))
+
+CACHE_HIT_RATIO = _gauge("cache_hit_ratio", "Acertos / consultas por cache", ("cache",))
+CACHE_SIZE = _gauge("cache_items", "Itens em cada cache", ("cache",))
+QUEUE_DEPTH = _gauge("queue_depth", "Itens aguardando em filas internas", ("queue",))
+ACTIVE_CONVERSATIONS = _gauge("active_conversations", "Clientes com buffer/turno em andamento")
+
+
+# ============================================
+# Gauges atualizados na coleta
+# ============================================
+
+_caches: Dict[str, Any] = {}
+_scrape_hooks: List[Callable[[], None]] = []
+
+
+def register_cache(name: str, cache: Any) -> None:
+    """Exporta hit ratio e tamanho de um cache com `stats()` (ex: TTLCache)."""
+    _caches[name] = cache
+
+
+def on_scrape(fn: Callable[[], None]) -> None:
+    """Registra função chamada a cada coleta (para atualizar gauges)."""
+    _scrape_hooks.append(fn)
+
+
+def render() -> Tuple[bytes, str]:
+    """Corpo e content-type do /metrics."""
+    if not PROMETHEUS_AVAILABLE:
+        return b"# prometheus_client nao instalado\n", CONTENT_TYPE_LATEST
+    for name, cache in list(_caches.items()):
+        stats = cache.stats()
+        CACHE_HIT_RATIO.labels(name).set(stats.get("hit_ratio", 0.0))
+        CACHE_SIZE.labels(name).set(stats.get("size", 0))
+    for fn in list(_scrape_hooks):
+        try:
+            fn()
+        except Exception as e:
+            logger.warning(f"Falha ao atualizar métricas ({getattr(fn, '__name__', fn)}): {e}")
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+# ============================================
+# Tokens e custo
+# ============================================
+
+_pricing: Dict[str, Dict[str, float]] = {}
+_pricing_lock = threading.Lock()
+
+
+def load_pricing() -> Dict[str, Dict[str, float]]:
+    """Preços por modelo (USD por 1M tokens), lidos uma vez de LLM_PRICING_PATH."""
+    global _pricing
+    if not _pricing:
+        with _pricing_lock:
+            if not _pricing:
+                path = Path(settings.llm_pricing_path)
+                if not path.is_absolute():
+                    path = Path(__file__).resolve().parent.parent / path
+                try:
+                    _pricing = json.loads(path.read_text(encoding="utf-8"))
+                except Exception as e:
+                    logger.error(f"Tabela de preços indisponível ({path}): {e}")
+                    _pricing = {"default": {"input": 0.0, "output": 0.0}}
+    return _pricing
+
+
+def price_for(model: str) -> Dict[str, float]:
+    """Preço do modelo: nome exato, maior prefixo conhecido ou `default`."""
+    pricing = load_pricing()
+    if model in pricing:
+        return pricing[model]
+    prefixes = [name for name in pricing if model.startswith(name)]
+    if prefixes:
+        return pricing[max(prefixes, key=len)]
+    return pricing.get("default", {"input": 0.0, "output": 0.0})
+
+
+def record_tokens(model: str, input_tokens: int, output_tokens: int) -> Tuple[float, float]:
+    """Soma tokens e custo do modelo; retorna (custo_input, custo_output) em USD."""
+    price = price_for(model)
+    input_cost = input_tokens / 1_000_000 * price.get("input", 0.0)
+    output_cost = output_tokens / 1_000_000 * price.get("output", 0.0)
+    LLM_TOKENS.labels(model, "input").inc(input_tokens)
+    LLM_TOKENS.labels(model, "output").inc(output_tokens)
+    LLM_COST.labels(model).inc(input_cost + output_cost)
+    return input_cost, output_cost
@@ -21,6 +21,36 @@ class Settings(BaseSettings):
     llm_model: str = "gemini-2.0-flash-lite"
     llm_temperature: float = 0.0
     llm_provider: str = "google"
+    openai_base_url: Optional[str] = None  # Endpoint compatível com OpenAI (proxy, modelo local, loadtest)
+    # Camada rápida/barata para turnos simples (vazio = todo turno usa LLM_MODEL)
+    llm_fast_model: Optional[str] = None
+    llm_fast_provider: Optional[str] = None  # Padrão: LLM_PROVIDER
+    llm_fast_max_chars: int = 240            # Mensagens maiores vão para o modelo forte
+    llm_fast_max_cart_items: int = 12        # Carrinhos maiores vão para o modelo forte
+    # Provedor secundário: hedging (backup se o principal passar do p95) e failover
+    llm_fallback_provider: Optional[str] = None  # google/openai; vazio = sem secundário
+    llm_fallback_model: Optional[str] = None
+    llm_hedge_enabled: bool = True
+    llm_hedge_min_delay: float = 1.5         # Limites do atraso antes do backup (s)
+    llm_hedge_max_delay: float = 12.0
+    llm_health_window: int = 50              # Chamadas consideradas na saúde do provedor
+    llm_failover_min_score: float = 0.6      # Abaixo disso o secundário passa a ser o principal
+    llm_hedge_workers: int = 32              # Chamadas simultâneas ao LLM (principal + backup); ~2x turnos simultâneos
+    # Cliente Gemini compartilhado (transcrição, File Search, chat)
+    gemini_api_base_url: str = "https://generativelanguage.googleapis.com/v1beta"
+    gemini_max_concurrency: int = 8        # Chamadas simultâneas ao Gemini (transcrição, File Search)
+    gemini_chat_max_concurrency: int = 16  # Chamadas simultâneas do modelo de chat (limite separado)
+    gemini_max_retries: int = 3            # Retries em 429/503
+    gemini_backoff_base: float = 0.5
+    gemini_backoff_max: float = 8.0
+    gemini_timeout: float = 30.0
+    # Orçamento por turno do agente: ao estourar, encerra com a melhor resposta parcial
+    agent_max_llm_calls: int = 8
+    agent_max_tool_calls: int = 12
+    agent_max_turn_seconds: float = 90.0
+    agent_max_turn_tokens: int = 60000
+    # Tools por fase do pedido (navegando / montando / enviado) com descrições curtas
+    agent_phase_tools: bool = True
     moonshot_api_key: Optional[str] = None
     moonshot_api_url: str = "https://api.moonshot.ai/anthropic"
     
@@ -34,6 +64,23 @@ class Settings(BaseSettings):
     redis_port: int = 6379
     redis_password: Optional[str] = None
     redis_db: int = 0
+    redis_max_connections: int = 20
+    redis_connect_timeout: float = 2.0
+    redis_socket_timeout: float = 2.0
+    redis_health_check_interval: int = 30      # PING em conexões ociosas antes de reutilizar
+    redis_breaker_threshold: int = 3           # Falhas seguidas para abrir o circuit breaker
+    redis_reconnect_backoff_base: float = 1.0  # 1s, 2s, 4s... até o máximo
+    redis_reconnect_backoff_max: float = 60.0
+    local_store_max_keys: int = 5000           # Fallback em memória (Redis fora): limite de chaves
+    local_store_max_bytes: int = 16 * 1024 * 1024
+
+    # Outbox de pedidos (envio ao painel em background)
+    order_outbox_poll_interval: float = 2.0
+    order_submit_timeout: float = 10.0
+    order_max_attempts: int = 8
+    order_retry_backoff_base: float = 5.0      # 5s, 10s, 20s... até o máximo
+    order_retry_backoff_max: float = 300.0
+    order_lease_seconds: int = 60              # Reserva do pedido por um worker
     
     # API do Supermercado
     supermercado_base_url: str
@@ -48,6 +95,11 @@ class Settings(BaseSettings):
     smart_responder_auth: str = ""
     smart_responder_apikey: str = ""
     pre_resolver_enabled: bool = False
+
+    # Busca de produtos: cache por chave canônica (tools/normalizer.py)
+    product_catalog_path: str = ""             # JSON [{ean, nome, sinonimos}] para atalho local
+    search_cache_size: int = 1024
+    search_cache_ttl: int = 600
     
     # WhatsApp / UAZ API
     # WHATSAPP_API_URL mantido para compatibilidade, mas UAZ_API_URL tem prioridade
@@ -60,6 +112,32 @@ class Settings(BaseSettings):
     
     # Human Takeover - Tempo de pausa quando atendente humano assume (em segundos)
     human_takeover_ttl: int = 900  # 15 minutos padrão
+
+    # Atrasos "humanos" (em segundos) - agendados, não seguram threads
+    # Leitura: o agente já roda durante esse tempo; só o restante é esperado
+    human_read_delay_min: float = 2.0
+    human_read_delay_max: float = 4.0
+    human_send_pause: float = 0.5          # Pausa após parar de "digitar"
+    human_chunk_delay_min: float = 0.8     # Intervalo entre blocos de mensagem
+    human_chunk_delay_max: float = 1.5
+
+    # Buffer de mensagens: espera novas mensagens em ciclos de N segundos e
+    # processa após M ciclos sem novidade (padrão: 3 x 5s = 15s)
+    buffer_poll_interval: float = 5.0
+    buffer_stall_cycles: int = 3
+
+    # Pipeline de mídia (PDF/áudio/imagem) - roda fora da requisição do webhook
+    media_workers: int = 4                 # Threads para download/links
+    media_pdf_processes: int = 2           # Processos para extrair texto de PDF
+    media_pdf_max_pages: int = 3           # Só as N primeiras páginas
+    media_pdf_timeout: float = 20.0
+    media_max_bytes: int = 10 * 1024 * 1024
+    media_cache_size: int = 256            # Itens por cache (por message_id)
+    media_cache_ttl: int = 3600
+    image_max_side: int = 1024             # Lado máximo (px) da imagem enviada à visão
+    image_jpeg_quality: int = 80
+    audio_workers: int = 2                 # Transcrições simultâneas (pool limitado)
+    transcription_model: str = "gemini-2.0-flash-lite"
     
     # Servidor
     server_host: str = "0.0.0.0"
@@ -69,6 +147,24 @@ class Settings(BaseSettings):
     # Logging
     log_level: str = "INFO"
     log_file: str = "logs/agente.log"
+    log_max_bytes: int = 10 * 1024 * 1024   # Rotação dos arquivos de log
+    log_backup_count: int = 5
+    log_verbose_sample_rate: float = 0.1    # Fração dos turnos com dump completo das mensagens (INFO; todos em DEBUG)
+
+    # Tracing (spans por turno, exportados em JSONL no formato do OpenTelemetry)
+    tracing_enabled: bool = True
+    tracing_export_path: str = "logs/traces.jsonl"
+    tracing_sample_rate: float = 1.0       # Fração de turnos rastreados
+    tracing_queue_size: int = 10000        # Spans à espera do exportador; acima disso são descartados
+
+    # Métricas (/metrics): preços por modelo em USD por 1M tokens
+    llm_pricing_path: str = "config/pricing.json"
+
+    # Captura de turnos reais (com PII removida) para replay offline
+    capture_enabled: bool = False
+    capture_dir: str = "logs/captures"
+    capture_sample_rate: float = 1.0       # Fração dos turnos gravados
+    capture_salt: str = ""                 # Sal do pseudônimo de telefone (fixo = estável entre reinícios)
     
     agent_prompt_path: str | None = "prompts/agent_system_optimized.md"
 
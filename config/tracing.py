@@ -0,0 +1,287 @@
+"""
+Tracing leve por turno (compatível com o modelo do OpenTelemetry)
+
+- `span(...)` abre um span filho do span atual (contextvars). Sem trace
+  ativo não registra nada: Redis/HTTP fora de um turno não geram ruído.
+- `span(..., root=True)` inicia um trace novo (webhook); a amostragem
+  (TRACING_SAMPLE_RATE) é decidida aqui e herdada pelos filhos.
+- Threads não herdam contextvars: use `wrap(fn)` ao entregar trabalho
+  para Thread/ThreadPoolExecutor/scheduler, ou `attach(span)`.
+- Spans finalizados vão para um JSONL local (TRACING_EXPORT_PATH) com os
+  nomes de campo do OTLP (traceId, spanId, parentSpanId, *UnixNano),
+  escrito por uma thread própria (sem I/O no caminho da requisição) e
+  rotacionado como os logs (LOG_MAX_BYTES, LOG_BACKUP_COUNT).
+"""
+import functools
+import json
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Optional, TypeVar
+
+from config.settings import settings
+from config.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+SERVICE_NAME = "agente-supermercado"
+
+
+class Span:
+    """Um trecho cronometrado de um trace."""
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attributes",
+                 "start_ns", "end_ns", "_t0", "status", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None, **attributes: Any):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes: Dict[str, Any] = dict(attributes)
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self._t0 = time.perf_counter()
+        self.status = "OK"
+        self.error: Optional[str] = None
+
+    @property
+    def recording(self) -> bool:
+        return True
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def child(self, name: str, **attributes: Any) -> "Span":
+        return Span(name, self.trace_id, self.span_id, **attributes)
+
+    def fail(self, error: BaseException) -> None:
+        self.status = "ERROR"
+        self.error = f"{type(error).__name__}: {error}"[:300]
+
+    def end(self) -> None:
+        if self.end_ns is not None:
+            return
+        duration = time.perf_counter() - self._t0
+        self.end_ns = self.start_ns + int(duration * 1e9)
+        _exporter.export(self)
+        if self.parent_id is None:
+            logger.info(f"🧭 Trace {self.trace_id[:8]} '{self.name}' {duration * 1000:.0f}ms")
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "durationMs": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "status": self.status,
+            "service": SERVICE_NAME,
+            "attributes": self.attributes,
+        }
+        if self.error:
+            data["error"] = self.error
+        return data
+
+
+class _NoopSpan:
+    """Span de trace não amostrado/desligado: filhos também não registram."""
+
+    recording = False
+    trace_id = ""
+    span_id = ""
+
+    def set(self, **attributes: Any) -> None:
+        pass
+
+    def child(self, name: str, **attributes: Any) -> "_NoopSpan":
+        return self
+
+    def fail(self, error: BaseException) -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+_current: ContextVar[Optional[Any]] = ContextVar("trace_span", default=None)
+
+
+class JsonlExporter:
+    """Grava spans finalizados em JSONL (com rotação) a partir de uma thread dedicada."""
+
+    def __init__(self, path: str, max_bytes: int = 0, backup_count: int = 0, queue_size: int = 10000):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        # Fila limitada: exportador lento ou parado não acumula spans sem fim
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.exported = 0
+        self.dropped = 0
+
+    def export(self, span: Span) -> None:
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(span.to_dict())
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+
+    def _rotate(self) -> None:
+        """traces.jsonl -> .1 -> .2 ... (mesmo esquema do RotatingFileHandler)."""
+        if self.backup_count <= 0:
+            self.path.unlink(missing_ok=True)
+            return
+        for i in range(self.backup_count - 1, 0, -1):
+            src = self.path.with_name(f"{self.path.name}.{i}")
+            if src.exists():
+                src.replace(self.path.with_name(f"{self.path.name}.{i + 1}"))
+        self.path.replace(self.path.with_name(f"{self.path.name}.1"))
+
+    def _drain(self) -> None:
+        """Modo descarte: consome a fila só contando, para não crescer nem travar quem exporta."""
+        while True:
+            self._queue.get()
+            self.dropped += 1
+
+    def _run(self) -> None:
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fh = open(self.path, "a", encoding="utf-8")
+        except OSError as e:
+            logger.error(f"Exportador de traces desativado ({self.path}): {e}")
+            self._drain()
+        try:
+            while True:
+                item = self._queue.get()
+                # Escreve o que estiver acumulado de uma vez e dá flush
+                while True:
+                    fh.write(json.dumps(item, ensure_ascii=False, default=str, separators=(",", ":")) + "\n")
+                    self.exported += 1
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                fh.flush()
+                if self.max_bytes and fh.tell() >= self.max_bytes:
+                    fh.close()
+                    try:
+                        self._rotate()
+                    except OSError as e:
+                        logger.error(f"Falha ao rotacionar traces ({self.path}): {e}")
+                    fh = open(self.path, "a", encoding="utf-8")
+        except OSError as e:
+            # Disco cheio, permissão, reabertura após rotação: a thread segue viva descartando
+            logger.error(f"Exportador de traces desativado ({self.path}): {e}")
+            try:
+                fh.close()
+            except OSError:
+                pass
+            self._drain()
+
+
+_exporter = JsonlExporter(settings.tracing_export_path, settings.log_max_bytes, settings.log_backup_count,
+                          settings.tracing_queue_size)
+
+
+def current_span() -> Optional[Any]:
+    """Span ativo no contexto atual (None fora de um trace)."""
+    return _current.get()
+
+
+def start_span(name: str, parent: Optional[Any] = None, root: bool = False, **attributes: Any) -> Any:
+    """
+    Cria um span sem torná-lo o atual (para callbacks com início/fim separados).
+    Chame `.end()` ao terminar.
+    """
+    parent = parent if parent is not None else _current.get()
+    if parent is not None and not root:
+        return parent.child(name, **attributes)
+    if not root or not settings.tracing_enabled or random.random() >= settings.tracing_sample_rate:
+        return NOOP_SPAN
+    return Span(name, os.urandom(16).hex(), None, **attributes)
+
+
+@contextmanager
+def span(name: str, root: bool = False, parent: Optional[Any] = None, **attributes: Any) -> Iterator[Any]:
+    """Abre um span (filho do atual, ou raiz com `root=True`) enquanto durar o bloco."""
+    sp = start_span(name, parent=parent, root=root, **attributes)
+    token = _current.set(sp)
+    try:
+        yield sp
+    except BaseException as e:
+        sp.fail(e)
+        raise
+    finally:
+        _current.reset(token)
+        sp.end()
+
+
+@contextmanager
+def attach(sp: Optional[Any]) -> Iterator[Any]:
+    """Torna `sp` o span atual (propagação explícita para outra thread)."""
+    token = _current.set(sp)
+    try:
+        yield sp
+    finally:
+        _current.reset(token)
+
+
+def set_current(sp: Optional[Any]) -> Token:
+    """Ativa `sp` sem bloco `with` (ex: callbacks com início/fim separados)."""
+    return _current.set(sp)
+
+
+def reset_current(token: Token) -> None:
+    """Desfaz `set_current` (precisa rodar no mesmo contexto)."""
+    _current.reset(token)
+
+
+def wrap(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """Captura o span atual e o reativa quando `fn` rodar em outra thread."""
+    sp = _current.get()
+    if sp is None:
+        return fn
+
+    @functools.wraps(fn)
+    def _run(*args: Any, **kwargs: Any) -> Any:
+        with attach(sp):
+            return fn(*args, **kwargs)
+    return _run
+
+
+def traced(name: str) -> Callable[[F], F]:
+    """Decorator: span filho em volta da função (só dentro de um trace ativo)."""
+    def decorator(fn: F) -> F:
+        @functools.wraps(fn)
+        def _run(*args: Any, **kwargs: Any) -> Any:
+            if _current.get() is None:
+                return fn(*args, **kwargs)
+            with span(name):
+                return fn(*args, **kwargs)
+        return _run  # type: ignore[return-value]
+    return decorator
+
+
+def exporter_stats() -> Dict[str, int]:
+    return {"exported": _exporter.exported, "dropped": _exporter.dropped}
@@ -4,6 +4,7 @@ import logging
 from langchain_community.chat_message_histories import PostgresChatMessageHistory
 from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
 from langchain_core.chat_history import BaseChatMessageHistory
+from config import tracing
 try:
     import psycopg2
     import psycopg2.extras
@@ -15,6 +16,12 @@ except ImportError:
 # Configurar logger
 logger = logging.getLogger(__name__)
 
+# Frases do agente que indicam que ele se perdeu na conversa
+CONFUSION_PATTERNS = (
+    "não identifiquei", "não consegui identificar",
+    "informar o nome principal", "desculpe, não", "pode informar",
+)
+
 class LimitedPostgresChatMessageHistory(BaseChatMessageHistory):
     """
     Histórico de chat PostgreSQL que armazena todas as mensagens mas
@@ -53,6 +60,7 @@ class LimitedPostgresChatMessageHistory(BaseChatMessageHistory):
         """Obtém mensagens (contexto otimizado)."""
         return self.get_optimized_context()
     
+    @tracing.traced("postgres.add_message")
     def add_message(self, message: BaseMessage) -> None:
         """
         Adiciona uma mensagem ao banco de dados com SQL manual e COMMIT explícito.
@@ -106,6 +114,7 @@ class LimitedPostgresChatMessageHistory(BaseChatMessageHistory):
             except Exception as e:
                 logger.error(f"Erro ao limpar histórico: {e}")
     
+    @tracing.traced("postgres.get_context")
     def get_optimized_context(self) -> List[BaseMessage]:
         """
         Obtém contexto otimizado lendo diretamente do banco.
@@ -166,13 +175,8 @@ class LimitedPostgresChatMessageHistory(BaseChatMessageHistory):
         if len(recent_messages) < 3:
             return False
         
-        confusion_patterns = [
-            "não identifiquei", "não consegui identificar", 
-            "informar o nome principal", "desculpe, não", "pode informar"
-        ]
-        
         recent_text = " ".join([msg.content.lower() for msg in recent_messages[-3:]])
-        confusion_count = sum(1 for pattern in confusion_patterns if pattern in recent_text)
+        confusion_count = sum(1 for pattern in CONFUSION_PATTERNS if pattern in recent_text)
         
         return confusion_count >= 2
 
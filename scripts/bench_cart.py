@@ -0,0 +1,96 @@
+"""
+Microbenchmark do carrinho no Redis: sequência antiga (lista de JSON,
+vários comandos) vs. hash + índice com scripts Lua atômicos (uma ida ao
+Redis por operação, totais mantidos no servidor).
+
+Uso:
+  python scripts/bench_cart.py            # 500 adições + 500 remoções
+  python scripts/bench_cart.py 2000
+
+Requer um Redis acessível (REDIS_HOST/REDIS_PORT do .env ou do ambiente).
+Usa telefones fictícios (bench:*) e limpa as chaves ao final.
+"""
+import os
+import sys
+import json
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+# Settings exige estas variáveis; valores fictícios bastam para o benchmark
+for _k in ("POSTGRES_CONNECTION_STRING", "SUPERMERCADO_BASE_URL", "SUPERMERCADO_AUTH_TOKEN", "WHATSAPP_TOKEN"):
+    os.environ.setdefault(_k, "bench")
+
+from tools import redis_tools as rt  # noqa: E402
+
+ITEM = json.dumps({"produto": "ARROZ TIPO 1 5KG", "quantidade": 2, "observacao": "", "preco": 27.9}, ensure_ascii=False)
+
+
+def legacy_cart_key(telefone: str) -> str:
+    """Carrinho antigo: lista de JSON."""
+    return f"cart:{telefone}"
+
+
+def legacy_add(client, telefone: str) -> None:
+    """Sequência anterior: GET sessão -> (SET) -> RPUSH -> EXPIRE -> GET -> EXPIRE."""
+    skey, ckey = rt.order_session_key(telefone), legacy_cart_key(telefone)
+    raw = client.get(skey)
+    session = json.loads(raw) if raw else None
+    if not session or session.get("status") != "building":
+        client.set(skey, rt._new_session_json(), ex=rt.SESSION_TTL)
+    client.rpush(ckey, ITEM)
+    client.expire(ckey, rt.SESSION_TTL)
+    raw = client.get(skey)
+    if raw and json.loads(raw).get("status") == "building":
+        client.expire(skey, rt.SESSION_TTL)
+
+
+def legacy_remove(client, telefone: str) -> None:
+    """Sequência anterior: LRANGE -> LSET -> LREM (não atômica)."""
+    key = legacy_cart_key(telefone)
+    items = client.lrange(key, 0, -1)
+    if items:
+        client.lset(key, 0, "__DELETED__")
+        client.lrem(key, 0, "__DELETED__")
+
+
+def _timeit(label: str, fn, n: int) -> float:
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {n:>6} ops  {elapsed:8.3f}s  {elapsed / n * 1000:7.3f} ms/op")
+    return elapsed
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    client = rt.get_redis_client()
+    if client is None:
+        print("Redis indisponível. Configure REDIS_HOST/REDIS_PORT.")
+        sys.exit(1)
+
+    tel_old, tel_new = "bench:legacy", "bench:lua"
+    keys = [rt.order_session_key(t) for t in (tel_old, tel_new)] + [
+        legacy_cart_key(tel_old), rt.cart_key(tel_new), rt.cart_index_key(tel_new)]
+    client.delete(*keys)
+
+    try:
+        print(f"Redis {client.connection_pool.connection_kwargs.get('host')}:{client.connection_pool.connection_kwargs.get('port')}")
+        old_add = _timeit("add (sequência antiga)", lambda: legacy_add(client, tel_old), n)
+        # Produtos distintos para não mesclar tudo numa linha só
+        seq = iter(range(n))
+        new_add = _timeit("add (script Lua)", lambda: rt.add_item_to_cart(
+            tel_new, f"ARROZ TIPO 1 5KG #{next(seq)}", quantidade=2, preco=27.9), n)
+        _timeit("view antigo (LRANGE+soma)", lambda: sum(
+            json.loads(r)["preco"] * json.loads(r)["quantidade"] for r in client.lrange(legacy_cart_key(tel_old), 0, -1)), 50)
+        _timeit("view novo (HGETALL)", lambda: rt.get_cart(tel_new), 50)
+        old_rm = _timeit("remove (sequência antiga)", lambda: legacy_remove(client, tel_old), n)
+        new_rm = _timeit("remove (script Lua)", lambda: rt.remove_item_from_cart(tel_new, 0), n)
+        print(f"\nSpeedup add: {old_add / new_add:.2f}x | remove: {old_rm / new_rm:.2f}x")
+    finally:
+        client.delete(*keys)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+Microbenchmarks das rotinas puramente Python que rodam em todo turno,
+com fixtures no formato real (webhooks UAZ, respostas do smart-responder
+e da API de estoque, mensagens de um turno do agente):
+
+  extract_incoming   server._extract_incoming (JID -> telefone, tipo de mídia)
+  split_message      server._split_message (blocos de 500 chars do envio)
+  ean_walk_score     parse do payload do smart-responder + ranking (ean_lookup)
+  estoque_sanitize   itens da API de estoque -> StockItem -> JSON (estoque_preco)
+  load_prompt        load_system_prompt (arquivo + dicionário da KB)
+  select_response    escolha da resposta do turno (run_agent_langgraph)
+
+Cada caso roda em repetições de `timeit` e reporta o melhor tempo por
+chamada. `--save` acrescenta o resultado (com commit e data) ao histórico
+JSONL; `--compare` compara com a última entrada do histórico e sai com
+código 1 se algum caso ficou mais lento que a tolerância.
+
+Uso:
+  python scripts/bench_hotpaths.py                      # todos os casos
+  python scripts/bench_hotpaths.py split_message ean_walk_score
+  python scripts/bench_hotpaths.py --save               # grava no histórico
+  python scripts/bench_hotpaths.py --compare --tolerance 0.2
+"""
+import os
+import sys
+import json
+import random
+import argparse
+import datetime
+import subprocess
+import timeit
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# Settings exige estas variáveis; valores fictícios bastam para o benchmark
+for _k in ("POSTGRES_CONNECTION_STRING", "SUPERMERCADO_BASE_URL", "SUPERMERCADO_AUTH_TOKEN", "WHATSAPP_TOKEN"):
+    os.environ.setdefault(_k, "bench")
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage  # noqa: E402
+
+import server  # noqa: E402
+import agent_langgraph_simple as agent  # noqa: E402
+from tools import http_tools  # noqa: E402
+from tools.matching import Query, top_k  # noqa: E402
+from tools.records import to_tool_json  # noqa: E402
+
+DEFAULT_HISTORY = ROOT / "scripts" / "bench_hotpaths_history.jsonl"
+
+MARCAS = ["PILÃO", "MELITTA", "TIO JOÃO", "CAMIL", "SADIA", "PERDIGÃO", "YPÊ", "OMO", "NINHO", "ITAMBÉ"]
+PRODUTOS = ["CAFÉ", "ARROZ TIPO 1", "FEIJÃO CARIOCA", "LEITE INTEGRAL", "FRANGO CONGELADO",
+            "DETERGENTE", "SABÃO EM PÓ", "AÇÚCAR CRISTAL", "ÓLEO DE SOJA", "MACARRÃO ESPAGUETE"]
+MEDIDAS = ["500G", "1KG", "5KG", "1L", "2L", "900ML", "200G", "UN"]
+CONSULTAS = ["cafe pilao 500g", "arroz 5kg", "feijão carioca", "leite integral 1l", "frango",
+             "detergente ype", "sabao em po omo", "açúcar", "oleo de soja 900ml", "macarrao"]
+
+
+# ============================================
+# Fixtures
+# ============================================
+
+def webhook_payloads() -> List[dict]:
+    """Variações reais do UAZ: texto, lista `messages`, LID, áudio, imagem, PDF e fromMe."""
+    tel = "5585987654321"
+    jid = f"{tel}@s.whatsapp.net"
+    return [
+        {"EventType": "messages", "chat": {"wa_id": jid, "phone": tel},
+         "message": {"chatid": jid, "sender": jid, "messageid": "A1", "messageType": "conversation",
+                     "type": "text", "fromMe": False, "text": "quero 2 arroz 5kg e 1 feijão"}},
+        {"messages": [{"sender": jid, "chatid": jid, "id": "A2", "type": "text",
+                       "content": "tem coca 2l gelada?"}]},
+        {"EventType": "messages", "chat": {"wa_id": "123456789012345@lid", "phone": tel},
+         "message": {"chatid": "123456789012345@lid", "sender": "123456789012345@lid", "messageid": "A3",
+                     "messageType": "conversation", "type": "text", "text": "oi"}},
+        {"EventType": "messages", "chat": {"wa_id": jid},
+         "message": {"chatid": jid, "sender": jid, "messageid": "A4", "messageType": "audioMessage",
+                     "mediaType": "ptt", "type": "media", "mimetype": "audio/ogg; codecs=opus"}},
+        {"EventType": "messages", "chat": {"wa_id": jid},
+         "message": {"chatid": jid, "sender": jid, "messageid": "A5", "messageType": "imageMessage",
+                     "mediaType": "image", "type": "media", "content": {"caption": "tem esse?"}}},
+        {"EventType": "messages", "chat": {"wa_id": jid},
+         "message": {"chatid": jid, "sender": jid, "messageid": "A6", "messageType": "documentMessage",
+                     "type": "media", "mimetype": "application/pdf", "content": {"caption": "comprovante.pdf"}}},
+        {"EventType": "messages", "chat": {"wa_id": jid, "phone": tel},
+         "message": {"chatid": jid, "sender": "558533334444@s.whatsapp.net", "messageid": "A7",
+                     "messageType": "conversation", "type": "text", "fromMe": True, "text": "Pedido saiu!"}},
+    ]
+
+
+def long_reply(rng: random.Random) -> str:
+    """Resposta longa do agente: orçamento com ~25 itens em parágrafos e linhas."""
+    itens = []
+    for _ in range(25):
+        preco = f"{rng.uniform(2, 40):.2f}".replace(".", ",")
+        itens.append(f"▫️ {rng.choice(PRODUTOS).title()} {rng.choice(MARCAS).title()} {rng.choice(MEDIDAS)}"
+                     f" ....... R$ {preco}")
+    blocos = ["Deixa eu ver aqui... 📝 Encontrei quase tudo!",
+              "\n".join(itens[:12]),
+              "\n".join(itens[12:]),
+              "🚚 Taxa de entrega: R$ 5,00\n💰 Total estimado: R$ 312,45",
+              "Quer que eu coloque tudo no carrinho? Se preferir outra marca de algum item é só falar 😊"]
+    return "\n\n".join(blocos)
+
+
+def smart_responder_payload(rng: random.Random, n_docs: int = 40) -> list:
+    """Documentos como os devolvidos pelo smart-responder (Supabase)."""
+    docs = []
+    for _ in range(n_docs):
+        nome = f"{rng.choice(PRODUTOS)} {rng.choice(MARCAS)} {rng.choice(MEDIDAS)}"
+        content = json.dumps({"codigo_ean": rng.randint(10 ** 12, 10 ** 13 - 1), "produto": nome,
+                              "categoria": "MERCEARIA", "descricao": f"{nome} - embalagem econômica"},
+                             ensure_ascii=False)
+        docs.append({"id": rng.randint(1, 10 ** 6), "content": content,
+                     "metadata": {"source": "catalogo", "type": "product", "categoria": "MERCEARIA"},
+                     "similarity": rng.random()})
+    return docs
+
+
+def estoque_items(rng: random.Random, n: int = 6) -> List[dict]:
+    """Itens da API de estoque por EAN (preço em formato BR, campos extras, sem estoque)."""
+    items = []
+    for i in range(n):
+        items.append({
+            "produto": f"{rng.choice(PRODUTOS)} {rng.choice(MARCAS)} {rng.choice(MEDIDAS)}",
+            "ean": "7891000100103", "id": i, "cod_loja": 1,
+            "vl_produto": f"{rng.uniform(2, 40):.2f}".replace(".", ","),
+            "vl_produto_normal": f"{rng.uniform(2, 40):.2f}",
+            "qtd_produto": rng.choice(["0", "12", "3,5", "", "abc"]),
+            "qtd_movimentacao": rng.randint(0, 200),
+            "dt_atualizacao": "2024-05-01T10:00:00",
+        })
+    return items
+
+
+def turn_messages(rng: random.Random, history: int = 10) -> list:
+    """Histórico + turno atual: tool calls, ToolMessages, <thinking> e JSON antes da resposta."""
+    msgs = []
+    for i in range(history):
+        msgs.append(HumanMessage(content=f"[TELEFONE_CLIENTE: 5585987654321]\n\nmensagem antiga {i}"))
+        msgs.append(AIMessage(content=f"Resposta antiga {i} 😊"))
+    msgs.append(HumanMessage(content="[TELEFONE_CLIENTE: 5585987654321]\n\nquero arroz, feijão e café"))
+    for nome in ("busca_lote", "add_item_tool", "view_cart_tool"):
+        call_id = f"call_{rng.getrandbits(32):x}"
+        msgs.append(AIMessage(content="", tool_calls=[{"name": nome, "args": {"produtos": "arroz"}, "id": call_id}]))
+        msgs.append(ToolMessage(content="PRODUTOS_ENCONTRADOS:\n" + long_reply(rng)[:400], tool_call_id=call_id))
+    msgs.append(AIMessage(content='{"status": "ok", "itens": 3}'))
+    msgs.append(AIMessage(content="<thinking>cliente quer 3 itens; confirmar carrinho</thinking>\n\n"
+                                  + long_reply(rng)))
+    return msgs
+
+
+# ============================================
+# Casos
+# ============================================
+
+def build_cases(seed: int = 7) -> Dict[str, Callable[[], object]]:
+    rng = random.Random(seed)
+    payloads = webhook_payloads()
+    reply = long_reply(rng)
+    docs = [smart_responder_payload(rng) for _ in range(8)]
+    consultas = [CONSULTAS[i % len(CONSULTAS)] for i in range(len(docs))]
+    estoque = estoque_items(rng)
+    messages = turn_messages(rng)
+
+    def extract_incoming():
+        for p in payloads:
+            server._extract_incoming(p)
+
+    def split_message():
+        return server._split_message(reply)
+
+    def ean_walk_score():
+        for q, data in zip(consultas, docs):
+            pairs = http_tools._extract_pairs_from_json(data)
+            top_k(Query(q), pairs, lambda pn: pn.nome, k=5)
+
+    def estoque_sanitize():
+        return to_tool_json([http_tools._to_stock_item(it, "7891000100103") for it in estoque])
+
+    def select_response():
+        return agent._select_response(messages)
+
+    return {
+        "extract_incoming": extract_incoming,
+        "split_message": split_message,
+        "ean_walk_score": ean_walk_score,
+        "estoque_sanitize": estoque_sanitize,
+        "load_prompt": agent.load_system_prompt,
+        "select_response": select_response,
+    }
+
+
+def measure(fn: Callable[[], object], repeat: int) -> Tuple[float, int]:
+    """Melhor tempo por chamada (µs) entre `repeat` rodadas de ~0.2s."""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number))
+    return best / number * 1e6, number
+
+
+# ============================================
+# Histórico
+# ============================================
+
+def _git_commit() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                             capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or "?"
+    except Exception:
+        return "?"
+
+
+def last_entry(path: Path) -> Dict[str, float]:
+    if not path.exists():
+        return {}
+    lines = [line for line in path.read_text(encoding="utf-8").splitlines() if line.strip()]
+    return json.loads(lines[-1]).get("results", {}) if lines else {}
+
+
+def save_entry(path: Path, results: Dict[str, float]) -> None:
+    entry = {
+        "commit": _git_commit(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "results": results,
+    }
+    with path.open("a", encoding="utf-8") as f:
+        f.write(json.dumps(entry) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("cases", nargs="*", help="casos a rodar (padrão: todos)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--history", default=str(DEFAULT_HISTORY), help="arquivo JSONL do histórico")
+    parser.add_argument("--save", action="store_true", help="acrescenta o resultado ao histórico")
+    parser.add_argument("--compare", action="store_true", help="compara com a última entrada do histórico")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="regressão aceita em --compare (0.15 = 15%%)")
+    args = parser.parse_args()
+
+    cases = build_cases()
+    unknown = [name for name in args.cases if name not in cases]
+    if unknown:
+        raise SystemExit(f"Casos desconhecidos: {', '.join(unknown)} (use {', '.join(cases)})")
+    selected = args.cases or list(cases)
+
+    history = Path(args.history)
+    baseline = last_entry(history) if args.compare else {}
+    results: Dict[str, float] = {}
+    regressions = []
+
+    for name in selected:
+        us, number = measure(cases[name], args.repeat)
+        results[name] = round(us, 3)
+        line = f"{name:<18} {us:>10.2f} µs/chamada  ({number} chamadas/rodada)"
+        before = baseline.get(name)
+        if before:
+            delta = us / before - 1
+            line += f"   {delta:+.1%} vs {before:.2f} µs"
+            if delta > args.tolerance:
+                line += "  ⚠️ REGRESSÃO"
+                regressions.append(name)
+        print(line)
+
+    if args.save:
+        save_entry(history, results)
+        print(f"\nResultado gravado em {history}")
+    if args.compare and not baseline:
+        print(f"\nSem histórico em {history} para comparar (rode com --save primeiro)")
+    if regressions:
+        raise SystemExit(f"\nRegressão acima de {args.tolerance:.0%}: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
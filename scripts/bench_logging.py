@@ -0,0 +1,97 @@
+"""
+Microbenchmark do custo de log no caminho da requisição: configuração
+antiga (três handlers síncronos por logger: JSON, console e texto) vs.
+config.logger (QueueHandler + uma thread gravando com rotação).
+
+Mede o tempo gasto na thread que loga (o que a requisição sente) e, para
+a fila, quanto o listener leva para esvaziar depois.
+
+Uso:
+  python scripts/bench_logging.py            # 20000 linhas, 4 threads
+  python scripts/bench_logging.py 50000 8
+"""
+import os
+import sys
+import logging
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+# Settings exige estas variáveis; valores fictícios bastam para o benchmark
+for _k in ("POSTGRES_CONNECTION_STRING", "SUPERMERCADO_BASE_URL", "SUPERMERCADO_AUTH_TOKEN", "WHATSAPP_TOKEN"):
+    os.environ.setdefault(_k, "bench")
+
+from pythonjsonlogger import jsonlogger  # noqa: E402
+
+from config import logger as log_config  # noqa: E402
+
+MENSAGEM = "📝 Msg[%d] type=%s tool_calls=%s content=%s"
+CONTEUDO = "Deixa eu ver aqui... arroz tipo 1 5kg, feijão carioca 1kg, óleo de soja 900ml " * 2
+
+
+def legacy_logger(name: str, log_file: str) -> logging.Logger:
+    """setup_logger anterior: três handlers síncronos no próprio logger."""
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    json_formatter = jsonlogger.JsonFormatter('%(asctime)s %(name)s %(levelname)s %(message)s',
+                                              datefmt='%Y-%m-%d %H:%M:%S')
+    console_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                                          datefmt='%Y-%m-%d %H:%M:%S')
+    file_handler = logging.FileHandler(log_file, encoding='utf-8')
+    file_handler.setFormatter(json_formatter)
+    # Console redirecionado para /dev/null (mede a escrita, não o terminal)
+    console_handler = logging.StreamHandler(open(os.devnull, "w", encoding="utf-8"))
+    console_handler.setFormatter(console_formatter)
+    plain_handler = logging.FileHandler(log_file + ".plain", encoding='utf-8')
+    plain_handler.setFormatter(console_formatter)
+    for h in (file_handler, console_handler, plain_handler):
+        logger.addHandler(h)
+    return logger
+
+
+def _run(logger: logging.Logger, n: int, threads: int) -> float:
+    per_thread = n // threads
+
+    def worker():
+        for i in range(per_thread):
+            logger.info(MENSAGEM, i, "AIMessage", False, CONTEUDO)
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return time.perf_counter() - start
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    with tempfile.TemporaryDirectory() as tmp:
+        old = _run(legacy_logger("bench.legacy", os.path.join(tmp, "legacy.log")), n, threads)
+
+        log_file = os.path.join(tmp, "queue.log")
+        new_logger = log_config.setup_logger("bench.queue", log_file=log_file)
+        # Console do listener também para /dev/null
+        _, listener = log_config._pipelines[log_file]
+        for h in listener.handlers:
+            if isinstance(h, logging.StreamHandler) and not isinstance(h, logging.FileHandler):
+                h.setStream(open(os.devnull, "w", encoding="utf-8"))
+        new = _run(new_logger, n, threads)
+        drain_start = time.perf_counter()
+        listener.stop()
+        drain = time.perf_counter() - drain_start
+
+    print(f"{'síncrono (3 handlers)':<24} {n:>7} linhas  {old:8.3f}s  {old / n * 1e6:8.1f} µs/linha na thread")
+    print(f"{'fila + listener':<24} {n:>7} linhas  {new:8.3f}s  {new / n * 1e6:8.1f} µs/linha na thread")
+    print(f"{'':<24} listener esvaziou a fila em {drain:.3f}s (fora da requisição)")
+    print(f"\nSpeedup na thread da requisição: {old / new:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
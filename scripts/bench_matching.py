@@ -0,0 +1,165 @@
+"""
+Microbenchmark do ranking de candidatos do ean_lookup: implementação antiga
+(funções recriadas a cada chamada, consulta normalizada por candidato,
+regex em toda string e ordenação dupla) vs. tools.matching (padrões
+compilados, consulta normalizada uma vez em chave canônica, top-k com heapq).
+
+Usa payloads no formato do smart-responder (lista de documentos com
+metadata e um campo "content" contendo JSON dos produtos como texto).
+
+Uso:
+  python scripts/bench_matching.py            # 2000 consultas, 40 docs por payload
+  python scripts/bench_matching.py 5000 80
+"""
+import os
+import sys
+import json
+import random
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+# Settings exige estas variáveis; valores fictícios bastam para o benchmark
+for _k in ("POSTGRES_CONNECTION_STRING", "SUPERMERCADO_BASE_URL", "SUPERMERCADO_AUTH_TOKEN", "WHATSAPP_TOKEN"):
+    os.environ.setdefault(_k, "bench")
+
+from tools import http_tools  # noqa: E402
+from tools.matching import Query, top_k  # noqa: E402
+
+MARCAS = ["PILÃO", "MELITTA", "TIO JOÃO", "CAMIL", "SADIA", "PERDIGÃO", "YPÊ", "OMO", "NINHO", "ITAMBÉ"]
+PRODUTOS = ["CAFÉ", "ARROZ TIPO 1", "FEIJÃO CARIOCA", "LEITE INTEGRAL", "FRANGO CONGELADO",
+            "DETERGENTE", "SABÃO EM PÓ", "AÇÚCAR CRISTAL", "ÓLEO DE SOJA", "MACARRÃO ESPAGUETE"]
+MEDIDAS = ["500G", "1KG", "5KG", "1L", "2L", "900ML", "200G", "UN"]
+CONSULTAS = ["cafe pilao 500g", "arroz 5kg", "feijão carioca", "leite integral 1l", "frango",
+             "detergente ype", "sabao em po omo", "açúcar", "oleo de soja 900ml", "macarrao"]
+
+
+def fake_payload(rng: random.Random, n_docs: int) -> list:
+    """Documentos como os devolvidos pelo smart-responder (Supabase)."""
+    docs = []
+    for _ in range(n_docs):
+        nome = f"{rng.choice(PRODUTOS)} {rng.choice(MARCAS)} {rng.choice(MEDIDAS)}"
+        ean = str(rng.randint(10 ** 12, 10 ** 13 - 1))
+        content = json.dumps({"codigo_ean": int(ean), "produto": nome, "categoria": "MERCEARIA",
+                              "descricao": f"{nome} - embalagem econômica"}, ensure_ascii=False)
+        docs.append({
+            "id": rng.randint(1, 10 ** 6),
+            "content": content,
+            "metadata": {"source": "catalogo", "type": "product", "categoria": "MERCEARIA"},
+            "similarity": rng.random(),
+        })
+    return docs
+
+
+# ---- implementação anterior (copiada do ean_lookup antigo) ----
+
+def legacy_rank(query: str, data) -> list:
+    def _extract_pairs_from_text(text: str):
+        import re
+        eans = re.findall(r'"codigo_ean"\s*:\s*([0-9]+)', text)
+        names = re.findall(r'"produto"\s*:\s*"([^"]+)"', text)
+        pairs = []
+        limit = min(len(eans), len(names)) or max(len(eans), len(names))
+        for i in range(min(limit, 50)):
+            e = eans[i] if i < len(eans) else None
+            n = names[i] if i < len(names) else None
+            if e or n:
+                pairs.append((e, n))
+        return pairs
+
+    pairs = []
+
+    def try_obj(d):
+        e = None
+        for k in ["ean", "ean_code", "codigo_ean", "barcode", "gtin"]:
+            v = d.get(k)
+            if isinstance(v, (str, int)) and str(v).strip():
+                e = str(v).strip()
+                break
+        n = None
+        for k in ["produto", "product", "name", "nome", "title", "descricao", "description"]:
+            v = d.get(k)
+            if isinstance(v, str) and v.strip():
+                n = v.strip()
+                break
+        if e or n:
+            pairs.append((e, n))
+
+    def walk(payload):
+        if isinstance(payload, dict):
+            try_obj(payload)
+            for _, val in payload.items():
+                if isinstance(val, dict):
+                    walk(val)
+                elif isinstance(val, list):
+                    for it in val:
+                        walk(it)
+                elif isinstance(val, str):
+                    pairs.extend(_extract_pairs_from_text(val))
+        elif isinstance(payload, list):
+            for it in payload:
+                walk(it)
+        elif isinstance(payload, str):
+            pairs.extend(_extract_pairs_from_text(payload))
+
+    walk(data)
+
+    def _strip_accents(s: str) -> str:
+        import unicodedata
+        return ''.join(c for c in unicodedata.normalize('NFD', s) if unicodedata.category(c) != 'Mn')
+
+    def _score(q, nome):
+        if not nome:
+            return 0.0
+        import re as _re
+        qn = _strip_accents((q or '').lower())
+        nn = _strip_accents((nome or '').lower())
+        score = 0.0
+        for tok in _re.findall(r"[\wáéíóúâêîôûãõç]+", qn):
+            if tok and tok in nn:
+                score += 1.0
+        for m in _re.findall(r"(\d+\s*(g|kg|ml|l|litro|un))", qn):
+            if m[0] in nn:
+                score += 1.5
+        return score
+
+    scored = [(pn, _score(query, pn[1])) for pn in pairs]
+    ordered = [pn for pn, sc in sorted(scored, key=lambda x: x[1], reverse=True)]
+    top_relevant = [pn for pn, sc in sorted(scored, key=lambda x: x[1], reverse=True) if sc >= 1.0][:5]
+    return top_relevant if top_relevant else ordered[:5]
+
+
+def new_rank(query: str, data) -> list:
+    pairs = http_tools._extract_pairs_from_json(data)
+    return [(pn.ean, pn.nome) for _, pn in top_k(Query(query), pairs, lambda pn: pn.nome, k=5)]
+
+
+def _timeit(label: str, fn, cases) -> float:
+    start = time.perf_counter()
+    for q, payload in cases:
+        fn(q, payload)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<22} {len(cases):>6} consultas  {elapsed:8.3f}s  {elapsed / len(cases) * 1e6:9.1f} µs/consulta")
+    return elapsed
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    docs = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    rng = random.Random(42)
+    payloads = [fake_payload(rng, docs) for _ in range(50)]
+    cases = [(rng.choice(CONSULTAS), rng.choice(payloads)) for _ in range(n)]
+
+    # Concordância do primeiro colocado (o novo ranking entende 1l = 1000ml,
+    # sinônimos e plurais, então pode divergir de propósito)
+    sample = cases[:200]
+    same_top = sum(1 for q, payload in sample if legacy_rank(q, payload)[:1] == new_rank(q, payload)[:1])
+    print(f"Mesmo 1º colocado em {same_top}/{len(sample)} consultas")
+
+    old = _timeit("antigo", legacy_rank, cases)
+    new = _timeit("tools.matching", new_rank, cases)
+    print(f"\nSpeedup: {old / new:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Tamanho dos schemas de tools enviados ao LLM em cada chamada, por fase
+do pedido (AGENT_PHASE_TOOLS): todas as tools com as docstrings completas
+(como era) x tools da fase com descrições curtas.
+
+Os schemas são gerados como no bind_tools (formato de function calling
+da OpenAI; o Gemini recebe os mesmos nomes, descrições e parâmetros).
+Tokens contados com tiktoken quando disponível, senão ~chars/4.
+
+A economia por turno usa a média de chamadas ao LLM por turno e a
+distribuição de turnos por fase (ver agent_turn_steps e
+agent_tool_phase_total no /metrics).
+
+Uso:
+  python scripts/bench_tool_schemas.py
+  python scripts/bench_tool_schemas.py --calls-per-turn 2.6 --mix browsing=0.5,building=0.4,sent=0.1
+"""
+import os
+import sys
+import json
+import argparse
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# Settings exige estas variáveis; valores fictícios bastam para medir os schemas
+for _k in ("POSTGRES_CONNECTION_STRING", "SUPERMERCADO_BASE_URL", "SUPERMERCADO_AUTH_TOKEN", "WHATSAPP_TOKEN"):
+    os.environ.setdefault(_k, "bench")
+
+from langchain_core.utils.function_calling import convert_to_openai_tool  # noqa: E402
+
+import agent_langgraph_simple as agent  # noqa: E402
+
+
+def token_counter() -> Tuple[Callable[[str], int], str]:
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding("cl100k_base")
+        return (lambda text: len(encoding.encode(text))), "tiktoken cl100k_base"
+    except Exception:
+        return (lambda text: len(text) // 4), "estimativa chars/4 (tiktoken indisponível)"
+
+
+def check_coverage() -> List[str]:
+    """Toda tool das fases existe em ACTIVE_TOOLS e tem descrição curta."""
+    active = {t.name for t in agent.ACTIVE_TOOLS}
+    problems = []
+    for phase, names in agent.PHASE_TOOLS.items():
+        problems += [f"{phase}: '{n}' não está em ACTIVE_TOOLS" for n in sorted(names - active)]
+        problems += [f"{phase}: '{n}' sem COMPACT_DESCRIPTIONS" for n in sorted(names - set(agent.COMPACT_DESCRIPTIONS))]
+    return problems
+
+
+def schema_size(tools: List[Any], count: Callable[[str], int]) -> Dict[str, int]:
+    payload = json.dumps([convert_to_openai_tool(t) for t in tools], ensure_ascii=False, separators=(",", ":"))
+    return {"tools": len(tools), "chars": len(payload), "tokens": count(payload)}
+
+
+def parse_mix(raw: str) -> Dict[str, float]:
+    mix = {}
+    for part in raw.split(","):
+        phase, _, share = part.partition("=")
+        if phase.strip() not in agent.PHASE_TOOLS:
+            raise SystemExit(f"Fase desconhecida: {phase} (use {', '.join(agent.PHASE_TOOLS)})")
+        mix[phase.strip()] = float(share)
+    total = sum(mix.values()) or 1.0
+    return {phase: share / total for phase, share in mix.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls-per-turn", type=float, default=2.0, help="média de chamadas ao LLM por turno")
+    parser.add_argument("--mix", default="browsing=0.5,building=0.35,sent=0.15",
+                        help="fração dos turnos em cada fase")
+    args = parser.parse_args()
+
+    problems = check_coverage()
+    if problems:
+        raise SystemExit("Fases inconsistentes:\n  " + "\n  ".join(problems))
+    count, counter_name = token_counter()
+    mix = parse_mix(args.mix)
+    print(f"Tokens: {counter_name}\n")
+    full = schema_size(agent.tools_for_phase(None), count)
+
+    print(f"{'fase':<10} {'tools':>6} {'chars':>8} {'tokens':>8} {'economia/chamada':>18}")
+    print(f"{'todas':<10} {full['tools']:>6} {full['chars']:>8} {full['tokens']:>8} {'-':>18}")
+    weighted = 0.0
+    for phase in agent.PHASE_TOOLS:
+        size = schema_size(agent.tools_for_phase(phase), count)
+        saved = full["tokens"] - size["tokens"]
+        weighted += mix.get(phase, 0.0) * saved
+        print(f"{phase:<10} {size['tools']:>6} {size['chars']:>8} {size['tokens']:>8} "
+              f"{saved:>8} ({saved / full['tokens']:.0%})")
+
+    print(f"\nEconomia média: {weighted:.0f} tokens de prompt por chamada, "
+          f"{weighted * args.calls_per_turn:.0f} por turno ({args.calls_per_turn:g} chamadas/turno)")
+
+
+if __name__ == "__main__":
+    main()
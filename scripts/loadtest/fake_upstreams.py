@@ -0,0 +1,271 @@
+"""
+Servidor local que imita todos os serviços externos do agente (só stdlib)
+
+  UAZ (WhatsApp)       POST /send/text, /message/presence, /message/download
+                       GET  /media/<id>
+  API do supermercado  POST /pedidos/   PUT /pedidos/telefone/<tel>
+                       GET  /api/Produto/GetProdutosEAN/<ean>
+  smart-responder      POST /smart-responder
+  Gemini (File Search) POST /v1beta/models/<modelo>:generateContent
+  Chat (OpenAI)        POST /v1/chat/completions  (modelo roteirizado)
+
+O modelo de chat segue um roteiro de tools por turno (ex:
+"busca_lote,final"): a cada resposta de tool avança um passo e termina
+com um texto. Cada serviço tem latência configurável e todas as chamadas
+são contadas; as mensagens enviadas ao cliente ficam registradas com o
+horário de chegada (usado pelo run.py para medir mensagem -> resposta).
+
+Uso isolado:
+  python scripts/loadtest/fake_upstreams.py --port 9100 --latency llm=0.8
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+PRODUTOS = [
+    ("7891000100103", "ARROZ TIPO 1 CAMIL 5KG", 27.90),
+    ("7896006711117", "FEIJAO CARIOCA KICALDO 1KG", 8.49),
+    ("7891107101621", "OLEO DE SOJA SOYA 900ML", 7.99),
+    ("7894900011517", "REFRIGERANTE COCA COLA 2L", 10.99),
+    ("7896005800027", "CAFE PILAO 500G", 18.90),
+    ("7891000053508", "LEITE INTEGRAL NINHO 1L", 6.29),
+    ("7896036090244", "ACUCAR CRISTAL DOCE 1KG", 4.99),
+    ("7891149103102", "MACARRAO ESPAGUETE VITARELLA 500G", 4.29),
+    ("550", "FRANGO ABATIDO KG", 12.90),
+    ("7896221600012", "AGUA SANITARIA QBOA 1L", 3.99),
+]
+
+# Latências padrão (segundos) por serviço
+DEFAULT_LATENCY = {"uaz": 0.02, "supermercado": 0.08, "smart_responder": 0.3, "gemini": 0.6, "llm": 0.8}
+
+
+class FakeState:
+    """Contadores, latências e registro das respostas enviadas ao cliente."""
+
+    def __init__(self, latency: Dict[str, float], script: List[str], jitter: float = 0.2):
+        self.latency = dict(DEFAULT_LATENCY, **latency)
+        self.script = script
+        self.jitter = jitter
+        self.calls: Counter = Counter()
+        self.replies: Dict[str, List[Tuple[float, str]]] = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def wait(self, service: str) -> None:
+        base = self.latency.get(service, 0.0)
+        if base > 0:
+            time.sleep(max(0.0, random.gauss(base, base * self.jitter)))
+
+    def count(self, name: str) -> None:
+        with self.lock:
+            self.calls[name] += 1
+
+    def record_reply(self, number: str, text: str) -> None:
+        with self.lock:
+            self.replies[number].append((time.monotonic(), text))
+
+
+# ============================================
+# Respostas de cada serviço
+# ============================================
+
+def _catalog_docs(query: str) -> List[Dict[str, Any]]:
+    """Documentos no formato do smart-responder (conteúdo com JSON em texto)."""
+    docs = []
+    for ean, nome, _ in random.sample(PRODUTOS, 5):
+        content = json.dumps({"codigo_ean": int(ean), "produto": nome, "categoria": "MERCEARIA"}, ensure_ascii=False)
+        docs.append({"id": random.randint(1, 10 ** 6), "content": content,
+                     "metadata": {"type": "product"}, "similarity": random.random()})
+    return docs
+
+
+def _stock(ean: str) -> List[Dict[str, Any]]:
+    for code, nome, preco in PRODUTOS:
+        if code == ean:
+            return [{"produto": nome, "ean": code, "id": 1, "vl_produto": preco, "qtd_produto": 25}]
+    return []
+
+
+def _file_search_text() -> str:
+    return "\n".join(f"{ean} | {nome} | MERCEARIA" for ean, nome, _ in random.sample(PRODUTOS, 4))
+
+
+_PHONE_RE = re.compile(r"\[TELEFONE_CLIENTE:\s*(\d+)\]")
+
+
+def _chat_completion(state: FakeState, body: Dict[str, Any]) -> Dict[str, Any]:
+    """Modelo roteirizado: passo = nº de respostas de tool desde a última mensagem do cliente."""
+    messages = body.get("messages") or []
+    step, user_text = 0, ""
+    for msg in reversed(messages):
+        if msg.get("role") == "tool":
+            step += 1
+        elif msg.get("role") == "user":
+            content = msg.get("content")
+            user_text = content if isinstance(content, str) else json.dumps(content, ensure_ascii=False)
+            break
+    match = _PHONE_RE.search(user_text)
+    telefone = match.group(1) if match else "0"
+    pedido = _PHONE_RE.sub("", user_text).strip() or "arroz"
+
+    action = state.script[step] if step < len(state.script) else "final"
+    prompt_tokens = sum(len(str(m.get("content") or "")) for m in messages) // 4
+    if action == "final":
+        message = {"role": "assistant", "content": "Encontrei aqui! 😊 Quer que eu coloque no carrinho?"}
+        finish = "stop"
+    else:
+        args = {
+            "busca_lote": {"produtos": pedido.replace(" | ", ", ")},
+            "ean": {"query": pedido},
+            "add_item_tool": {"telefone": telefone, "produto": PRODUTOS[0][1], "quantidade": 1,
+                              "preco": PRODUTOS[0][2], "ean": PRODUTOS[0][0]},
+            "view_cart_tool": {"telefone": telefone},
+        }.get(action, {})
+        message = {"role": "assistant", "content": "", "tool_calls": [{
+            "id": f"call_{random.getrandbits(48):x}", "type": "function",
+            "function": {"name": action, "arguments": json.dumps(args, ensure_ascii=False)},
+        }]}
+        finish = "tool_calls"
+    completion_tokens = 20
+    return {
+        "id": f"chatcmpl-{random.getrandbits(48):x}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "fake-chat"),
+        "choices": [{"index": 0, "message": message, "finish_reason": finish}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "total_tokens": prompt_tokens + completion_tokens},
+    }
+
+
+def make_handler(state: FakeState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt: str, *args: Any) -> None:
+            pass  # Silencioso: milhares de chamadas por rodada
+
+        def _body(self) -> Dict[str, Any]:
+            length = int(self.headers.get("Content-Length") or 0)
+            if not length:
+                return {}
+            try:
+                return json.loads(self.rfile.read(length))
+            except ValueError:
+                return {}
+
+        def _send(self, payload: Any, status: int = 200, content_type: str = "application/json") -> None:
+            data = payload if isinstance(payload, bytes) else json.dumps(payload, ensure_ascii=False).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self) -> None:
+            path = self.path.split("?")[0]
+            if path.startswith("/api/Produto/GetProdutosEAN/"):
+                state.count("supermercado.estoque_ean")
+                state.wait("supermercado")
+                return self._send(_stock(path.rsplit("/", 1)[-1]))
+            if path.startswith("/media/"):
+                state.count("uaz.media")
+                state.wait("uaz")
+                return self._send(b"%PDF-1.4 fake", content_type="application/pdf")
+            if path == "/stats":
+                with state.lock:
+                    return self._send({"calls": dict(state.calls),
+                                       "replies": {k: len(v) for k, v in state.replies.items()}})
+            state.count(f"404 GET {path}")
+            self._send({"error": "not found"}, 404)
+
+        def do_PUT(self) -> None:
+            self._body()
+            if self.path.startswith("/pedidos/"):
+                state.count("supermercado.alterar_pedido")
+                state.wait("supermercado")
+                return self._send({"status": "ok"})
+            state.count(f"404 PUT {self.path}")
+            self._send({"error": "not found"}, 404)
+
+        def do_POST(self) -> None:
+            path = self.path.split("?")[0]
+            body = self._body()
+            if path == "/send/text":
+                state.count("uaz.send_text")
+                state.wait("uaz")
+                state.record_reply(str(body.get("number", "")), str(body.get("text", "")))
+                return self._send({"status": "sent"})
+            if path == "/message/presence":
+                state.count("uaz.presence")
+                return self._send({"status": "ok"})
+            if path == "/message/download":
+                state.count("uaz.download")
+                state.wait("uaz")
+                host = self.headers.get("Host", "127.0.0.1")
+                return self._send({"fileURL": f"http://{host}/media/{body.get('id', 'x')}"})
+            if path.startswith("/pedidos"):
+                state.count("supermercado.pedidos")
+                state.wait("supermercado")
+                return self._send({"id": random.randint(1, 10 ** 6), "status": "recebido"})
+            if path == "/smart-responder":
+                state.count("smart_responder")
+                state.wait("smart_responder")
+                return self._send(_catalog_docs(str(body.get("query", ""))))
+            if path.startswith("/v1beta/models/") and path.endswith(":generateContent"):
+                state.count("gemini.generate_content")
+                state.wait("gemini")
+                return self._send({"candidates": [{"content": {"parts": [{"text": _file_search_text()}]}}]})
+            if path == "/v1/chat/completions":
+                state.count("llm.chat")
+                state.wait("llm")
+                return self._send(_chat_completion(state, body))
+            state.count(f"404 POST {path}")
+            self._send({"error": "not found"}, 404)
+
+    return Handler
+
+
+def start(port: int = 0, latency: Optional[Dict[str, float]] = None,
+          script: Optional[List[str]] = None) -> Tuple[ThreadingHTTPServer, FakeState]:
+    """Sobe o servidor numa thread; port=0 escolhe uma porta livre (server.server_port)."""
+    state = FakeState(latency or {}, script or ["busca_lote", "final"])
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-upstreams", daemon=True).start()
+    return server, state
+
+
+def parse_latency(items: List[str]) -> Dict[str, float]:
+    """["llm=0.8", "gemini=0.5"] -> {"llm": 0.8, "gemini": 0.5}"""
+    latency = {}
+    for item in items or []:
+        name, _, value = item.partition("=")
+        if name not in DEFAULT_LATENCY:
+            raise SystemExit(f"Serviço desconhecido em --latency: {name} (use {', '.join(DEFAULT_LATENCY)})")
+        latency[name] = float(value)
+    return latency
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", action="append", default=[], help="serviço=segundos (repetível)")
+    parser.add_argument("--script", default="busca_lote,final", help="roteiro de tools do modelo por turno")
+    args = parser.parse_args()
+    server, _ = start(args.port, parse_latency(args.latency), args.script.split(","))
+    print(f"Fake upstreams em http://127.0.0.1:{server.server_port} (GET /stats para contadores)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""
+Replay offline de turnos gravados com CAPTURE_ENABLED (config/capture.py)
+
+Reexecuta `run_agent_langgraph` para cada turno gravado, na ordem, com:
+- tools simuladas: devolvem a saída gravada para a mesma tool/argumentos
+  (ou a próxima gravada daquela tool); nada chega ao Redis, à API do
+  supermercado, ao smart-responder ou ao Gemini;
+- modelo simulado: repete as respostas gravadas do LLM (tool_calls e
+  texto). Com --live-model usa o LLM configurado (.env) e só as tools
+  ficam simuladas, para medir mudanças de prompt no comportamento;
+- histórico em memória no lugar do Postgres.
+
+O próprio replay é gravado (mesmo formato) e comparado com a gravação
+original: chamadas ao LLM (passos ReAct), tools por nome, tamanho do
+prompt, tokens, tempo por turno e respostas que mudaram.
+
+Uso:
+  python scripts/replay.py logs/captures/turns-20250101.jsonl.gz
+  python scripts/replay.py logs/captures/*.jsonl.gz --live-model --limit 50
+  python scripts/replay.py base.jsonl.gz --compare depois.jsonl.gz   # só compara
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+from collections import Counter, defaultdict, deque
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from langchain_core.chat_history import InMemoryChatMessageHistory  # noqa: E402
+from langchain_core.language_models.chat_models import BaseChatModel  # noqa: E402
+from langchain_core.messages import AIMessage  # noqa: E402
+from langchain_core.outputs import ChatGeneration, ChatResult  # noqa: E402
+from langchain_core.tools import StructuredTool  # noqa: E402
+
+NO_RECORDING = "Nenhum resultado gravado para esta chamada (replay)."
+
+
+def _args_key(tool: str, args: Any) -> str:
+    if isinstance(args, str):
+        try:
+            args = json.loads(args)
+        except ValueError:
+            pass
+    return f"{tool}:{json.dumps(args, sort_keys=True, ensure_ascii=False, default=str)}"
+
+
+class ReplaySession:
+    """Respostas gravadas do turno em andamento (LLM em ordem, tools por nome/argumentos)."""
+
+    def __init__(self):
+        self.turn: Dict[str, Any] = {}
+        self._llm: deque = deque()
+        self._by_args: Dict[str, deque] = defaultdict(deque)
+        self._by_tool: Dict[str, deque] = defaultdict(deque)
+        self.misses = Counter()
+
+    def load(self, turn: Dict[str, Any]) -> None:
+        self.turn = turn
+        self._llm = deque(turn.get("llm") or [])
+        self._by_args.clear()
+        self._by_tool.clear()
+        for entry in turn.get("tools") or []:
+            self._by_args[_args_key(entry["tool"], entry.get("input"))].append(entry["output"])
+            self._by_tool[entry["tool"]].append(entry["output"])
+
+    def next_llm(self, prompt_chars: int) -> AIMessage:
+        if not self._llm:
+            # Mais passos que na gravação: encerra com a resposta final gravada
+            self.misses["llm"] += 1
+            return AIMessage(content=self.turn.get("output") or "")
+        entry = self._llm.popleft()
+        tool_calls = [{"name": tc["tool"], "args": tc.get("args") or {}, "id": tc.get("id") or f"replay_{i}"}
+                      for i, tc in enumerate(entry.get("tool_calls") or [])]
+        output_tokens = entry.get("output_tokens", 0)
+        return AIMessage(
+            content=entry.get("content") or "",
+            tool_calls=tool_calls,
+            usage_metadata={"input_tokens": prompt_chars // 4, "output_tokens": output_tokens,
+                            "total_tokens": prompt_chars // 4 + output_tokens},
+        )
+
+    def tool_output(self, tool: str, args: Dict[str, Any]) -> str:
+        exact = self._by_args.get(_args_key(tool, args))
+        if exact:
+            return exact.popleft()
+        if self._by_tool.get(tool):
+            self.misses[f"tool_args:{tool}"] += 1
+            return self._by_tool[tool].popleft()
+        self.misses[f"tool:{tool}"] += 1
+        return NO_RECORDING
+
+
+class ReplayChatModel(BaseChatModel):
+    """Modelo que devolve as mensagens gravadas do LLM."""
+
+    session: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "ReplayChatModel":
+        return self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        prompt_chars = sum(len(str(m.content)) for m in messages)
+        return ChatResult(generations=[ChatGeneration(message=self.session.next_llm(prompt_chars))])
+
+
+def replay_tools(tools: List[Any], session: ReplaySession) -> List[StructuredTool]:
+    """Mesmos nomes, descrições e schemas das tools reais; saída vem da gravação."""
+    def make(name: str):
+        def run(**kwargs: Any) -> str:
+            return session.tool_output(name, kwargs)
+        return run
+
+    return [StructuredTool.from_function(func=make(t.name), name=t.name, description=t.description,
+                                         args_schema=t.args_schema) for t in tools]
+
+
+# ============================================
+# Comparação
+# ============================================
+
+def summarize(turns: List[Dict[str, Any]]) -> Dict[str, Any]:
+    llm_calls = [len(t.get("llm") or []) for t in turns]
+    tools = Counter(entry["tool"] for t in turns for entry in t.get("tools") or [])
+    walls = sorted(t.get("wall_ms", 0.0) for t in turns)
+
+    def pct(p: float) -> float:
+        return walls[min(len(walls) - 1, int(p * len(walls)))] if walls else 0.0
+
+    return {
+        "turnos": len(turns),
+        "chamadas_llm": sum(llm_calls),
+        "passos_por_turno": round(sum(llm_calls) / len(turns), 2) if turns else 0.0,
+        "chamadas_tool": sum(tools.values()),
+        "prompt_chars": sum(e.get("prompt_chars", 0) for t in turns for e in t.get("llm") or []),
+        "tokens_input": sum(e.get("input_tokens", 0) for t in turns for e in t.get("llm") or []),
+        "tokens_output": sum(e.get("output_tokens", 0) for t in turns for e in t.get("llm") or []),
+        "wall_ms_p50": pct(0.50),
+        "wall_ms_p95": pct(0.95),
+        "erros": sum(1 for t in turns if t.get("error")),
+        "tools": tools,
+    }
+
+
+def print_comparison(base: List[Dict[str, Any]], other: List[Dict[str, Any]], label: str) -> None:
+    a, b = summarize(base), summarize(other)
+    print(f"\n{'':<20} {'gravado':>12} {label:>12} {'delta':>9}")
+    for key in a:
+        if key == "tools":
+            continue
+        va, vb = a[key], b[key]
+        delta = f"{(vb / va - 1):+.1%}" if va else ""
+        print(f"{key:<20} {va:>12} {vb:>12} {delta:>9}")
+    print("\nTools por nome:")
+    for name in sorted(set(a["tools"]) | set(b["tools"])):
+        print(f"  {name:<28} {a['tools'][name]:>6} {b['tools'][name]:>6}")
+    changed = sum(1 for x, y in zip(base, other) if (x.get("output") or "").strip() != (y.get("output") or "").strip())
+    print(f"\nRespostas diferentes: {changed}/{min(len(base), len(other))}")
+
+
+# ============================================
+# Execução
+# ============================================
+
+def run_replay(turns: List[Dict[str, Any]], live_model: bool) -> ReplaySession:
+    import agent_langgraph_simple as agent
+
+    session = ReplaySession()
+    llm = None if live_model else ReplayChatModel(session=session)
+    agent._agent_graph = agent.create_agent_with_history(llm=llm, tools=replay_tools(agent.ACTIVE_TOOLS, session))
+
+    histories: Dict[str, InMemoryChatMessageHistory] = defaultdict(InMemoryChatMessageHistory)
+    agent.get_session_history = lambda session_id: histories[session_id]
+
+    for i, turn in enumerate(turns, 1):
+        session.load(turn)
+        res = agent.run_agent_langgraph(turn["telefone"], turn.get("mensagem") or "")
+        status = "erro" if res.get("error") else "ok"
+        print(f"[{i}/{len(turns)}] {turn['telefone']} {status}: {(res.get('output') or '')[:60]!r}")
+    return session
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("captures", nargs="+", help="arquivos turns-*.jsonl.gz gravados")
+    parser.add_argument("--live-model", action="store_true", help="usa o LLM real (tools continuam simuladas)")
+    parser.add_argument("--limit", type=int, default=0, help="máximo de turnos")
+    parser.add_argument("--out", default="", help="diretório da gravação do replay (padrão: temporário)")
+    parser.add_argument("--compare", nargs="+", default=None, help="só compara com outra gravação, sem replay")
+    args = parser.parse_args()
+
+    out_dir = args.out or tempfile.mkdtemp(prefix="replay-")
+    # Settings exige estas variáveis; o replay não fala com nenhum desses serviços
+    for key in ("POSTGRES_CONNECTION_STRING", "SUPERMERCADO_BASE_URL", "SUPERMERCADO_AUTH_TOKEN", "WHATSAPP_TOKEN"):
+        os.environ.setdefault(key, "replay")
+    os.environ.update({"CAPTURE_ENABLED": "true", "CAPTURE_SAMPLE_RATE": "1.0", "CAPTURE_DIR": out_dir,
+                       "TRACING_ENABLED": "false"})
+
+    from config import capture
+
+    turns = capture.read_turns(args.captures)
+    if args.limit:
+        turns = turns[:args.limit]
+    if not turns:
+        raise SystemExit("Nenhum turno nas gravações informadas")
+
+    if args.compare:
+        print_comparison(turns, capture.read_turns(args.compare)[:len(turns)], "comparado")
+        return
+
+    session = run_replay(turns, args.live_model)
+    if not capture.flush(timeout=30):
+        print("⚠️ Gravação do replay não terminou a tempo; comparação pode estar incompleta")
+    replayed = capture.read_turns(sorted(str(p) for p in Path(out_dir).glob("turns-*.jsonl.gz")))
+    print_comparison(turns, replayed, "live" if args.live_model else "replay")
+    if session.misses:
+        print("\nChamadas sem correspondência na gravação: "
+              + ", ".join(f"{k}={v}" for k, v in session.misses.most_common()))
+    print(f"\nGravação do replay em {out_dir}")
+
+
+if __name__ == "__main__":
+    main()
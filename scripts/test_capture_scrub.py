@@ -0,0 +1,65 @@
+"""
+Teste da limpeza de PII da captura de turnos (config/capture.py), com
+CPF e telefones do jeito que o cliente digita (com e sem formatação).
+
+Uso:
+  python scripts/test_capture_scrub.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+# Settings exige estas variáveis; o teste não fala com nenhum desses serviços
+for _k in ("POSTGRES_CONNECTION_STRING", "SUPERMERCADO_BASE_URL", "SUPERMERCADO_AUTH_TOKEN", "WHATSAPP_TOKEN"):
+    os.environ.setdefault(_k, "test")
+
+from config.capture import Scrubber  # noqa: E402
+
+TELEFONE = "5585911112222"
+
+# (texto, trecho que não pode sobrar, marcador esperado)
+CASES = [
+    ("meu cpf 52998224725", "52998224725", "[CPF]"),
+    ("cpf: 529.982.247-25", "529.982.247-25", "[CPF]"),
+    ("liga 85999998888", "85999998888", "[TELEFONE]"),
+    ("fixo 8532223344.", "8532223344", "[TELEFONE]"),
+    ("(85) 99999-8888 à tarde", "99999-8888", "[TELEFONE]"),
+    ("meu outro 5585988887777", "5585988887777", "tel_"),
+    ("email joao.silva@gmail.com", "joao.silva", "[EMAIL]"),
+]
+
+# Números que não são PII e precisam continuar no registro
+KEEP = ["ean 7891234567890", "total 1234567890,50", "quero 12 unidades"]
+
+
+def main():
+    scrubber = Scrubber("test")
+    failures = []
+
+    for text, leaked, marker in CASES:
+        out = scrubber.text(text, [])
+        if leaked in out or marker not in out:
+            failures.append(f"{text!r} -> {out!r}")
+
+    for text in KEEP:
+        out = scrubber.text(text, [])
+        if out != text:
+            failures.append(f"{text!r} alterado -> {out!r}")
+
+    record = scrubber.record({"telefone": TELEFONE, "mensagem": "meu número é 85911112222",
+                              "tools": [{"tool": "add_item_tool", "input": {"telefone": TELEFONE}}]})
+    pseudonym = scrubber.pseudonym(TELEFONE)
+    if TELEFONE[2:] in str(record) or record["mensagem"] != f"meu número é {pseudonym}":
+        failures.append(f"telefone do turno -> {record!r}")
+
+    if failures:
+        print("❌ PII vazou na captura:")
+        for line in failures:
+            print(f"  {line}")
+        raise SystemExit(1)
+    print(f"✅ {len(CASES) + len(KEEP) + 1} casos ok")
+
+
+if __name__ == "__main__":
+    main()
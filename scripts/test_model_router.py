@@ -0,0 +1,52 @@
+"""
+Teste da escolha de camada do modelo (services/model_router.py) com
+mensagens como chegam ao agente, inclusive com o aviso de sessão
+("[SESSÃO] ...") que o buffer_loop coloca antes do texto do cliente.
+
+Uso:
+  python scripts/test_model_router.py
+"""
+import os
+import sys
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+# Settings exige estas variáveis; o teste não fala com nenhum desses serviços
+for _k in ("POSTGRES_CONNECTION_STRING", "SUPERMERCADO_BASE_URL", "SUPERMERCADO_AUTH_TOKEN", "WHATSAPP_TOKEN"):
+    os.environ.setdefault(_k, "test")
+# Camada rápida ligada (modelo diferente do LLM_MODEL)
+os.environ["LLM_FAST_MODEL"] = "router-test-fast"
+
+from services import model_router as mr  # noqa: E402
+from tools.redis_tools import ORDER_CONTEXT_MESSAGES  # noqa: E402
+
+# (mensagem, camada esperada)
+CASES = [
+    ("quanto ta o arroz?", mr.TIER_FAST),
+    (f"{ORDER_CONTEXT_MESSAGES['sent']}\n\nobrigado", mr.TIER_FAST),
+    (f"{ORDER_CONTEXT_MESSAGES['expired_sent']}\n\ntem coca 2l?", mr.TIER_FAST),
+    (f"{ORDER_CONTEXT_MESSAGES['new']}\n\noi", mr.TIER_FAST),
+    (f"{ORDER_CONTEXT_MESSAGES['sent']}\n\nquero alterar o endereço", mr.TIER_STRONG),
+    ("pode fechar, vou pagar no pix", mr.TIER_STRONG),
+    ("arroz, feijão, óleo, café, açúcar e leite", mr.TIER_STRONG),
+]
+
+
+def main():
+    failures = []
+    with mock.patch.object(mr, "get_cart_count", return_value=0):
+        for i, (mensagem, expected) in enumerate(CASES):
+            tier, reason = mr.ModelRouter().route(f"55859000000{i:02d}", mensagem)
+            if tier != expected:
+                failures.append(f"{mensagem!r} -> {tier} ({reason}), esperado {expected}")
+    if failures:
+        print("❌ Roteamento de modelo:")
+        for line in failures:
+            print(f"  {line}")
+        raise SystemExit(1)
+    print(f"✅ {len(CASES)} casos ok")
+
+
+if __name__ == "__main__":
+    main()
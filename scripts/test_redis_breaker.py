@@ -0,0 +1,71 @@
+"""
+Teste do circuit breaker do Redis (tools/redis_tools.py): falhas
+esparsas intercaladas com comandos bem-sucedidos nunca abrem o breaker;
+só falhas seguidas abrem.
+
+Uso:
+  python scripts/test_redis_breaker.py
+"""
+import os
+import sys
+from unittest import mock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+# Settings exige estas variáveis; o teste não fala com nenhum desses serviços
+for _k in ("POSTGRES_CONNECTION_STRING", "SUPERMERCADO_BASE_URL", "SUPERMERCADO_AUTH_TOKEN", "WHATSAPP_TOKEN"):
+    os.environ.setdefault(_k, "test")
+
+import redis  # noqa: E402
+
+from tools import redis_tools  # noqa: E402
+from tools.redis_tools import RedisCircuitBreaker  # noqa: E402
+
+TIMEOUT = redis.exceptions.TimeoutError("timeout")
+
+
+def check_alternating(failures: list) -> None:
+    breaker = RedisCircuitBreaker(threshold=3, backoff_base=1.0, backoff_max=30.0)
+    for _ in range(50):
+        breaker.failure(TIMEOUT)
+        breaker.success()
+    if breaker.state != "closed" or breaker.failures != 0:
+        failures.append(f"erro/sucesso alternados abriram o breaker: {breaker.snapshot()}")
+
+
+def check_consecutive(failures: list) -> None:
+    breaker = RedisCircuitBreaker(threshold=3, backoff_base=1.0, backoff_max=30.0)
+    for _ in range(3):
+        breaker.failure(TIMEOUT)
+    if breaker.state != "open":
+        failures.append(f"3 falhas seguidas não abriram o breaker: {breaker.snapshot()}")
+
+
+def check_client_reports_success(failures: list) -> None:
+    """Comando bem-sucedido pelo cliente real zera as falhas do breaker global."""
+    breaker = RedisCircuitBreaker(threshold=3, backoff_base=1.0, backoff_max=30.0)
+    client = redis_tools._BreakerRedis()  # não conecta até o primeiro comando
+    with mock.patch.object(redis_tools, "_breaker", breaker), \
+            mock.patch.object(redis.Redis, "execute_command", return_value="OK"):
+        for _ in range(50):
+            redis_tools._on_redis_error(TIMEOUT)
+            client.set("k", "v")
+    if breaker.state != "closed" or breaker.failures != 0:
+        failures.append(f"comandos ok não zeraram as falhas: {breaker.snapshot()}")
+
+
+def main():
+    failures: list = []
+    checks = (check_alternating, check_consecutive, check_client_reports_success)
+    for check in checks:
+        check(failures)
+    if failures:
+        print("❌ Circuit breaker:")
+        for line in failures:
+            print(f"  {line}")
+        raise SystemExit(1)
+    print(f"✅ {len(checks)} casos ok")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,26 +4,25 @@ Suporta: Texto, Áudio (Transcrição), Imagem (Visão) e PDF (Extração de Tex
 Versão: 1.5.5 (Correção de LID e Buffer Personalizado)
 """
 from fastapi import FastAPI, Request, HTTPException, BackgroundTasks
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel, Field
 from typing import Optional, Dict, Any
 import requests
 from datetime import datetime
 import time
-import random
 import threading
 import re
-import io
-
-# Tenta importar pypdf para leitura de comprovantes
-try:
-    from pypdf import PdfReader
-except ImportError:
-    PdfReader = None
 
 from config.settings import settings
 from config.logger import setup_logger
+from config import capture, metrics, tracing
 from agent_langgraph_simple import run_agent_langgraph as run_agent, get_session_history
+from services.scheduler import scheduler, human_delay
+from services.uaz import get_api_base_url
+from services.media import media_pipeline
+from services import resilient_llm
+from tools.order_outbox import outbox_worker, set_order_notifier, outbox_depth
+from tools.overrides import ean_overrides
 from tools.redis_tools import (
     push_message_to_buffer,
     get_buffer_length,
@@ -34,6 +33,9 @@ from tools.redis_tools import (
     start_order_session,
     refresh_session_ttl,
     get_order_context,
+    get_order_state,
+    ORDER_CONTEXT_MESSAGES,
+    redis_health,
 )
 
 logger = setup_logger(__name__)
@@ -57,141 +59,6 @@ class AgentResponse(BaseModel):
 
 # --- Helpers ---
 
-def get_api_base_url() -> str:
-    """Prioriza UAZ_API_URL > WHATSAPP_API_URL."""
-    return (settings.uaz_api_url or settings.whatsapp_api_url or "").strip().rstrip("/")
-
-def get_media_url_uaz(message_id: str) -> Optional[str]:
-    """Solicita link público da mídia (Imagem/PDF)."""
-    if not message_id: return None
-    base = get_api_base_url()
-    if not base: return None
-
-    try:
-        from urllib.parse import urlparse
-        parsed = urlparse(base)
-        url = f"{parsed.scheme}://{parsed.netloc}/message/download"
-    except:
-        url = f"{base.split('/message')[0]}/message/download"
-
-    headers = {"Content-Type": "application/json", "token": (settings.whatsapp_token or "").strip()}
-    # return_link=True devolve url pública
-    payload = {"id": message_id, "return_link": True, "return_base64": False}
-    
-    try:
-        resp = requests.post(url, headers=headers, json=payload, timeout=15)
-        if resp.status_code == 200:
-            data = resp.json()
-            link = data.get("fileURL") or data.get("url")
-            if link: return link
-    except Exception as e:
-        logger.error(f"Erro ao obter link mídia: {e}")
-    return None
-
-def process_pdf_uaz(message_id: str) -> Optional[str]:
-    """Baixa o PDF e extrai o texto (para leitura do valor)."""
-    if not PdfReader:
-        logger.error("❌ Biblioteca pypdf não instalada. Adicione ao requirements.txt")
-        return "[Erro: sistema não suporta leitura de PDF]"
-
-    url = get_media_url_uaz(message_id)
-    if not url: return None
-    
-    logger.info(f"📄 Processando PDF: {url}")
-    try:
-        # Baixar o arquivo
-        response = requests.get(url, timeout=20)
-        response.raise_for_status()
-        
-        # Ler PDF em memória
-        f = io.BytesIO(response.content)
-        reader = PdfReader(f)
-        
-        text_content = []
-        for page in reader.pages:
-            text_content.append(page.extract_text())
-            
-        full_text = "\n".join(text_content)
-        full_text = re.sub(r'\s+', ' ', full_text).strip()
-        
-        logger.info(f"✅ PDF lido com sucesso ({len(full_text)} chars)")
-        return full_text
-        
-    except Exception as e:
-        logger.error(f"Erro ao ler PDF: {e}")
-        return None
-
-def transcribe_audio_uaz(message_id: str) -> Optional[str]:
-    """
-    Transcreve áudio usando Google Gemini.
-    """
-    if not message_id: return None
-    
-    # 1. Obter URL do áudio via UAZ
-    audio_url = get_media_url_uaz(message_id)
-    if not audio_url:
-        logger.error(f"❌ Não foi possível obter URL do áudio: {message_id}")
-        return None
-    
-    # 2. Baixar o áudio
-    try:
-        audio_response = requests.get(audio_url, timeout=20)
-        audio_response.raise_for_status()
-        audio_data = audio_response.content
-        content_type = audio_response.headers.get('content-type', 'audio/ogg')
-    except Exception as e:
-        logger.error(f"Erro ao baixar áudio para transcrição: {e}")
-        return None
-
-    # 3. Transcrever com Google Gemini
-    if settings.google_api_key:
-        try:
-            from google import genai
-            import tempfile
-            import os
-            
-            client = genai.Client(api_key=settings.google_api_key)
-
-            # Determinar extensão
-            ext_map = {
-                'audio/ogg': '.ogg',
-                'audio/mpeg': '.mp3',
-                'audio/mp4': '.m4a',
-                'audio/wav': '.wav',
-                'audio/webm': '.webm',
-            }
-            ext = ext_map.get(content_type.split(';')[0], '.ogg')
-
-            # Salvar temporariamente
-            with tempfile.NamedTemporaryFile(suffix=ext, delete=False) as tmp:
-                tmp.write(audio_data)
-                tmp_path = tmp.name
-
-            try:
-                # Upload e Transcrição
-                audio_file = client.files.upload(file=tmp_path)
-                response = client.models.generate_content(
-                    model="gemini-2.0-flash-lite",
-                    contents=[
-                        "Transcreva este áudio para texto em português brasileiro. Retorne APENAS o texto transcrito.",
-                        audio_file
-                    ]
-                )
-                transcription = response.text.strip() if response.text else None
-                if transcription:
-                    logger.info(f"✅ Áudio transcrito com Gemini: {transcription[:50]}...")
-                    return transcription
-            finally:
-                if os.path.exists(tmp_path):
-                    os.unlink(tmp_path)
-
-        except Exception as e:
-            logger.error(f"Erro transcrição Gemini: {e}")
-            return None
-
-    logger.warning("❌ Falha na transcrição: chave do Google não configurada ou erro no processo.")
-    return None
-
 def _extract_incoming(payload: Dict[str, Any]) -> Dict[str, Any]:
     """
     Normaliza e processa (Texto, Áudio, Imagem, Documento/PDF).
@@ -269,6 +136,7 @@ def _extract_incoming(payload: Dict[str, Any]) -> Dict[str, Any]:
     mensagem_texto = payload.get("text")
     message_id = payload.get("id") or payload.get("messageid")
     from_me = False
+    media_kind = None  # Mídia a processar em background ("pdf", "audio", "image")
     
     raw_type = str(message_any.get("messageType") or "").lower()
     media_type = str(message_any.get("mediaType") or "").lower()
@@ -308,35 +176,27 @@ def _extract_incoming(payload: Dict[str, Any]) -> Dict[str, Any]:
     # --- Lógica de Mídia ---
     if message_type == "audio" and not mensagem_texto:
         if message_id:
-            trans = transcribe_audio_uaz(message_id)
-            mensagem_texto = f"[Áudio]: {trans}" if trans else "[Áudio inaudível]"
+            # Transcrição roda no pool de áudio (fora da requisição)
+            media_kind = "audio"
         else:
             mensagem_texto = "[Áudio sem ID]"
             
     elif message_type == "image":
         caption = mensagem_texto or ""
         if message_id:
-            url = get_media_url_uaz(message_id)
-            if url: 
-                mensagem_texto = f"{caption} [MEDIA_URL: {url}]".strip()
-            else: 
-                mensagem_texto = f"{caption} [Imagem recebida - erro ao baixar]".strip()
+            # Download + redução da imagem no pipeline de mídia; a legenda segue junto
+            media_kind = "image"
         else:
             mensagem_texto = f"{caption} [Imagem recebida]".strip()
 
     elif message_type == "document":
         if "pdf" in mimetype or (mensagem_texto and ".pdf" in str(mensagem_texto).lower()):
-            pdf_url = get_media_url_uaz(message_id) if message_id else None
-            pdf_text = ""
+            # Download/extração rodam no pipeline de mídia (fora da requisição)
             if message_id:
-                extracted = process_pdf_uaz(message_id)
-                if extracted:
-                    pdf_text = f"\n[Conteúdo PDF]: {extracted[:1200]}..."
-            
-            if pdf_url:
-                mensagem_texto = f"Comprovante/PDF Recebido. {pdf_text} [MEDIA_URL: {pdf_url}]"
+                media_kind = "pdf"
+                mensagem_texto = None
             else:
-                mensagem_texto = f"[PDF sem link] {pdf_text}"
+                mensagem_texto = "[PDF sem link]"
 
     return {
         "telefone": telefone,
@@ -344,9 +204,63 @@ def _extract_incoming(payload: Dict[str, Any]) -> Dict[str, Any]:
         "message_type": message_type,
         "message_id": message_id,
         "from_me": from_me,
+        "media_kind": media_kind,
     }
 
+def _split_message(mensagem: str, max_len: int = 500) -> list:
+    """Divide a resposta em blocos de até `max_len` chars (parágrafos > linhas)."""
+    if len(mensagem) <= max_len:
+        return [mensagem]
+
+    msgs = []
+    # Divide por parágrafos duplos primeiro
+    paragrafos = mensagem.split('\n\n')
+    curr = ""
+    
+    for p in paragrafos:
+        # Se o parágrafo sozinho é muito grande, divide por quebras simples
+        if len(p) > max_len:
+            if curr:
+                msgs.append(curr.strip())
+                curr = ""
+            # Divide parágrafo grande por linhas
+            linhas = p.split('\n')
+            for linha in linhas:
+                if len(curr) + len(linha) + 1 <= max_len:
+                    curr += linha + "\n"
+                else:
+                    if curr: msgs.append(curr.strip())
+                    curr = linha + "\n"
+        elif len(curr) + len(p) + 2 <= max_len:
+            curr += p + "\n\n"
+        else:
+            if curr: msgs.append(curr.strip())
+            curr = p + "\n\n"
+    
+    if curr: msgs.append(curr.strip())
+    return msgs
+
+def _post_chunks(url: str, headers: Dict[str, str], number: str, msgs: list, i: int = 0) -> bool:
+    """Envia o bloco `i` e agenda o próximo (sem segurar thread no intervalo)."""
+    try:
+        payload = {"number": number, "text": msgs[i], "openTicket": "1"}
+        requests.post(url, headers=headers, json=payload, timeout=10)
+    except Exception as e:
+        logger.error(f"Erro envio (bloco {i+1}/{len(msgs)}): {e}")
+        return False
+
+    # Delay entre mensagens para parecer mais natural (exceto última)
+    if i < len(msgs) - 1:
+        delay = human_delay(settings.human_chunk_delay_min, settings.human_chunk_delay_max)
+        scheduler.schedule(delay, _post_chunks, url, headers, number, msgs, i + 1)
+    return True
+
+@tracing.traced("whatsapp.send")
 def send_whatsapp_message(telefone: str, mensagem: str) -> bool:
+    """
+    Envia a resposta dividida em blocos de até 500 chars.
+    O primeiro bloco sai na hora; os demais são agendados no scheduler.
+    """
     base = get_api_base_url()
     if not base: return False
     try:
@@ -358,53 +272,9 @@ def send_whatsapp_message(telefone: str, mensagem: str) -> bool:
     
     headers = {"Content-Type": "application/json", "token": (settings.whatsapp_token or "").strip()}
     
-    # Configuração de split de mensagens
     # Max 500 chars por mensagem para não enviar textões
-    max_len = 500
-    msgs = []
-    
-    if len(mensagem) > max_len:
-        # Divide por parágrafos duplos primeiro
-        paragrafos = mensagem.split('\n\n')
-        curr = ""
-        
-        for p in paragrafos:
-            # Se o parágrafo sozinho é muito grande, divide por quebras simples
-            if len(p) > max_len:
-                if curr:
-                    msgs.append(curr.strip())
-                    curr = ""
-                # Divide parágrafo grande por linhas
-                linhas = p.split('\n')
-                for linha in linhas:
-                    if len(curr) + len(linha) + 1 <= max_len:
-                        curr += linha + "\n"
-                    else:
-                        if curr: msgs.append(curr.strip())
-                        curr = linha + "\n"
-            elif len(curr) + len(p) + 2 <= max_len:
-                curr += p + "\n\n"
-            else:
-                if curr: msgs.append(curr.strip())
-                curr = p + "\n\n"
-        
-        if curr: msgs.append(curr.strip())
-    else:
-        msgs = [mensagem]
-    
-    try:
-        for i, msg in enumerate(msgs):
-            payload = {"number": re.sub(r"\D", "", telefone or ""), "text": msg, "openTicket": "1"}
-            requests.post(url, headers=headers, json=payload, timeout=10)
-            
-            # Delay entre mensagens para parecer mais natural (exceto última)
-            if i < len(msgs) - 1:
-                time.sleep(random.uniform(0.8, 1.5))
-                
-        return True
-    except Exception as e:
-        logger.error(f"Erro envio: {e}")
-        return False
+    msgs = _split_message(mensagem)
+    return _post_chunks(url, headers, re.sub(r"\D", "", telefone or ""), msgs)
 
 # --- Presença & Buffer ---
 presence_sessions = {}
@@ -425,48 +295,61 @@ def send_presence(num, type_):
                      json={"number": re.sub(r"\D","",num), "presence": type_}, timeout=5)
     except: pass
 
-def process_async(tel, msg, mid=None):
+def _deliver_reply(tel: str, txt: Optional[str], recebido_em: Optional[float] = None) -> None:
+    """Para de "digitar" e envia a resposta (executado pelo scheduler)."""
+    num = re.sub(r"\D", "", tel)
+    try:
+        with tracing.span("reply.deliver", chars=len(txt or "")):
+            send_presence(num, "paused")
+            if txt:
+                send_whatsapp_message(tel, txt)
+        if txt and recebido_em is not None:
+            metrics.TURN_LATENCY.observe(time.monotonic() - recebido_em)
+    finally:
+        presence_sessions.pop(num, None)
+
+@tracing.traced("turn.process")
+def process_async(tel, msg, mid=None, recebido_em=None):
     """
     Processa mensagem do Buffer.
-    Fluxo Humano:
-    1. Espera (simula leitura).
-    2. Digita (composing).
+    Fluxo Humano (atrasos agendados, sem time.sleep):
+    1. "Lendo": o agente já começa a rodar durante o tempo de leitura.
+    2. Digita (composing) ao fim da leitura, enquanto a IA termina.
     3. Processa (IA).
-    4. Para de digitar (paused).
+    4. Para de digitar (paused) após a leitura restante + pausa.
     5. Envia.
-    """
-    try:
-        num = re.sub(r"\D", "", tel)
-        
-        # 1. Simular "Lendo" (Delay Humano)
-        tempo_leitura = random.uniform(2.0, 4.0) 
-        time.sleep(tempo_leitura)
 
-        # 2. Começar a "Digitar"
-        send_presence(num, "composing")
-        
-        # 3. Processamento IA
-        res = run_agent(tel, msg)
-        txt = res.get("output", "Erro ao processar.")
-        
-        # 4. Parar "Digitar"
-        send_presence(num, "paused")
-        time.sleep(0.5) # Pausa dramática antes de chegar
+    `recebido_em` (time.monotonic da primeira mensagem do lote) alimenta a
+    métrica mensagem -> resposta.
+    """
+    num = re.sub(r"\D", "", tel)
+    inicio = time.monotonic()
+    recebido_em = recebido_em or inicio
 
-        # 5. Enviar Mensagem
-        send_whatsapp_message(tel, txt)
+    # 1/2. Agenda o "digitando" para o fim da leitura simulada
+    tempo_leitura = human_delay(settings.human_read_delay_min, settings.human_read_delay_max)
+    digitando = scheduler.schedule(tempo_leitura, send_presence, num, "composing")
 
+    try:
+        # 3. Processamento IA (sobreposto à leitura)
+        with tracing.span("agent.run", chars=len(msg)):
+            res = run_agent(tel, msg)
+        txt = res.get("output", "Erro ao processar.")
     except Exception as e:
         logger.error(f"Erro async: {e}")
-    finally:
-        # Garante limpeza
-        send_presence(tel, "paused")
-        presence_sessions.pop(re.sub(r"\D", "", tel), None)
+        digitando.cancel()
+        scheduler.schedule(0, tracing.wrap(_deliver_reply), tel, None)
+        return
+
+    # 4/5. Se a IA foi mais rápida que a leitura, espera só o restante
+    restante = max(0.0, tempo_leitura - (time.monotonic() - inicio))
+    scheduler.schedule(restante + settings.human_send_pause, tracing.wrap(_deliver_reply), tel, txt, recebido_em)
 
+@tracing.traced("buffer_loop")
 def buffer_loop(tel):
     """
-    Loop do Buffer (3 ciclos de 5s = 15 segundos)
-    Total espera máxima: ~15 segundos
+    Loop do Buffer (BUFFER_STALL_CYCLES ciclos de BUFFER_POLL_INTERVAL;
+    padrão 3 x 5s = ~15 segundos sem mensagem nova)
     
     IMPORTANTE: Após processar, verifica se chegaram novas mensagens durante
     a execução do agente e as processa também (evita mensagens "perdidas").
@@ -482,14 +365,25 @@ def buffer_loop(tel):
                 break
                 
             stall = 0
+            recebido_em = time.monotonic()
             
-            # Esperar por mais mensagens (3 ciclos de 3.5s)
-            while stall < 3:
-                time.sleep(5)  # 3 ciclos de 5s = 15 segundos total
-                curr = get_buffer_length(n)
-                if curr > prev: prev, stall = curr, 0
-                else: stall += 1
+            # Esperar por mais mensagens (BUFFER_STALL_CYCLES ciclos sem novidade)
+            with tracing.span("buffer.wait") as sp:
+                while stall < settings.buffer_stall_cycles:
+                    time.sleep(settings.buffer_poll_interval)
+                    curr = get_buffer_length(n)
+                    if curr > prev: prev, stall = curr, 0
+                    else: stall += 1
+                sp.set(mensagens=prev)
+            metrics.BUFFER_WAIT.observe(time.monotonic() - recebido_em)
             
+            # Cooldown só leitura, antes de consumir o buffer
+            em_cooldown, _ = is_agent_in_cooldown(n)
+            if em_cooldown:
+                # Atendente humano assumiu durante a espera do buffer: mensagens ficam no buffer
+                logger.info(f"🙋 Cooldown ativo para {n}; IA não responde este lote")
+                break
+
             # Consumir e processar mensagens
             msgs = pop_all_messages(n)
             # Usa ' | ' como separador para o agente entender que são itens/pedidos separados
@@ -497,14 +391,22 @@ def buffer_loop(tel):
             
             if not final:
                 break
+
+            # Transição da sessão de pedido só com lote real (script Lua também checa o cooldown)
+            code, em_cooldown, _ = get_order_state(n)
+            if em_cooldown:
+                # Cooldown entrou entre a checagem e o pop: devolve o lote ao buffer
+                for m in msgs:
+                    push_message_to_buffer(n, m)
+                logger.info(f"🙋 Cooldown ativo para {n}; IA não responde este lote")
+                break
                 
-            # Obter contexto de sessão
-            order_ctx = get_order_context(n)
+            order_ctx = ORDER_CONTEXT_MESSAGES.get(code, "")
             if order_ctx:
                 final = f"{order_ctx}\n\n{final}"
             
             # Processar (enquanto isso, novas mensagens podem chegar)
-            process_async(n, final)
+            process_async(n, final, recebido_em=recebido_em)
             
             # Após processar, o loop vai verificar se tem novas mensagens
             # Se tiver, processa novamente. Se não, sai.
@@ -514,12 +416,80 @@ def buffer_loop(tel):
     finally: 
         buffer_sessions.pop(re.sub(r"\D","",tel), None)
 
+def enqueue_message(num: str, txt: str) -> str:
+    """
+    Coloca a mensagem no buffer do cliente e garante um buffer_loop ativo.
+    Usado pelo webhook e pelos callbacks do pipeline de mídia.
+
+    Returns:
+        Status textual ("cooldown", "buffering").
+    """
+    # NOTA: 'send_presence' imediato removido para evitar comportamento robótico.
+    # O cliente verá 'digitando' apenas após o buffer, no process_async.
+
+    active, _ = is_agent_in_cooldown(num)
+    if active:
+        push_message_to_buffer(num, txt)
+        return "cooldown"
+
+    try:
+        if not presence_sessions.get(num):
+            presence_sessions[num] = True
+    except: pass
+
+    if push_message_to_buffer(num, txt):
+        if not buffer_sessions.get(num):
+            buffer_sessions[num] = True
+            threading.Thread(target=tracing.wrap(buffer_loop), args=(num,), daemon=True).start()
+    else:
+        threading.Thread(target=tracing.wrap(process_async), args=(num, txt), daemon=True).start()
+
+    return "buffering"
+
+# --- Pedidos (outbox) ---
+ORDER_CONFIRMED_MSG = "✅ Seu pedido foi confirmado e já está com a nossa equipe! Obrigada! 💚"
+ORDER_FAILED_MSG = "⚠️ Tive um problema para registrar seu pedido no sistema. Nossa equipe vai entrar em contato para confirmar, tudo bem?"
+
+def _notify_order(tel: str, status: str, detalhe: str) -> None:
+    """Chamado pelo worker da outbox quando o painel confirma (ou recusa) o pedido."""
+    txt = ORDER_CONFIRMED_MSG if status == "sent" else ORDER_FAILED_MSG
+    send_whatsapp_message(tel, txt)
+    try: get_session_history(tel).add_ai_message(txt)
+    except Exception as e: logger.error(f"Erro ao salvar aviso de pedido no histórico: {e}")
+
+set_order_notifier(_notify_order)
+
+def _refresh_gauges() -> None:
+    metrics.ACTIVE_CONVERSATIONS.set(len(buffer_sessions))
+    metrics.QUEUE_DEPTH.labels("scheduler").set(scheduler.pending())
+    metrics.QUEUE_DEPTH.labels("order_outbox").set(outbox_depth())
+
+metrics.on_scrape(_refresh_gauges)
+
+@app.on_event("startup")
+async def _start_background_workers():
+    outbox_worker.start()
+
+@app.on_event("shutdown")
+async def _stop_background_workers():
+    outbox_worker.stop()
+
 # --- Endpoints ---
 @app.get("/")
 async def root(): return {"status":"online", "ver":"1.5.5"}
 
 @app.get("/health")
-async def health(): return {"status":"healthy", "ts":datetime.now().isoformat()}
+async def health():
+    redis_info = redis_health()
+    status = "healthy" if redis_info["state"] == "closed" else "degraded"
+    return {"status": status, "ts": datetime.now().isoformat(), "redis": redis_info,
+            "ean_overrides": ean_overrides.stats(), "capture": capture.writer_stats(),
+            "llm_providers": resilient_llm.health_stats()}
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
 
 @app.post("/")
 @app.post("/webhook/whatsapp")
@@ -528,10 +498,11 @@ async def webhook(req: Request, tasks: BackgroundTasks):
         pl = await req.json()
         data = _extract_incoming(pl)
         tel, txt, from_me = data["telefone"], data["mensagem_texto"], data["from_me"]
+        media_kind = data.get("media_kind")
 
-        if not tel or not txt: return JSONResponse(content={"status":"ignored"})
+        if not tel or not (txt or media_kind): return JSONResponse(content={"status":"ignored"})
         
-        logger.info(f"In: {tel} | {data['message_type']} | {txt[:50]}")
+        logger.info("In: %s | %s | %.50s", tel, data['message_type'], txt or media_kind)
 
         if from_me:
             # Detectar Human Takeover: Se o número do agente enviou mensagem
@@ -547,33 +518,28 @@ async def webhook(req: Request, tasks: BackgroundTasks):
                     set_agent_cooldown(tel, ttl)
                     logger.info(f"🙋 Human Takeover ativado para {tel} - IA pausa por {ttl//60}min")
             
-            try: get_session_history(tel).add_ai_message(txt)
-            except: pass
+            if txt:
+                try: get_session_history(tel).add_ai_message(txt)
+                except: pass
             return JSONResponse(content={"status":"ignored_self"})
 
         num = re.sub(r"\D","",tel)
-        
-        # NOTA: 'send_presence' imediato removido para evitar comportamento robótico.
-        # O cliente verá 'digitando' apenas após o buffer, no process_async.
-
-        active, _ = is_agent_in_cooldown(num)
-        if active:
-            push_message_to_buffer(num, txt)
-            return JSONResponse(content={"status":"cooldown"})
-
-        try:
-            if not presence_sessions.get(num):
-                presence_sessions[num] = True
-        except: pass
-
-        if push_message_to_buffer(num, txt):
-            if not buffer_sessions.get(num):
-                buffer_sessions[num] = True
-                threading.Thread(target=buffer_loop, args=(num,), daemon=True).start()
-        else:
-            tasks.add_task(process_async, tel, txt)
-
-        return JSONResponse(content={"status":"buffering"})
+        capture.note_inbound(num, pl)
+
+        # Início do trace do turno: segue para buffer_loop, agente, tools e envio
+        with tracing.span("webhook", root=True, telefone=num, tipo=data["message_type"]):
+            if media_kind:
+                # Responde já; o texto extraído/transcrito entra no buffer quando ficar pronto
+                on_ready = tracing.wrap(lambda texto: enqueue_message(num, texto))
+                if media_kind == "audio":
+                    media_pipeline.submit_audio(data["message_id"], on_ready)
+                elif media_kind == "image":
+                    media_pipeline.submit_image(data["message_id"], txt or "", on_ready)
+                else:
+                    media_pipeline.submit_pdf(data["message_id"], on_ready)
+                return JSONResponse(content={"status":"processing_media"})
+
+            return JSONResponse(content={"status": enqueue_message(num, txt)})
     except Exception as e:
         logger.error(f"Erro webhook: {e}")
         return JSONResponse(status_code=500, detail=str(e))
@@ -0,0 +1,21 @@
+"""
+Serviços de infraestrutura do Agente de Supermercado (agendamento, mídia, etc.)
+"""
+from .cache import TTLCache
+from .scheduler import scheduler, human_delay, DelayScheduler
+from .uaz import get_api_base_url, get_media_url_uaz
+from .media import media_pipeline, MediaPipeline
+from .gemini import get_genai_client, get_latency_stats
+
+__all__ = [
+    'TTLCache',
+    'scheduler',
+    'human_delay',
+    'DelayScheduler',
+    'get_api_base_url',
+    'get_media_url_uaz',
+    'media_pipeline',
+    'MediaPipeline',
+    'get_genai_client',
+    'get_latency_stats',
+]
@@ -0,0 +1,218 @@
+"""
+Cliente Gemini compartilhado (transcrição, File Search e modelo de chat)
+
+- Um único `genai.Client` criado sob demanda (import e autenticação uma vez).
+- Uma `requests.Session` com pool de conexões para as chamadas REST.
+- Limite de concorrência para transcrição/File Search
+  (GEMINI_MAX_CONCURRENCY) e outro, separado, para o modelo de chat
+  (GEMINI_CHAT_MAX_CONCURRENCY): pico de conversas não trava mídia.
+- Retry com backoff exponencial em 429/503.
+- Métricas de latência por operação (`get_latency_stats()`).
+"""
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, TypeVar
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config.settings import settings
+from config.logger import setup_logger
+from config import metrics
+
+logger = setup_logger(__name__)
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS = (429, 503)
+
+_client = None
+_client_lock = threading.Lock()
+_session: Optional[requests.Session] = None
+_semaphore = threading.BoundedSemaphore(max(1, settings.gemini_max_concurrency))
+_chat_semaphore = threading.BoundedSemaphore(max(1, settings.gemini_chat_max_concurrency))
+
+
+# ============================================
+# Métricas de latência
+# ============================================
+
+class LatencyStats:
+    """Contadores e janela recente de latências de uma operação."""
+
+    __slots__ = ("count", "errors", "total", "max", "recent")
+
+    def __init__(self, window: int = 200):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent: deque = deque(maxlen=window)
+
+    def observe(self, seconds: float, ok: bool = True) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.recent.append(seconds)
+        if not ok:
+            self.errors += 1
+
+    def snapshot(self) -> Dict[str, float]:
+        ordered = sorted(self.recent)
+        def pct(p: float) -> float:
+            return ordered[min(len(ordered) - 1, int(p * len(ordered)))] if ordered else 0.0
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg": self.total / self.count if self.count else 0.0,
+            "p50": pct(0.50),
+            "p95": pct(0.95),
+            "max": self.max,
+        }
+
+
+_stats: Dict[str, LatencyStats] = {}
+_stats_lock = threading.Lock()
+
+
+def record_latency(op: str, seconds: float, ok: bool = True) -> None:
+    with _stats_lock:
+        _stats.setdefault(op, LatencyStats()).observe(seconds, ok)
+    metrics.GEMINI_LATENCY.labels(op, "ok" if ok else "error").observe(seconds)
+
+
+def get_latency_stats() -> Dict[str, Dict[str, float]]:
+    """Resumo de latência por operação (transcription, file_search, chat...)."""
+    with _stats_lock:
+        return {op: st.snapshot() for op, st in _stats.items()}
+
+
+# ============================================
+# Clientes (SDK e REST)
+# ============================================
+
+def get_genai_client():
+    """Retorna o `genai.Client` compartilhado (criado na primeira chamada)."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from google import genai
+                _client = genai.Client(api_key=settings.google_api_key)
+                logger.info("Cliente Gemini inicializado")
+    return _client
+
+
+def get_http_session() -> requests.Session:
+    """Sessão HTTP com pool de conexões para a API REST do Gemini."""
+    global _session
+    if _session is None:
+        with _client_lock:
+            if _session is None:
+                session = requests.Session()
+                size = max(1, settings.gemini_max_concurrency)
+                session.mount("https://", HTTPAdapter(pool_connections=size, pool_maxsize=size))
+                session.mount("http://", HTTPAdapter(pool_connections=size, pool_maxsize=size))
+                _session = session
+    return _session
+
+
+def _status_of(error: Exception) -> Optional[int]:
+    """Extrai o status HTTP de erros do SDK (`code`) ou do requests (`response`)."""
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    if code is None and getattr(error, "response", None) is not None:
+        code = getattr(error.response, "status_code", None)
+    try:
+        return int(code) if code is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def call_with_retry(op: str, fn: Callable[[], T]) -> T:
+    """
+    Executa `fn` respeitando o limite de concorrência, com retry em 429/503.
+    Cada tentativa é registrada nas métricas da operação `op`.
+    """
+    attempts = max(1, settings.gemini_max_retries + 1)
+    for attempt in range(attempts):
+        start = time.perf_counter()
+        with _semaphore:
+            try:
+                result = fn()
+                record_latency(op, time.perf_counter() - start)
+                return result
+            except Exception as e:
+                record_latency(op, time.perf_counter() - start, ok=False)
+                status = _status_of(e)
+                if status not in RETRYABLE_STATUS or attempt == attempts - 1:
+                    raise
+        delay = min(settings.gemini_backoff_max, settings.gemini_backoff_base * (2 ** attempt))
+        delay *= random.uniform(0.5, 1.0)
+        logger.warning(f"Gemini {op}: status {status}, nova tentativa em {delay:.1f}s ({attempt + 1}/{attempts - 1})")
+        time.sleep(delay)
+    raise RuntimeError("unreachable")
+
+
+def generate_content(model: str, contents: Any, op: str = "generate", **kwargs: Any) -> Any:
+    """`client.models.generate_content` pelo cliente compartilhado."""
+    client = get_genai_client()
+    return call_with_retry(op, lambda: client.models.generate_content(model=model, contents=contents, **kwargs))
+
+
+def part_from_bytes(data: bytes, mime_type: str) -> Any:
+    """Conteúdo binário inline (áudio/imagem) para o SDK, sem arquivo temporário."""
+    from google.genai import types
+    return types.Part.from_bytes(data=data, mime_type=mime_type)
+
+
+class _RetryableHTTPError(Exception):
+    def __init__(self, response: requests.Response):
+        super().__init__(f"HTTP {response.status_code}")
+        self.response = response
+
+
+def rest_generate_content(model: str, payload: Dict[str, Any], op: str = "generate_rest",
+                          timeout: Optional[float] = None) -> requests.Response:
+    """
+    POST em `models/{model}:generateContent` pela sessão compartilhada.
+    Para recursos ainda não expostos no SDK (ex: fileSearch).
+    Retorna a última resposta (o chamador trata status != 200).
+    """
+    base = (settings.gemini_api_base_url or "").rstrip("/")
+    url = f"{base}/models/{model}:generateContent"
+    headers = {"x-goog-api-key": settings.google_api_key or ""}
+    session = get_http_session()
+
+    def _post() -> requests.Response:
+        resp = session.post(url, json=payload, headers=headers, timeout=timeout or settings.gemini_timeout)
+        if resp.status_code in RETRYABLE_STATUS:
+            raise _RetryableHTTPError(resp)
+        return resp
+
+    try:
+        return call_with_retry(op, _post)
+    except _RetryableHTTPError as e:
+        return e.response
+
+
+# ============================================
+# Modelo de chat (LangChain)
+# ============================================
+
+@contextmanager
+def chat_slot() -> Iterator[None]:
+    """
+    Vaga no limite do modelo de chat durante a chamada (liberada no
+    `finally`, mesmo com erro/timeout) e latência como operação "chat".
+    """
+    with _chat_semaphore:
+        start = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            record_latency("chat", time.perf_counter() - start, ok)
@@ -0,0 +1,283 @@
+"""
+Pipeline de mídia recebida pelo WhatsApp (fora do caminho da requisição)
+
+- Resolve o link público UMA vez por message_id (cache).
+- Baixa UMA vez, em streaming e com limite de tamanho.
+- Extrai texto apenas das N primeiras páginas do PDF em um pool de processos.
+- Transcreve áudios em um pool limitado, enviando os bytes direto da memória
+  e reaproveitando transcrições pelo message_id / hash do conteúdo.
+- Reduz e recomprime imagens (lado máximo configurável) antes da visão; o
+  agente recebe os bytes compactos inline via tag [IMAGEM: message_id].
+- O webhook só agenda o trabalho; o texto final entra no buffer via callback.
+"""
+import hashlib
+import io
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional, Tuple
+
+import requests
+
+from config.settings import settings
+from config.logger import setup_logger
+from config import metrics
+from services import gemini
+from services.cache import TTLCache
+from services.uaz import get_media_url_uaz
+
+logger = setup_logger(__name__)
+
+# Tenta importar pypdf para leitura de comprovantes
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+# Pillow é opcional: sem ele a imagem segue no tamanho original
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Tag injetada na mensagem para o agente buscar a imagem no cache
+IMAGE_TAG = "[IMAGEM: {}]"
+
+
+class MediaTooLarge(Exception):
+    """Arquivo excede o limite configurado (MEDIA_MAX_BYTES)."""
+
+
+class MediaFallback(str):
+    """Texto de falha (link, download, leitura): vai para o agente, mas não para o cache."""
+
+
+def download_media(url: str, max_bytes: int) -> Tuple[bytes, str]:
+    """
+    Baixa a mídia em streaming, abortando se passar de `max_bytes`.
+
+    Returns:
+        (conteúdo, content-type)
+    """
+    with requests.get(url, stream=True, timeout=20) as resp:
+        resp.raise_for_status()
+        declared = resp.headers.get("content-length")
+        if declared and declared.isdigit() and int(declared) > max_bytes:
+            raise MediaTooLarge(f"{declared} bytes > {max_bytes}")
+
+        buf = io.BytesIO()
+        for chunk in resp.iter_content(chunk_size=64 * 1024):
+            buf.write(chunk)
+            if buf.tell() > max_bytes:
+                raise MediaTooLarge(f"> {max_bytes} bytes")
+        return buf.getvalue(), resp.headers.get("content-type", "")
+
+
+def extract_pdf_text(data: bytes, max_pages: int) -> str:
+    """Extrai o texto das `max_pages` primeiras páginas (roda no pool de processos)."""
+    reader = PdfReader(io.BytesIO(data))
+    text_content = []
+    for page in reader.pages[:max_pages]:
+        text_content.append(page.extract_text() or "")
+    return re.sub(r'\s+', ' ', "\n".join(text_content)).strip()
+
+
+# Prompt usado na transcrição
+TRANSCRIPTION_PROMPT = "Transcreva este áudio para texto em português brasileiro. Retorne APENAS o texto transcrito."
+
+
+def transcribe_audio_bytes(data: bytes, mime_type: str) -> Optional[str]:
+    """Transcreve áudio com Google Gemini a partir dos bytes em memória (sem arquivo temporário)."""
+    if not settings.google_api_key:
+        logger.warning("❌ Falha na transcrição: chave do Google não configurada.")
+        return None
+
+    response = gemini.generate_content(
+        settings.transcription_model,
+        [TRANSCRIPTION_PROMPT, gemini.part_from_bytes(data, mime_type)],
+        op="transcription",
+    )
+    return response.text.strip() if response.text else None
+
+
+def downscale_image(data: bytes, max_side: int, quality: int) -> Tuple[bytes, str]:
+    """
+    Reduz a imagem para caber em `max_side` pixels e recomprime em JPEG.
+    Retorna os bytes originais se o Pillow não estiver disponível.
+    """
+    if Image is None:
+        return data, "image/jpeg"
+    with Image.open(io.BytesIO(data)) as img:
+        img.thumbnail((max_side, max_side))
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=quality, optimize=True)
+    return out.getvalue(), "image/jpeg"
+
+
+class MediaPipeline:
+    """Orquestra resolução de link, download e extração de mídia em background."""
+
+    def __init__(self):
+        self._io_pool = ThreadPoolExecutor(max_workers=settings.media_workers, thread_name_prefix="media")
+        # Pool separado: áudio lento não atrasa PDFs/imagens (nem o texto)
+        self._audio_pool = ThreadPoolExecutor(max_workers=settings.audio_workers, thread_name_prefix="audio")
+        self._cpu_pool: Optional[ProcessPoolExecutor] = None
+        self._cpu_lock = threading.Lock()
+        self._urls = TTLCache(settings.media_cache_size, settings.media_cache_ttl)
+        self._results = TTLCache(settings.media_cache_size, settings.media_cache_ttl)
+        self._transcripts = TTLCache(settings.media_cache_size, settings.media_cache_ttl)  # sha1 -> texto
+        self._images = TTLCache(settings.media_cache_size, settings.media_cache_ttl)  # message_id -> (bytes, mime)
+        for name in ("urls", "results", "transcripts", "images"):
+            metrics.register_cache(f"media_{name}", getattr(self, f"_{name}"))
+        self._inflight: set = set()
+        self._inflight_lock = threading.Lock()
+
+    def _get_cpu_pool(self) -> ProcessPoolExecutor:
+        with self._cpu_lock:
+            if self._cpu_pool is None:
+                self._cpu_pool = ProcessPoolExecutor(max_workers=settings.media_pdf_processes)
+            return self._cpu_pool
+
+    def resolve_url(self, message_id: str) -> Optional[str]:
+        """Link público da mídia, consultando a UAZ no máximo uma vez por message_id."""
+        url = self._urls.get(message_id)
+        if url is None:
+            url = get_media_url_uaz(message_id)
+            if url:
+                self._urls.set(message_id, url)
+        return url
+
+    def _run(self, key: str, job: Callable[[], Optional[str]], on_ready: Callable[[str], None]) -> None:
+        try:
+            texto = self._results.get(key)
+            if texto is None:
+                texto = job()
+                # Falha pode ser passageira: a reentrega do webhook tenta de novo
+                if texto and not isinstance(texto, MediaFallback):
+                    self._results.set(key, texto)
+            if texto:
+                on_ready(texto)
+        except Exception as e:
+            logger.error(f"Erro no pipeline de mídia ({key}): {e}")
+        finally:
+            with self._inflight_lock:
+                self._inflight.discard(key)
+
+    def _submit(self, key: str, job: Callable[[], Optional[str]], on_ready: Callable[[str], None],
+                pool: Optional[ThreadPoolExecutor] = None) -> bool:
+        """Agenda o job, ignorando duplicatas em andamento (reentrega do webhook)."""
+        with self._inflight_lock:
+            if key in self._inflight:
+                logger.info(f"Mídia {key} já em processamento; ignorando duplicata")
+                return False
+            self._inflight.add(key)
+        (pool or self._io_pool).submit(self._run, key, job, on_ready)
+        return True
+
+    # --- PDF ---
+
+    def _process_pdf(self, message_id: str) -> str:
+        pdf_url = self.resolve_url(message_id)
+        if not pdf_url:
+            return MediaFallback("[PDF sem link]")
+
+        logger.info(f"📄 Processando PDF: {pdf_url}")
+        pdf_text = ""
+        ok = False
+        if not PdfReader:
+            logger.error("❌ Biblioteca pypdf não instalada. Adicione ao requirements.txt")
+            pdf_text = "\n[Erro: sistema não suporta leitura de PDF]"
+        else:
+            try:
+                data, _ = download_media(pdf_url, settings.media_max_bytes)
+                future = self._get_cpu_pool().submit(extract_pdf_text, data, settings.media_pdf_max_pages)
+                extracted = future.result(timeout=settings.media_pdf_timeout)
+                logger.info(f"✅ PDF lido com sucesso ({len(extracted)} chars)")
+                ok = True
+                if extracted:
+                    pdf_text = f"\n[Conteúdo PDF]: {extracted[:1200]}..."
+            except MediaTooLarge as e:
+                logger.warning(f"PDF ignorado (muito grande): {e}")
+            except Exception as e:
+                logger.error(f"Erro ao ler PDF: {e}")
+
+        texto = f"Comprovante/PDF Recebido. {pdf_text} [MEDIA_URL: {pdf_url}]"
+        return texto if ok else MediaFallback(texto)
+
+    def submit_pdf(self, message_id: str, on_ready: Callable[[str], None]) -> bool:
+        return self._submit(f"pdf:{message_id}", lambda: self._process_pdf(message_id), on_ready)
+
+    # --- Áudio ---
+
+    def _process_audio(self, message_id: str) -> str:
+        # 1. Obter URL do áudio via UAZ
+        audio_url = self.resolve_url(message_id)
+        if not audio_url:
+            logger.error(f"❌ Não foi possível obter URL do áudio: {message_id}")
+            return MediaFallback("[Áudio inaudível]")
+
+        # 2. Baixar o áudio (em memória)
+        try:
+            data, content_type = download_media(audio_url, settings.media_max_bytes)
+        except Exception as e:
+            logger.error(f"Erro ao baixar áudio para transcrição: {e}")
+            return MediaFallback("[Áudio inaudível]")
+
+        # 3. Mesmo conteúdo (ex: áudio encaminhado) reaproveita a transcrição
+        digest = hashlib.sha1(data).hexdigest()
+        transcription = self._transcripts.get(digest)
+        if transcription is None:
+            try:
+                mime_type = (content_type or "audio/ogg").split(";")[0].strip() or "audio/ogg"
+                transcription = transcribe_audio_bytes(data, mime_type)
+            except Exception as e:
+                logger.error(f"Erro transcrição Gemini: {e}")
+                transcription = None
+            if transcription:
+                self._transcripts.set(digest, transcription)
+                logger.info(f"✅ Áudio transcrito com Gemini: {transcription[:50]}...")
+        else:
+            logger.info(f"♻️ Transcrição reaproveitada (hash {digest[:8]})")
+
+        return f"[Áudio]: {transcription}" if transcription else MediaFallback("[Áudio inaudível]")
+
+    def submit_audio(self, message_id: str, on_ready: Callable[[str], None]) -> bool:
+        return self._submit(f"audio:{message_id}", lambda: self._process_audio(message_id), on_ready,
+                            pool=self._audio_pool)
+
+    # --- Imagem ---
+
+    def load_image(self, message_id: str) -> Optional[Tuple[bytes, str]]:
+        """Bytes compactos da imagem (cache por message_id; baixa e reduz se faltar)."""
+        cached = self._images.get(message_id)
+        if cached is not None:
+            return cached
+
+        url = self.resolve_url(message_id)
+        if not url:
+            return None
+        try:
+            data, _ = download_media(url, settings.media_max_bytes)
+            original = len(data)
+            image = downscale_image(data, settings.image_max_side, settings.image_jpeg_quality)
+        except Exception as e:
+            logger.error(f"Erro ao preparar imagem {message_id}: {e}")
+            return None
+
+        logger.info(f"🖼️ Imagem {message_id}: {original // 1024}KB -> {len(image[0]) // 1024}KB")
+        self._images.set(message_id, image)
+        return image
+
+    def _process_image(self, message_id: str, caption: str) -> str:
+        if self.load_image(message_id) is None:
+            return MediaFallback(f"{caption} [Imagem recebida - erro ao baixar]".strip())
+        return f"{caption} {IMAGE_TAG.format(message_id)}".strip()
+
+    def submit_image(self, message_id: str, caption: str, on_ready: Callable[[str], None]) -> bool:
+        return self._submit(f"image:{message_id}", lambda: self._process_image(message_id, caption), on_ready)
+
+
+# Instância global usada pelo servidor
+media_pipeline = MediaPipeline()
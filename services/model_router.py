@@ -0,0 +1,99 @@
+"""
+Escolha do modelo por turno: camada rápida/barata (LLM_FAST_MODEL) para
+turnos simples de carrinho e preço, LLM_MODEL (forte) quando o turno pede.
+
+Vai para o modelo forte quando há:
+- mídia (imagem, PDF/comprovante) no turno;
+- sinal de falha: turno anterior estourou o orçamento ou deu erro, ou o
+  agente vem se confundindo (CONFUSION_PATTERNS nas últimas respostas);
+- mensagem longa, lista com muitos itens ou intenção de várias etapas
+  (fechar pedido, pagamento, endereço, alteração, reclamação);
+- carrinho grande (resumos e fechamento ficam com o modelo forte).
+
+A decisão olha só o texto do cliente: o aviso de sessão ("[SESSÃO] ...",
+ORDER_CONTEXT_MESSAGES) que o buffer_loop coloca antes da mensagem é
+ignorado.
+
+Sem LLM_FAST_MODEL configurado todo turno usa LLM_MODEL.
+"""
+import re
+from typing import Sequence, Tuple
+
+from config.settings import settings
+from config.logger import setup_logger
+from memory.limited_postgres_memory import CONFUSION_PATTERNS
+from services.cache import TTLCache
+from tools.redis_tools import get_cart_count
+
+logger = setup_logger(__name__)
+
+TIER_FAST = "fast"
+TIER_STRONG = "strong"
+
+_MEDIA_MARKERS = ("[IMAGEM:", "[MEDIA_URL:", "Comprovante/PDF", "[Conteúdo PDF]")
+# Intenções que pedem várias etapas ou cuidado (fechamento, pagamento, alteração, reclamação)
+_COMPLEX_RE = re.compile(
+    r"\b(finaliz|fech|pix|cart[aã]o|troco|endere[cç]|entreg|alter|troc|cancel|reclam|errad|falt|devolv)\w*",
+    re.IGNORECASE,
+)
+# Linhas de contexto injetadas pelo servidor antes do texto do cliente
+_SESSION_CONTEXT_RE = re.compile(r"^\[SESSÃO\][^\n]*\n*", re.MULTILINE)
+_ITEM_SPLIT_RE = re.compile(r"[,;\n]|\s+e\s+")
+_MAX_FAST_ITEMS = 4
+
+
+class ModelRouter:
+    """Decide a camada do turno e guarda escalonamentos pendentes por telefone."""
+
+    def __init__(self):
+        # Telefone -> motivo da falha no turno anterior (vale para o próximo turno)
+        self._escalated = TTLCache(max_items=2000, ttl_seconds=1800)
+
+    @staticmethod
+    def enabled() -> bool:
+        fast = (settings.llm_fast_model or "").strip()
+        return bool(fast) and fast != settings.llm_model
+
+    @staticmethod
+    def model_for(tier: str) -> str:
+        return settings.llm_fast_model if tier == TIER_FAST and ModelRouter.enabled() else settings.llm_model
+
+    def route(self, telefone: str, mensagem: str, recent_replies: Sequence[str] = ()) -> Tuple[str, str]:
+        """(camada, motivo) para o turno."""
+        mensagem = _SESSION_CONTEXT_RE.sub("", mensagem).strip()
+        if not self.enabled():
+            return TIER_STRONG, "sem_camada_rapida"
+
+        failure = self._escalated.get(telefone)
+        if failure:
+            self._escalated.set(telefone, "")
+            return TIER_STRONG, f"falha_anterior:{failure}"
+
+        if any(marker in mensagem for marker in _MEDIA_MARKERS):
+            return TIER_STRONG, "midia"
+
+        recent = " ".join(recent_replies).lower()
+        if recent and any(pattern in recent for pattern in CONFUSION_PATTERNS):
+            return TIER_STRONG, "confusao"
+
+        if len(mensagem) > settings.llm_fast_max_chars:
+            return TIER_STRONG, "mensagem_longa"
+
+        if len([p for p in _ITEM_SPLIT_RE.split(mensagem) if p.strip()]) > _MAX_FAST_ITEMS:
+            return TIER_STRONG, "muitos_itens"
+
+        if _COMPLEX_RE.search(mensagem):
+            return TIER_STRONG, "intencao_complexa"
+
+        if get_cart_count(telefone) > settings.llm_fast_max_cart_items:
+            return TIER_STRONG, "carrinho_grande"
+
+        return TIER_FAST, "simples"
+
+    def escalate(self, telefone: str, reason: str) -> None:
+        """Próximo turno desse telefone vai para o modelo forte."""
+        self._escalated.set(telefone, reason)
+        logger.info(f"⬆️ Próximo turno de {telefone} escalado para o modelo forte ({reason})")
+
+
+model_router = ModelRouter()
@@ -0,0 +1,204 @@
+"""
+Modelo de chat resiliente: provedor principal + secundário (LLM_FALLBACK_*)
+
+- Hedging: se o principal não respondeu dentro do p95 recente dele
+  (limitado a LLM_HEDGE_MIN_DELAY..LLM_HEDGE_MAX_DELAY), dispara a mesma
+  requisição no secundário e fica com a primeira resposta válida. O prazo
+  conta a partir do início real da chamada: espera na fila do pool
+  (LLM_HEDGE_WORKERS) não dispara backup.
+- Failover: erro do principal vai direto para o secundário; se a taxa de
+  sucesso recente do principal cair abaixo de LLM_FAILOVER_MIN_SCORE e o
+  secundário estiver melhor, a ordem se inverte até ele se recuperar.
+- Saúde por provedor (janela das últimas LLM_HEALTH_WINDOW chamadas)
+  exportada em /metrics e /health.
+
+Para o LangChain é um único BaseChatModel: callbacks do turno (spans,
+métricas, captura, contagem de tokens) veem só a resposta vencedora, com
+o llm_output dela (modelo e uso de tokens para o custo por camada). A
+chamada perdedora não é cancelada (HTTP em andamento); o resultado dela só
+alimenta a saúde do provedor.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatResult
+from langchain_core.runnables import RunnableBinding
+
+from config.settings import settings
+from config.logger import setup_logger
+from config import metrics, tracing
+
+logger = setup_logger(__name__)
+
+# Mínimo de amostras para confiar no p95 do provedor
+_MIN_SAMPLES = 10
+
+_executor = ThreadPoolExecutor(max_workers=settings.llm_hedge_workers, thread_name_prefix="llm-hedge")
+
+
+class ProviderHealth:
+    """Sucesso e latência das últimas chamadas a um provedor/modelo."""
+
+    def __init__(self, name: str, window: int):
+        self.name = name
+        self._samples: "deque[Tuple[bool, float]]" = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, ok: bool, latency: float) -> None:
+        with self._lock:
+            self._samples.append((ok, latency))
+        metrics.LLM_PROVIDER_HEALTH.labels(self.name).set(self.score())
+
+    def score(self) -> float:
+        """Taxa de sucesso recente (1.0 sem histórico)."""
+        with self._lock:
+            if not self._samples:
+                return 1.0
+            return sum(1 for ok, _ in self._samples if ok) / len(self._samples)
+
+    def p95(self) -> Optional[float]:
+        with self._lock:
+            latencies = sorted(lat for ok, lat in self._samples if ok)
+        if len(latencies) < _MIN_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+
+    def stats(self) -> Dict[str, Any]:
+        p95 = self.p95()
+        with self._lock:
+            calls = len(self._samples)
+        return {"score": round(self.score(), 3), "p95_s": round(p95, 2) if p95 else None, "calls": calls}
+
+
+_health: Dict[str, ProviderHealth] = {}
+_health_lock = threading.Lock()
+
+
+def health_for(name: str) -> ProviderHealth:
+    with _health_lock:
+        if name not in _health:
+            _health[name] = ProviderHealth(name, settings.llm_health_window)
+        return _health[name]
+
+
+def health_stats() -> Dict[str, Any]:
+    with _health_lock:
+        providers = list(_health.values())
+    return {p.name: p.stats() for p in providers}
+
+
+def _hedge_delay(health: ProviderHealth) -> Optional[float]:
+    if not settings.llm_hedge_enabled:
+        return None
+    p95 = health.p95() or settings.llm_hedge_max_delay
+    return min(max(p95, settings.llm_hedge_min_delay), settings.llm_hedge_max_delay)
+
+
+def _generate_full(runnable: Any, messages: List[BaseMessage], stop: Optional[List[str]]) -> ChatResult:
+    """
+    Chama o provedor mantendo o llm_output (modelo, uso de tokens), que o
+    invoke e o generate descartam. Desfaz o bind_tools para passar as tools
+    como kwargs; callbacks do turno ficam com o _generate do modelo resiliente.
+    """
+    kwargs: Dict[str, Any] = {}
+    while isinstance(runnable, RunnableBinding):
+        kwargs = {**runnable.kwargs, **kwargs}
+        runnable = runnable.bound
+    result = runnable._generate(messages, stop=stop, **kwargs)
+    llm_output = dict(result.llm_output or {})
+    message = result.generations[0].message
+    model_name = message.response_metadata.get("model_name") or getattr(runnable, "model", None)
+    if model_name:
+        llm_output.setdefault("model_name", model_name)
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        llm_output.setdefault("token_usage", {
+            "prompt_tokens": usage.get("input_tokens", 0),
+            "completion_tokens": usage.get("output_tokens", 0),
+            "total_tokens": usage.get("total_tokens", 0),
+        })
+    return ChatResult(generations=result.generations, llm_output=llm_output)
+
+
+def _call(runnable: Any, health: ProviderHealth, messages: List[BaseMessage], stop: Optional[List[str]],
+          started: Optional[threading.Event] = None) -> ChatResult:
+    if started is not None:
+        started.set()
+    t0 = time.perf_counter()
+    try:
+        result = _generate_full(runnable, messages, stop)
+    except Exception:
+        health.record(False, time.perf_counter() - t0)
+        raise
+    health.record(True, time.perf_counter() - t0)
+    return result
+
+
+class ResilientChatModel(BaseChatModel):
+    """Principal com hedging e failover para o secundário (ver docstring do módulo)."""
+
+    primary: Any
+    secondary: Any
+    primary_name: str
+    secondary_name: str
+    # Versões com tools (bind_tools) usadas nas chamadas; None = modelo puro
+    primary_runnable: Any = None
+    secondary_runnable: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "resilient"
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "ResilientChatModel":
+        return self.model_copy(update={
+            "primary_runnable": self.primary.bind_tools(tools, **kwargs),
+            "secondary_runnable": self.secondary.bind_tools(tools, **kwargs),
+        })
+
+    def _order(self) -> List[Tuple[Any, ProviderHealth]]:
+        first = (self.primary_runnable or self.primary, health_for(self.primary_name))
+        second = (self.secondary_runnable or self.secondary, health_for(self.secondary_name))
+        if first[1].score() < settings.llm_failover_min_score and second[1].score() > first[1].score():
+            metrics.LLM_FAILOVER.labels(first[1].name, "saude").inc()
+            return [second, first]
+        return [first, second]
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        (main, main_health), (backup, backup_health) = self._order()
+        started = threading.Event()
+        first = _executor.submit(tracing.wrap(_call), main, main_health, messages, stop, started)
+        # Prazo do hedge começa quando a chamada sai da fila do pool
+        started.wait()
+        done, _ = wait([first], timeout=_hedge_delay(main_health))
+
+        if done:
+            error = first.exception()
+            if error is None:
+                return first.result()
+            logger.warning(f"⚠️ LLM {main_health.name} falhou ({type(error).__name__}: {error}); "
+                           f"usando {backup_health.name}")
+            metrics.LLM_FAILOVER.labels(main_health.name, "erro").inc()
+            return _call(backup, backup_health, messages, stop)
+
+        # Principal lento: requisição de backup e fica a primeira resposta válida
+        logger.info(f"🏁 LLM {main_health.name} sem resposta em {_hedge_delay(main_health):.1f}s; "
+                    f"disparando backup em {backup_health.name}")
+        metrics.LLM_HEDGE.labels("disparado").inc()
+        second = _executor.submit(tracing.wrap(_call), backup, backup_health, messages, stop)
+        pending = {first, second}
+        last_error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                error = future.exception()
+                if error is None:
+                    metrics.LLM_HEDGE.labels("venceu_backup" if future is second else "venceu_principal").inc()
+                    return future.result()
+                last_error = error
+        raise last_error
@@ -0,0 +1,101 @@
+"""
+Agendador de tarefas com atraso (timers) para o fluxo "humano" do agente.
+
+Em vez de segurar uma thread por conversa com `time.sleep`, os atrasos
+(leitura, pausa antes do envio, intervalo entre blocos de mensagem) viram
+timers numa fila única. Uma thread de relógio dispara as tarefas vencidas
+e as executa num pool pequeno de workers (HTTP para a UAZ etc.).
+"""
+import heapq
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Tuple
+
+from config.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class ScheduledTask:
+    """Handle de uma tarefa agendada (permite cancelar antes de disparar)."""
+
+    __slots__ = ("due", "fn", "args", "kwargs", "cancelled")
+
+    def __init__(self, due: float, fn: Callable, args: tuple, kwargs: dict):
+        self.due = due
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+
+class DelayScheduler:
+    """
+    Fila de timers com uma única thread de relógio.
+
+    - `schedule(delay, fn, *args)` agenda `fn` para daqui a `delay` segundos.
+    - As tarefas vencidas rodam em um ThreadPoolExecutor limitado, então uma
+      chamada HTTP lenta não atrasa os demais timers.
+    """
+
+    def __init__(self, max_workers: int = 8):
+        self._heap: List[Tuple[float, int, ScheduledTask]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="delay")
+        self._thread: Optional[threading.Thread] = None
+
+    def _ensure_started(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="delay-scheduler", daemon=True)
+            self._thread.start()
+
+    def schedule(self, delay: float, fn: Callable, *args: Any, **kwargs: Any) -> ScheduledTask:
+        task = ScheduledTask(time.monotonic() + max(0.0, delay), fn, args, kwargs)
+        with self._cond:
+            self._ensure_started()
+            heapq.heappush(self._heap, (task.due, next(self._seq), task))
+            self._cond.notify()
+        return task
+
+    def pending(self) -> int:
+        """Tarefas agendadas ainda não executadas."""
+        with self._cond:
+            return len(self._heap)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                due, _, task = self._heap[0]
+                now = time.monotonic()
+                if due > now:
+                    self._cond.wait(due - now)
+                    continue
+                heapq.heappop(self._heap)
+            if not task.cancelled:
+                self._executor.submit(self._execute, task)
+
+    @staticmethod
+    def _execute(task: ScheduledTask) -> None:
+        try:
+            task.fn(*task.args, **task.kwargs)
+        except Exception as e:
+            logger.error(f"Erro em tarefa agendada {getattr(task.fn, '__name__', task.fn)}: {e}")
+
+
+def human_delay(min_s: float, max_s: float) -> float:
+    """Sorteia um atraso entre min e max (aceita faixa invertida ou zerada)."""
+    lo, hi = sorted((max(0.0, min_s), max(0.0, max_s)))
+    return random.uniform(lo, hi) if hi > lo else lo
+
+
+# Instância global usada pelo servidor
+scheduler = DelayScheduler()
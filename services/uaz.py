@@ -0,0 +1,50 @@
+"""
+Helpers da UAZ API (WhatsApp): URL base e link público de mídia
+"""
+from typing import Optional
+from urllib.parse import urlparse
+
+import requests
+
+from config.settings import settings
+from config.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def get_api_base_url() -> str:
+    """Prioriza UAZ_API_URL > WHATSAPP_API_URL."""
+    return (settings.uaz_api_url or settings.whatsapp_api_url or "").strip().rstrip("/")
+
+
+def uaz_endpoint(path: str) -> Optional[str]:
+    """Monta a URL de um endpoint da UAZ na raiz do host (ex: '/send/text')."""
+    base = get_api_base_url()
+    if not base:
+        return None
+    try:
+        parsed = urlparse(base)
+        return f"{parsed.scheme}://{parsed.netloc}{path}"
+    except Exception:
+        return f"{base.split('/message')[0]}{path}"
+
+
+def get_media_url_uaz(message_id: str) -> Optional[str]:
+    """Solicita link público da mídia (Imagem/PDF/Áudio)."""
+    if not message_id: return None
+    url = uaz_endpoint("/message/download")
+    if not url: return None
+
+    headers = {"Content-Type": "application/json", "token": (settings.whatsapp_token or "").strip()}
+    # return_link=True devolve url pública
+    payload = {"id": message_id, "return_link": True, "return_base64": False}
+
+    try:
+        resp = requests.post(url, headers=headers, json=payload, timeout=15)
+        if resp.status_code == 200:
+            data = resp.json()
+            link = data.get("fileURL") or data.get("url")
+            if link: return link
+    except Exception as e:
+        logger.error(f"Erro ao obter link mídia: {e}")
+    return None
@@ -1,14 +1,29 @@
 """
 Ferramentas HTTP para interação com a API do Supermercado
 """
+import re
+import time
 import requests
 import json
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 from config.settings import settings
 from config.logger import setup_logger
+from config import metrics, tracing
+from services import gemini
+from services.cache import TTLCache
+from tools.matching import Query, top_k, best_match
+from tools.normalizer import canonical_query, get_catalog_index, product_key
+from tools.overrides import ean_overrides
+from tools.records import ToolError, ProductCandidate, StockItem, OrderResult, to_tool_json
 
 logger = setup_logger(__name__)
 
+# Buscas remotas por chave canônica ("coca 2l" e "coca cola 2 litros" = mesma entrada)
+_ean_cache = TTLCache(settings.search_cache_size, settings.search_cache_ttl)
+_file_search_cache = TTLCache(settings.search_cache_size, settings.search_cache_ttl)
+metrics.register_cache("ean_lookup", _ean_cache)
+metrics.register_cache("file_search", _file_search_cache)
+
 
 def get_auth_headers() -> Dict[str, str]:
     """Retorna os headers de autenticação para as requisições"""
@@ -19,24 +34,39 @@ def get_auth_headers() -> Dict[str, str]:
     }
 
 
-def estoque(url: str) -> str:
+def _request(upstream: str, method: str, url: str, **kwargs: Any) -> requests.Response:
+    """`requests.request` com latência por upstream e status HTTP em /metrics."""
+    inicio = time.perf_counter()
+    status = "error"
+    try:
+        resp = requests.request(method, url, **kwargs)
+        status = str(resp.status_code)
+        return resp
+    except requests.exceptions.Timeout:
+        status = "timeout"
+        raise
+    finally:
+        metrics.UPSTREAM_LATENCY.labels(upstream, status).observe(time.perf_counter() - inicio)
+
+
+@tracing.traced("http.estoque")
+def buscar_estoque(url: str) -> Any:
     """
     Consulta o estoque e preço de produtos no sistema do supermercado.
-    
+
     Args:
         url: URL completa para consulta (ex: .../api/produtos/consulta?nome=arroz)
-    
+
     Returns:
-        JSON string com informações do produto ou mensagem de erro
+        Produto(s) apenas com os campos essenciais (dict ou lista de dicts)
+
+    Raises:
+        ToolError: timeout, erro HTTP ou resposta inválida
     """
     logger.info(f"Consultando estoque: {url}")
     
     try:
-        response = requests.get(
-            url,
-            headers=get_auth_headers(),
-            timeout=10
-        )
+        response = _request("estoque", "GET", url, headers=get_auth_headers(), timeout=10)
         response.raise_for_status()
         
         data = response.json()
@@ -68,112 +98,142 @@ def estoque(url: str) -> str:
             
         logger.info(f"Estoque consultado com sucesso: {len(data) if isinstance(data, list) else 1} produto(s)")
         
-        return json.dumps(filtered_data, indent=2, ensure_ascii=False)
+        return filtered_data
     
     except requests.exceptions.Timeout:
         error_msg = "Erro: Timeout ao consultar estoque. Tente novamente."
         logger.error(error_msg)
-        return error_msg
+        raise ToolError(error_msg)
     
     except requests.exceptions.HTTPError as e:
         error_msg = f"Erro HTTP ao consultar estoque: {e.response.status_code} - {e.response.text}"
         logger.error(error_msg)
-        return error_msg
+        raise ToolError(error_msg)
     
     except requests.exceptions.RequestException as e:
         error_msg = f"Erro ao consultar estoque: {str(e)}"
         logger.error(error_msg)
-        return error_msg
+        raise ToolError(error_msg)
     
     except json.JSONDecodeError:
         error_msg = "Erro: Resposta da API não é um JSON válido."
         logger.error(error_msg)
-        return error_msg
+        raise ToolError(error_msg)
 
 
-def pedidos(json_body: str) -> str:
+def estoque(url: str) -> str:
     """
-    Envia um pedido finalizado para o painel dos funcionários (dashboard).
+    Consulta o estoque e preço de produtos no sistema do supermercado.
     
     Args:
-        json_body: JSON string com os detalhes do pedido
-                   Exemplo: '{"cliente": "João", "itens": [{"produto": "Arroz", "quantidade": 1}]}'
+        url: URL completa para consulta (ex: .../api/produtos/consulta?nome=arroz)
     
     Returns:
-        Mensagem de sucesso com resposta do servidor ou mensagem de erro
+        JSON compacto com informações do produto ou mensagem de erro
     """
-def pedidos(json_body: str) -> str:
+    try:
+        return to_tool_json(buscar_estoque(url))
+    except ToolError as e:
+        return str(e)
+
+
+@tracing.traced("http.pedido")
+def enviar_pedido(data: Dict[str, Any], idempotency_key: str = "",
+                  timeout: float = 10) -> OrderResult:
     """
-    Envia um pedido finalizado para o painel dos funcionários (dashboard).
-    
+    POST do pedido no painel dos funcionários (dashboard).
+
     Args:
-        json_body: JSON string com os detalhes do pedido
-                   Exemplo: '{"cliente": "João", "itens": [{"produto": "Arroz", "quantidade": 1}]}'
-    
+        data: Pedido já montado (dict)
+        idempotency_key: Enviado no header `Idempotency-Key`; reenvios com a
+                         mesma chave não criam pedido duplicado
+        timeout: Timeout da requisição (segundos)
+
     Returns:
-        Mensagem de sucesso com resposta do servidor ou mensagem de erro
+        OrderResult (ok, mensagem, retryable, resposta do painel)
     """
     # Remove trailing slashed from base and from endpoint to ensure correct path
     base = settings.supermercado_base_url.rstrip("/")
     url = f"{base}/pedidos/"  # Barra final necessária para FastAPI
     logger.info(f"Enviando pedido para: {url}")
-    
+
     # DEBUG: Log token being used (only first/last 4 chars for security)
     token = settings.supermercado_auth_token or ""
     token_preview = f"{token[:12]}...{token[-4:]}" if len(token) > 16 else token
     logger.info(f"🔑 Token usado: {token_preview}")
-    
+
+    headers = get_auth_headers()
+    if idempotency_key:
+        headers["Idempotency-Key"] = idempotency_key
+
     try:
-        # Validar JSON
-        data = json.loads(json_body)
         logger.debug(f"Dados do pedido: {data}")
-        
-        response = requests.post(
-            url,
-            headers=get_auth_headers(),
-            json=data,
-            timeout=10
-        )
+        response = _request("pedidos", "POST", url, headers=headers, json=data, timeout=timeout)
         response.raise_for_status()
-        
+
         result = response.json()
-        success_msg = f"✅ Pedido enviado com sucesso!\n\nResposta do servidor:\n{json.dumps(result, indent=2, ensure_ascii=False)}"
         logger.info("Pedido enviado com sucesso")
-        
-        return success_msg
-    
-    except json.JSONDecodeError:
-        error_msg = "Erro: O corpo da requisição não é um JSON válido."
-        logger.error(error_msg)
-        return error_msg
-    
+        return OrderResult(True, f"✅ Pedido enviado com sucesso!\nResposta do servidor: {to_tool_json(result)}",
+                           resposta=result)
+
     except requests.exceptions.Timeout:
         error_msg = "Erro: Timeout ao enviar pedido. Tente novamente."
         logger.error(error_msg)
-        return error_msg
-    
+        return OrderResult(False, error_msg, retryable=True)
+
     except requests.exceptions.HTTPError as e:
-        error_msg = f"Erro HTTP ao enviar pedido: {e.response.status_code} - {e.response.text}"
+        status = e.response.status_code
+        error_msg = f"Erro HTTP ao enviar pedido: {status} - {e.response.text}"
         logger.error(error_msg)
-        return error_msg
-    
+        # 409 = chave de idempotência já processada pelo painel
+        if status == 409:
+            return OrderResult(True, "✅ Pedido já registrado no painel.")
+        return OrderResult(False, error_msg, retryable=status in (408, 425, 429) or status >= 500)
+
     except requests.exceptions.RequestException as e:
         error_msg = f"Erro ao enviar pedido: {str(e)}"
         logger.error(error_msg)
-        return error_msg
+        return OrderResult(False, error_msg, retryable=True)
 
+    except ValueError:
+        # Painel aceitou (2xx) mas a resposta não é JSON
+        return OrderResult(True, "✅ Pedido enviado com sucesso!")
 
-def alterar(telefone: str, json_body: str) -> str:
+
+def pedidos(json_body: str) -> str:
     """
-    Atualiza um pedido existente no painel dos funcionários (dashboard).
+    Envia um pedido finalizado para o painel dos funcionários (dashboard).
     
     Args:
-        telefone: Telefone do cliente para identificar o pedido
-        json_body: JSON string com os dados a serem atualizados
+        json_body: JSON string com os detalhes do pedido
+                   Exemplo: '{"cliente": "João", "itens": [{"produto": "Arroz", "quantidade": 1}]}'
     
     Returns:
         Mensagem de sucesso com resposta do servidor ou mensagem de erro
     """
+    try:
+        # Validar JSON
+        data = json.loads(json_body)
+    except json.JSONDecodeError:
+        error_msg = "Erro: O corpo da requisição não é um JSON válido."
+        logger.error(error_msg)
+        return error_msg
+
+    return enviar_pedido(data).mensagem
+
+
+@tracing.traced("http.alterar_pedido")
+def atualizar_pedido(telefone: str, data: Dict[str, Any]) -> OrderResult:
+    """
+    PUT do pedido existente no painel, identificado pelo telefone.
+
+    Args:
+        telefone: Telefone do cliente para identificar o pedido
+        data: Dados a serem atualizados (dict)
+
+    Returns:
+        OrderResult (ok, mensagem, retryable, resposta do painel)
+    """
     # Remove caracteres não numéricos do telefone
     telefone_limpo = "".join(filter(str.isdigit, telefone))
     url = f"{settings.supermercado_base_url}/pedidos/telefone/{telefone_limpo}"
@@ -181,42 +241,155 @@ def alterar(telefone: str, json_body: str) -> str:
     logger.info(f"Atualizando pedido para telefone: {telefone_limpo}")
     
     try:
-        # Validar JSON
-        data = json.loads(json_body)
         logger.debug(f"Dados de atualização: {data}")
         
-        response = requests.put(
-            url,
-            headers=get_auth_headers(),
-            json=data,
-            timeout=10
-        )
+        response = _request("pedidos", "PUT", url, headers=get_auth_headers(), json=data, timeout=10)
         response.raise_for_status()
         
         result = response.json()
-        success_msg = f"✅ Pedido atualizado com sucesso!\n\nResposta do servidor:\n{json.dumps(result, indent=2, ensure_ascii=False)}"
         logger.info("Pedido atualizado com sucesso")
-        
-        return success_msg
+        return OrderResult(True, f"✅ Pedido atualizado com sucesso!\nResposta do servidor: {to_tool_json(result)}",
+                           resposta=result)
+
+    except requests.exceptions.Timeout:
+        error_msg = "Erro: Timeout ao atualizar pedido. Tente novamente."
+        logger.error(error_msg)
+        return OrderResult(False, error_msg, retryable=True)
+
+    except requests.exceptions.HTTPError as e:
+        error_msg = f"Erro HTTP ao atualizar pedido: {e.response.status_code} - {e.response.text}"
+        logger.error(error_msg)
+        return OrderResult(False, error_msg, retryable=e.response.status_code >= 500)
+
+    except requests.exceptions.RequestException as e:
+        error_msg = f"Erro ao atualizar pedido: {str(e)}"
+        logger.error(error_msg)
+        return OrderResult(False, error_msg, retryable=True)
+
+    except ValueError:
+        return OrderResult(True, "✅ Pedido atualizado com sucesso!")
+
+
+def alterar(telefone: str, json_body: str) -> str:
+    """
+    Atualiza um pedido existente no painel dos funcionários (dashboard).
+    
+    Args:
+        telefone: Telefone do cliente para identificar o pedido
+        json_body: JSON string com os dados a serem atualizados
     
+    Returns:
+        Mensagem de sucesso com resposta do servidor ou mensagem de erro
+    """
+    try:
+        # Validar JSON
+        data = json.loads(json_body)
     except json.JSONDecodeError:
         error_msg = "Erro: O corpo da requisição não é um JSON válido."
         logger.error(error_msg)
         return error_msg
 
+    return atualizar_pedido(telefone, data).mensagem
+
+
+# Pares EAN/nome dentro de strings JSON (ex.: campo "content" do Supabase)
+_EAN_IN_TEXT_RE = re.compile(r'"codigo_ean"\s*:\s*([0-9]+)')
+_NAME_IN_TEXT_RE = re.compile(r'"produto"\s*:\s*"([^"]+)"')
+
+
+def _extract_pairs_from_text(text: str) -> List[ProductCandidate]:
+    # Atalho: a maioria das strings (nomes, categorias) não tem pares embutidos
+    if '"codigo_ean"' not in text and '"produto"' not in text:
+        return []
+    eans = _EAN_IN_TEXT_RE.findall(text)
+    names = _NAME_IN_TEXT_RE.findall(text)
+    # Emparelhar por ordem de aparição; não limitar aqui
+    pairs = []
+    limit = min(len(eans), len(names)) or max(len(eans), len(names))
+    for i in range(min(limit, 50)):
+        e = eans[i] if i < len(eans) else None
+        n = names[i] if i < len(names) else None
+        if e or n:
+            pairs.append(ProductCandidate(e, n))
+    return pairs
+
+
+def _extract_pairs_from_json(data: Any) -> List[ProductCandidate]:
+    """Procura pares EAN/nome em qualquer nível do JSON (e em strings internas)."""
+    pairs: List[ProductCandidate] = []
+
+    def try_obj(d: Dict[str, Any]):
+        # EAN pode ser string ou número
+        e = None
+        for k in ["ean", "ean_code", "codigo_ean", "barcode", "gtin"]:
+            v = d.get(k)
+            if isinstance(v, (str, int)) and str(v).strip():
+                e = str(v).strip()
+                break
+        n = None
+        for k in ["produto", "product", "name", "nome", "title", "descricao", "description"]:
+            v = d.get(k)
+            if isinstance(v, str) and v.strip():
+                n = v.strip()
+                break
+        if e or n:
+            pairs.append(ProductCandidate(e, n))
+
+    def walk(payload: Any):
+        if isinstance(payload, dict):
+            # Primeiro tenta extrair diretamente do objeto
+            try_obj(payload)
+            # Percorre TODOS os campos do dict, não apenas nomes comuns
+            for _, val in payload.items():
+                if isinstance(val, dict):
+                    walk(val)
+                elif isinstance(val, list):
+                    for it in val:
+                        walk(it)
+                elif isinstance(val, str):
+                    # Conteúdos string (ex.: campo "content" vindo do Supabase)
+                    pairs.extend(_extract_pairs_from_text(val))
+        elif isinstance(payload, list):
+            for it in payload:
+                walk(it)
+        elif isinstance(payload, str):
+            pairs.extend(_extract_pairs_from_text(payload))
+
+    walk(data)
+    return pairs
 
-def ean_lookup(query: str) -> str:
+
+@tracing.traced("http.smart_responder")
+def buscar_eans(query: str, limit: int = 5) -> List[ProductCandidate]:
     """
-    Busca informações/EAN do produto mencionado via Supabase Functions (smart-responder).
+    Busca candidatos (EAN + nome) via Supabase Functions (smart-responder),
+    ordenados por relevância em relação à consulta.
 
     Envia POST para settings.smart_responder_url com header Authorization Bearer e body {"query": query}.
 
     Args:
         query: Texto com o nome/descrição do produto ou entrada de chat.
+        limit: Máximo de candidatos retornados.
 
     Returns:
-        String com JSON de resposta ou mensagem de erro amigável.
+        Lista de ProductCandidate (vazia se nada foi encontrado)
+
+    Raises:
+        ToolError: configuração ausente, timeout ou erro HTTP
     """
+    cache_key = f"{canonical_query(query)}#{limit}"
+    cached = _ean_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"♻️ ean_lookup em cache para '{query[:40]}' ({cache_key})")
+        return cached
+
+    # Atalho: catálogo local com a mesma chave canônica dispensa a chamada remota
+    catalog = get_catalog_index()
+    local = catalog.lookup(query) if catalog else []
+    if local:
+        pairs = [ProductCandidate(ean, nome) for ean, nome in local]
+        return [pn for _, pn in top_k(Query(query), pairs, lambda pn: pn.nome, k=limit)]
+
     url = (settings.smart_responder_url or "").strip()
     # Prefer new envs; fall back to legacy token
     auth_token = (settings.smart_responder_auth or settings.smart_responder_token or "").strip()
@@ -225,7 +398,7 @@ def ean_lookup(query: str) -> str:
     if not url or not auth_token:
         msg = "Erro: SMART_RESPONDER_URL/AUTH não configurados no .env"
         logger.error(msg)
-        return msg
+        raise ToolError(msg)
 
     # Remover crases/backticks caso estejam coladas ao URL
     url = url.replace("`", "")
@@ -244,174 +417,166 @@ def ean_lookup(query: str) -> str:
     payload = {"query": query}
     logger.info(f"Consultando smart-responder: {url} query='{query[:80]}'")
 
-    def _extract_pairs_from_text(text: str):
-        import re
-        eans = re.findall(r'"codigo_ean"\s*:\s*([0-9]+)', text)
-        names = re.findall(r'"produto"\s*:\s*"([^"]+)"', text)
-        # Emparelhar por ordem de aparição; não limitar aqui
-        pairs = []
-        limit = min(len(eans), len(names)) or max(len(eans), len(names))
-        for i in range(min(limit, 50)):
-            e = eans[i] if i < len(eans) else None
-            n = names[i] if i < len(names) else None
-            if e or n:
-                pairs.append((e, n))
-        return pairs
-
-    def _format_summary(pairs):
-        if not pairs:
-            return None
-        lines = ["EANS_ENCONTRADOS:"]
-        for idx, (e, n) in enumerate(pairs, 1):
-            if e and n:
-                lines.append(f"{idx}) {e} - {n}")
-            elif e:
-                lines.append(f"{idx}) {e}")
-            elif n:
-                lines.append(f"{idx}) {n}")
-        return "\n".join(lines)
-
     try:
-        resp = requests.post(url, headers=headers, json=payload, timeout=15)
-        status = resp.status_code
-        text = resp.text
-        logger.info(f"smart-responder retorno: status={status}")
-
-        # Tentar interpretar como JSON e extrair EAN/nome quando possível
-        try:
-            data = resp.json()
-
-            # Caminho 1: procurar pares diretamente em campos estruturados
-            pairs = []
-            def try_obj(d: Dict[str, Any]):
-                # EAN pode ser string ou número
-                e = None
-                for k in ["ean", "ean_code", "codigo_ean", "barcode", "gtin"]:
-                    v = d.get(k)
-                    if isinstance(v, (str, int)) and str(v).strip():
-                        e = str(v).strip()
-                        break
-                n = None
-                for k in ["produto", "product", "name", "nome", "title", "descricao", "description"]:
-                    v = d.get(k)
-                    if isinstance(v, str) and v.strip():
-                        n = v.strip()
-                        break
-                if e or n:
-                    pairs.append((e, n))
-
-            def walk(payload: Any):
-                if isinstance(payload, dict):
-                    # Primeiro tenta extrair diretamente do objeto
-                    try_obj(payload)
-                    # Percorre TODOS os campos do dict, não apenas nomes comuns
-                    for _, val in payload.items():
-                        if isinstance(val, dict):
-                            walk(val)
-                        elif isinstance(val, list):
-                            for it in val:
-                                walk(it)
-                        elif isinstance(val, str):
-                            # Conteúdos string (ex.: campo "content" vindo do Supabase)
-                            pairs.extend(_extract_pairs_from_text(val))
-                elif isinstance(payload, list):
-                    for it in payload:
-                        walk(it)
-                elif isinstance(payload, str):
-                    pairs.extend(_extract_pairs_from_text(payload))
-
-            walk(data)
-
-            # Ordenar pares por relevância em relação ao 'query' e limitar na sumarização
-            def _strip_accents(s: str) -> str:
-                try:
-                    import unicodedata
-                    return ''.join(c for c in unicodedata.normalize('NFD', s) if unicodedata.category(c) != 'Mn')
-                except Exception:
-                    return s
-
-            def _score(q: str, nome: str | None) -> float:
-                if not nome:
-                    return 0.0
-                import re as _re
-                qn = _strip_accents((q or '').lower())
-                nn = _strip_accents((nome or '').lower())
-                score = 0.0
-                for tok in _re.findall(r"[\wáéíóúâêîôûãõç]+", qn):
-                    if tok and tok in nn:
-                        score += 1.0
-                for m in _re.findall(r"(\d+\s*(g|kg|ml|l|litro|un))", qn):
-                    if m[0] in nn:
-                        score += 1.5
-                return score
-
-            # Pontuar por relevância e filtrar apenas itens que casam com a consulta
-            scored = [(pn, _score(query, pn[1])) for pn in pairs]
-            # Ordena por score desc
-            ordered = [pn for pn, sc in sorted(scored, key=lambda x: x[1], reverse=True)]
-            # Mantém apenas os com score >= 1.0 (pelo menos um token da consulta)
-            top_relevant = [pn for pn, sc in sorted(scored, key=lambda x: x[1], reverse=True) if sc >= 1.0][:5]
-            # Fallback: se não houver relevantes, use os primeiros pares retornados
-            used_pairs = top_relevant if top_relevant else ordered[:5]
-            summary = _format_summary(used_pairs)
-            # [OPTIMIZATION] Return ONLY the summary, do not dump the full JSON
-            if summary:
-                sanitized = summary.replace("\n", "; ")
-                logger.info(f"smart-responder resumo extraído: {sanitized}")
-                final_resp = summary # Eliminating the heavy JSON appendix
-            else:
-                # Only if summarization fails we return a filtered version of data (if possible) or just a small slice
-                final_resp = "Nunhum produto encontrado com esse termo."
-
-            logger.info(f"Tamanho da resposta ean_lookup: {len(final_resp)} caracteres")
-            return final_resp
-        except Exception:
-            # Se não for JSON, tentar extrair com regex do texto bruto
-            pairs = _extract_pairs_from_text(text)
-            # Aplicar o mesmo filtro de relevância no texto bruto
-            def _strip_accents(s: str) -> str:
-                try:
-                    import unicodedata
-                    return ''.join(c for c in unicodedata.normalize('NFD', s) if unicodedata.category(c) != 'Mn')
-                except Exception:
-                    return s
-            def _score(q: str, nome: str | None) -> float:
-                if not nome:
-                    return 0.0
-                import re as _re
-                qn = _strip_accents((q or '').lower())
-                nn = _strip_accents((nome or '').lower())
-                score = 0.0
-                for tok in _re.findall(r"[\wáéíóúâêîôûãõç]+", qn):
-                    if tok and tok in nn:
-                        score += 1.0
-                for m in _re.findall(r"(\d+\s*(g|kg|ml|l|litro|un))", qn):
-                    if m[0] in nn:
-                        score += 1.5
-                return score
-            scored = [(pn, _score(query, pn[1])) for pn in pairs]
-            top_relevant = [pn for pn, sc in sorted(scored, key=lambda x: x[1], reverse=True) if sc >= 1.0][:5]
-            used_pairs = top_relevant if top_relevant else [pn for pn, _ in scored][:5]
-            summary = _format_summary(used_pairs)
-            if summary:
-                return summary # [OPTIMIZATION] Return only summary
-            return text[:200] # [OPTIMIZATION] Return only start of text if fail
-            
+        resp = _request("smart_responder", "POST", url, headers=headers, json=payload, timeout=15)
+        logger.info(f"smart-responder retorno: status={resp.status_code}")
     except requests.exceptions.Timeout:
         msg = "Erro: Timeout ao consultar smart-responder. Tente novamente."
         logger.error(msg)
-        return msg
-    except requests.exceptions.HTTPError as e:
-        msg = f"Erro HTTP no smart-responder: {getattr(e.response, 'status_code', '?')} - {getattr(e.response, 'text', '')}"
-        logger.error(msg)
-        return msg
+        raise ToolError(msg)
     except requests.exceptions.RequestException as e:
         msg = f"Erro ao consultar smart-responder: {str(e)}"
         logger.error(msg)
-        return msg
+        raise ToolError(msg)
 
+    # Erro do smart-responder (401/429/5xx): o corpo não é resultado de busca
+    if not resp.ok:
+        msg = f"Erro ao consultar smart-responder: HTTP {resp.status_code}"
+        logger.error(f"{msg} - {resp.text[:200]}")
+        raise ToolError(msg)
 
-def estoque_preco(ean: str) -> str:
+    # Interpretar como JSON; se não for, extrair com regex do texto bruto
+    try:
+        pairs = _extract_pairs_from_json(resp.json())
+    except ValueError:
+        pairs = _extract_pairs_from_text(resp.text)
+
+    # Pontuar por relevância; mantém apenas os que casam com a consulta
+    # (pelo menos um token) ou, se nenhum casar, os primeiros retornados
+    ranked = top_k(Query(query), pairs, lambda pn: pn.nome, k=limit)
+    for sc, pn in ranked:
+        pn.score = sc
+    result = [pn for _, pn in ranked]
+    # Busca vazia não vai para o cache (produto pode voltar na próxima consulta)
+    if result:
+        _ean_cache.set(cache_key, result)
+    ean_overrides.note_search(query, (pn.ean for pn in result))
+    return result
+
+
+def _format_summary(pairs: List[ProductCandidate]) -> Optional[str]:
+    if not pairs:
+        return None
+    lines = ["EANS_ENCONTRADOS:"]
+    for idx, pn in enumerate(pairs, 1):
+        if pn.ean and pn.nome:
+            lines.append(f"{idx}) {pn.ean} - {pn.nome}")
+        elif pn.ean:
+            lines.append(f"{idx}) {pn.ean}")
+        elif pn.nome:
+            lines.append(f"{idx}) {pn.nome}")
+    return "\n".join(lines)
+
+
+def ean_lookup(query: str) -> str:
+    """
+    Busca informações/EAN do produto mencionado via Supabase Functions (smart-responder).
+
+    Args:
+        query: Texto com o nome/descrição do produto ou entrada de chat.
+
+    Returns:
+        Resumo "EANS_ENCONTRADOS" (até 5 itens) ou mensagem de erro amigável.
+    """
+    try:
+        pairs = buscar_eans(query)
+    except ToolError as e:
+        return str(e)
+
+    # [OPTIMIZATION] Return ONLY the summary, do not dump the full JSON
+    summary = _format_summary(pairs)
+    if summary:
+        logger.info(f"smart-responder resumo extraído: {summary.replace(chr(10), '; ')}")
+        return summary
+    return "Nenhum produto encontrado com esse termo."
+
+
+# Heurística de extração de preço
+PRICE_KEYS = (
+    "vl_produto",
+    "vl_produto_normal",
+    "preco",
+    "preco_venda",
+    "valor",
+    "valor_unitario",
+    "preco_unitario",
+    "atacadoPreco",
+)
+
+# Possíveis chaves de quantidade de estoque
+# NOTA: qtd_produto é a chave principal, qtd_movimentacao NÃO é estoque real
+STOCK_QTY_KEYS = (
+    "qtd_produto",  # Chave principal do sistema
+    "estoque", "qtd", "qtde", "qtd_estoque", "quantidade", "quantidade_disponivel",
+    "quantidadeDisponivel", "qtdDisponivel", "qtdEstoque", "estoqueAtual", "saldo",
+    "qty", "quantity", "stock", "amount"
+    # REMOVIDO: "qtd_movimentacao" - isso é movimentação, não estoque!
+)
+
+# EXCEÇÃO: EAN 550 (frango abatido) sempre disponível
+ALWAYS_AVAILABLE_EANS = {"550"}
+
+
+def _parse_float(val) -> float | None:
+    try:
+        s = str(val).strip()
+        if not s:
+            return None
+        # aceita formato brasileiro
+        s = s.replace(".", "").replace(",", ".") if s.count(",") == 1 and s.count(".") > 1 else s.replace(",", ".")
+        return float(s)
+    except Exception:
+        return None
+
+
+def _extract_qty(d: Dict[str, Any]) -> float | None:
+    for k in STOCK_QTY_KEYS:
+        if k in d:
+            try:
+                return float(str(d.get(k)).replace(',', '.'))
+            except Exception:
+                pass
+    return None
+
+
+def _extract_price(d: Dict[str, Any]) -> float | None:
+    for k in PRICE_KEYS:
+        if k in d:
+            val = _parse_float(d.get(k))
+            if val is not None:
+                return val
+    return None
+
+
+def _has_positive_qty(d: Dict[str, Any]) -> bool:
+    for k in STOCK_QTY_KEYS:
+        if k in d:
+            try:
+                if float(str(d.get(k)).replace(",", ".")) > 0:
+                    return True
+            except Exception:
+                # ignore não numérico
+                pass
+    return False
+
+
+def _to_stock_item(it: Dict[str, Any], ean_digits: str) -> StockItem:
+    # APENAS produtos com estoque real positivo (> 0)
+    disponivel = ean_digits in ALWAYS_AVAILABLE_EANS or _has_positive_qty(it)
+    nome = it.get("produto") or it.get("nome") or it.get("descricao")
+    ean = it.get("ean") or it.get("cod_barra")
+    return StockItem(
+        produto=nome,
+        ean=str(ean) if ean else None,
+        id=it.get("id"),
+        disponibilidade=disponivel,
+        preco=_extract_price(it),
+        quantidade=_extract_qty(it),
+    )
+
+
+@tracing.traced("http.estoque_ean")
+def consultar_estoque_ean(ean: str) -> List[StockItem]:
     """
     Consulta preço e disponibilidade pelo EAN.
 
@@ -422,20 +587,23 @@ def estoque_preco(ean: str) -> str:
         ean: Código EAN do produto (apenas dígitos).
 
     Returns:
-        JSON string com informações do produto ou mensagem de erro amigável.
+        Lista de StockItem (incluindo indisponíveis)
+
+    Raises:
+        ToolError: configuração ausente, EAN inválido, timeout, erro HTTP ou resposta não-JSON
     """
     base = (settings.estoque_ean_base_url or "").strip().rstrip("/")
     if not base:
         msg = "Erro: ESTOQUE_EAN_BASE_URL não configurado no .env"
         logger.error(msg)
-        return msg
+        raise ToolError(msg)
 
     # manter apenas dígitos no EAN
     ean_digits = "".join(ch for ch in ean if ch.isdigit())
     if not ean_digits:
         msg = "Erro: EAN inválido. Informe apenas números."
         logger.error(msg)
-        return msg
+        raise ToolError(msg)
 
     url = f"{base}/{ean_digits}"
     logger.info(f"Consultando estoque_preco por EAN: {url}")
@@ -445,149 +613,51 @@ def estoque_preco(ean: str) -> str:
     }
 
     try:
-        resp = requests.get(url, headers=headers, timeout=10)
+        resp = _request("estoque_ean", "GET", url, headers=headers, timeout=10)
         resp.raise_for_status()
-
-        # resposta esperada: lista de objetos
-        try:
-            items = resp.json()
-        except json.JSONDecodeError:
-            txt = resp.text
-            logger.warning("Resposta não é JSON válido; retornando texto bruto")
-            return txt
-
-        # Se vier um único objeto, normalizar para lista
-        items = items if isinstance(items, list) else ([items] if isinstance(items, dict) else [])
-
-        # Heurística de extração de preço
-        PRICE_KEYS = (
-            "vl_produto",
-            "vl_produto_normal",
-            "preco",
-            "preco_venda",
-            "valor",
-            "valor_unitario",
-            "preco_unitario",
-            "atacadoPreco",
-        )
-
-        # Possíveis chaves de quantidade de estoque (remover da saída)
-        # NOTA: qtd_produto é a chave principal, qtd_movimentacao NÃO é estoque real
-        STOCK_QTY_KEYS = {
-            "qtd_produto",  # Chave principal do sistema
-            "estoque", "qtd", "qtde", "qtd_estoque", "quantidade", "quantidade_disponivel",
-            "quantidadeDisponivel", "qtdDisponivel", "qtdEstoque", "estoqueAtual", "saldo",
-            "qty", "quantity", "stock", "amount"
-            # REMOVIDO: "qtd_movimentacao" - isso é movimentação, não estoque!
-        }
-
-        # Possíveis indicadores de disponibilidade
-        STATUS_KEYS = ("situacao", "situacaoEstoque", "status", "statusEstoque")
-
-        def _parse_float(val) -> float | None:
-            try:
-                s = str(val).strip()
-                if not s:
-                    return None
-                # aceita formato brasileiro
-                s = s.replace(".", "").replace(",", ".") if s.count(",") == 1 and s.count(".") > 1 else s.replace(",", ".")
-                return float(s)
-            except Exception:
-                return None
-
-        def _has_positive_qty(d: Dict[str, Any]) -> bool:
-            for k in STOCK_QTY_KEYS:
-                if k in d:
-                    v = d.get(k)
-                    try:
-                        n = float(str(v).replace(",", "."))
-                        if n > 0:
-                            return True
-                    except Exception:
-                        # ignore não numérico
-                        pass
-            return False
-
-        def _is_available(d: Dict[str, Any]) -> bool:
-            # APENAS produtos com estoque real positivo (> 0)
-            if _has_positive_qty(d):
-                return True
-            return False
-
-        def _extract_qty(d: Dict[str, Any]) -> float | None:
-            for k in STOCK_QTY_KEYS:
-                if k in d:
-                    try:
-                        return float(str(d.get(k)).replace(',', '.'))
-                    except Exception:
-                        pass
-            return None
-
-        def _extract_price(d: Dict[str, Any]) -> float | None:
-            for k in PRICE_KEYS:
-                if k in d:
-                    val = _parse_float(d.get(k))
-                    if val is not None:
-                        return val
-            return None
-
-        # [OTIMIZAÇÃO] Filtro estrito para saída
-        # EXCEÇÃO: EAN 550 (frango abatido) sempre disponível
-        ALWAYS_AVAILABLE_EANS = ["550"]
-        is_always_available = ean_digits in ALWAYS_AVAILABLE_EANS
-        
-        sanitized: list[Dict[str, Any]] = []
-        for it in items:
-            if not isinstance(it, dict):
-                continue
-            
-            # Verificar disponibilidade real
-            real_availability = _is_available(it)
-            
-            # Se for sempre disponível, forçamos True
-            final_availability = True if is_always_available else real_availability
-
-            # Cria dict limpo apenas com campos essenciais
-            clean = {}
-            
-            # Copiar apenas identificadores básicos se existirem
-            for k in ["produto", "nome", "descricao", "id", "ean", "cod_barra"]:
-                if k in it: clean[k] = it[k]
-
-            # Definir disponibilidade final
-            clean["disponibilidade"] = final_availability
-
-            # Normalizar preço em campo unificado
-            price = _extract_price(it)
-            if price is not None:
-                clean["preco"] = price
-
-            qty = _extract_qty(it)
-            if qty is not None:
-                clean["quantidade"] = qty
-
-            sanitized.append(clean)
-
-        logger.info(f"EAN {ean_digits}: {len(sanitized)} item(s) procecsados (incluindo indisponíveis)")
-
-        return json.dumps(sanitized, indent=2, ensure_ascii=False)
-
     except requests.exceptions.Timeout:
         msg = "Erro: Timeout ao consultar preço/estoque por EAN. Tente novamente."
         logger.error(msg)
-        return msg
+        raise ToolError(msg)
     except requests.exceptions.HTTPError as e:
         status = getattr(e.response, "status_code", "?")
         body = getattr(e.response, "text", "")
         msg = f"Erro HTTP ao consultar EAN: {status} - {body}"
         logger.error(msg)
-        return msg
+        raise ToolError(msg)
     except requests.exceptions.RequestException as e:
         msg = f"Erro ao consultar EAN: {str(e)}"
         logger.error(msg)
-        return msg
+        raise ToolError(msg)
 
-    # [Cleanup] Removido bloco duplicado de ean_lookup antigo fora de função
+    # resposta esperada: lista de objetos
+    try:
+        items = resp.json()
+    except ValueError:
+        logger.warning("Resposta não é JSON válido; retornando texto bruto")
+        raise ToolError(resp.text)
+
+    # Se vier um único objeto, normalizar para lista
+    items = items if isinstance(items, list) else ([items] if isinstance(items, dict) else [])
+    result = [_to_stock_item(it, ean_digits) for it in items if isinstance(it, dict)]
+    logger.info(f"EAN {ean_digits}: {len(result)} item(s) processados (incluindo indisponíveis)")
+    return result
+
+
+def estoque_preco(ean: str) -> str:
+    """
+    Consulta preço e disponibilidade pelo EAN.
+
+    Args:
+        ean: Código EAN do produto (apenas dígitos).
+
+    Returns:
+        JSON compacto com informações do produto ou mensagem de erro amigável.
+    """
+    try:
+        return to_tool_json(consultar_estoque_ean(ean))
+    except ToolError as e:
+        return str(e)
 
 
 # ============================================
@@ -607,7 +677,6 @@ def busca_lote_produtos(produtos: list[str]) -> str:
         String formatada com todos os produtos encontrados e seus preços
     """
     from concurrent.futures import ThreadPoolExecutor, as_completed
-    import time
     
     start_time = time.time()
     logger.info(f"🚀 Iniciando busca em lote para {len(produtos)} produtos")
@@ -615,59 +684,25 @@ def busca_lote_produtos(produtos: list[str]) -> str:
     def buscar_produto_completo(produto: str) -> dict:
         """Busca EAN e depois preço de um produto"""
         try:
-            # 1. Buscar EAN
-            ean_result = ean_lookup(produto)
-            if "EANS_ENCONTRADOS" not in ean_result:
-                return {"produto": produto, "erro": "Não encontrado", "preco": None}
-            
-            # 2. Extrair TODOS os EANs e encontrar o mais relevante
-            import re
-            
-            # Parse das linhas: "1) 243 - COXA SOBRECOXA MQ kg"
-            linhas = ean_result.split('\n')
-            candidatos = []
-            
-            for linha in linhas:
-                # Procurar padrão: número) EAN - NOME
-                match = re.match(r'\d+\)\s*(\d+)\s*-\s*(.+)', linha.strip())
-                if match:
-                    ean = match.group(1)
-                    nome = match.group(2).strip()
-                    candidatos.append({"ean": ean, "nome": nome})
-            
-            if not candidatos:
-                return {"produto": produto, "erro": "EAN não extraído", "preco": None}
-            
-            # 3. Encontrar o candidato mais relevante (nome mais parecido com a busca)
-            produto_lower = produto.lower()
-            melhor_candidato = candidatos[0]  # fallback: primeiro
-            melhor_score = 0
-            
-            for c in candidatos:
-                nome_lower = c["nome"].lower()
-                # Score: quantas palavras da busca aparecem no nome
-                score = sum(1 for palavra in produto_lower.split() if palavra in nome_lower)
-                # Bonus se nome contém exatamente a busca
-                if produto_lower in nome_lower:
-                    score += 5
-                if score > melhor_score:
-                    melhor_score = score
-                    melhor_candidato = c
-            
-            ean = melhor_candidato["ean"]
-            logger.debug(f"EAN selecionado para '{produto}': {ean} - {melhor_candidato['nome']}")
+            # 1. Atalho aprendido (consulta -> EAN confirmado no carrinho) dispensa a busca remota
+            ean = ean_overrides.lookup(produto)
+            if not ean:
+                # Buscar EAN (candidatos já estruturados, sem parse de texto)
+                candidatos = [c for c in buscar_eans(produto) if c.ean]
+                if not candidatos:
+                    return {"produto": produto, "erro": "Não encontrado", "preco": None}
+                
+                # 2. Encontrar o candidato mais relevante (nome mais parecido com a busca)
+                melhor_candidato = best_match(Query(produto), candidatos, lambda c: c.nome)
+                
+                ean = melhor_candidato.ean
+                logger.debug(f"EAN selecionado para '{produto}': {ean} - {melhor_candidato.nome}")
             
-            # 4. Buscar preço
-            preco_result = estoque_preco(ean)
-            try:
-                preco_data = json.loads(preco_result)
-                if preco_data and isinstance(preco_data, list) and len(preco_data) > 0:
-                    item = preco_data[0]
-                    nome = item.get("produto", item.get("nome", produto))
-                    preco = item.get("preco", 0)
-                    return {"produto": nome, "erro": None, "preco": preco, "ean": ean}
-            except:
-                pass
+            # 3. Buscar preço
+            itens = consultar_estoque_ean(ean)
+            if itens:
+                item = itens[0]
+                return {"produto": item.produto or produto, "erro": None, "preco": item.preco or 0, "ean": ean}
             
             return {"produto": produto, "erro": "Preço não encontrado", "preco": None}
             
@@ -678,7 +713,7 @@ def busca_lote_produtos(produtos: list[str]) -> str:
     # Executar buscas em paralelo (máximo 5 threads para não sobrecarregar)
     resultados = []
     with ThreadPoolExecutor(max_workers=5) as executor:
-        futures = {executor.submit(buscar_produto_completo, p): p for p in produtos}
+        futures = {executor.submit(tracing.wrap(buscar_produto_completo), p): p for p in produtos}
         
         for future in as_completed(futures):
             resultado = future.result()
@@ -714,7 +749,9 @@ def busca_lote_produtos(produtos: list[str]) -> str:
 
 # Nome do FileSearchStore no Google
 FILE_SEARCH_STORE = "fileSearchStores/produtossupermercadoqueiroz-qhsuc929p2ie"
+FILE_SEARCH_MODEL = "gemini-2.5-flash"
 
+@tracing.traced("gemini.file_search")
 def busca_file_search(query: str) -> str:
     """
     Busca produtos usando Google File Search (RAG vetorizado).
@@ -726,20 +763,25 @@ def busca_file_search(query: str) -> str:
     Returns:
         String formatada com produtos encontrados
     """
-    import os
-    
-    api_key = os.getenv("GOOGLE_API_KEY") or getattr(settings, 'google_api_key', None)
-    if not api_key:
+    if not settings.google_api_key:
         logger.error("GOOGLE_API_KEY não configurada")
         return "❌ Erro de configuração: API key não encontrada."
-    
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={api_key}"
+
+    cache_key = canonical_query(query)
+    cached = _file_search_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"♻️ File Search em cache para '{query}' ({cache_key})")
+        return cached
+
+    # Medida já convertida (2l = 2000ml) para o modelo não depender da grafia
+    sizes = product_key(query).sizes
+    size_hint = f"\nMedida pedida: {', '.join(s.text for s in sizes)} (considere equivalentes: 2L = 2000ml, 1kg = 1000g)." if sizes else ""
     
     payload = {
         "contents": [
             {
                 "parts": [{
-                    "text": f"""Encontre no catálogo de produtos os itens mais parecidos com: "{query}"
+                    "text": f"""Encontre no catálogo de produtos os itens mais parecidos com: "{query}"{size_hint}
 
 REGRAS:
 1. Retorne uma lista com até 10 produtos relevantes.
@@ -770,7 +812,7 @@ Retorne APENAS a lista, sem textos explicativos."""
     
     try:
         logger.info(f"🔍 File Search: buscando '{query}'")
-        response = requests.post(url, json=payload, timeout=30)
+        response = gemini.rest_generate_content(FILE_SEARCH_MODEL, payload, op="file_search", timeout=30)
         
         if response.status_code == 200:
             data = response.json()
@@ -778,6 +820,7 @@ Retorne APENAS a lista, sem textos explicativos."""
             
             if text:
                 logger.info(f"✅ File Search retornou {len(text)} chars")
+                _file_search_cache.set(cache_key, text)
                 return text
             else:
                 return "Nenhum produto encontrado."
@@ -794,7 +837,7 @@ Retorne APENAS a lista, sem textos explicativos."""
 def busca_file_search_com_preco(produtos: list) -> str:
     """
     Busca múltiplos produtos no File Search e depois consulta preço na API.
-    Também verifica produtos críticos por palavra-chave (Hybrid Search).
+    Produtos com atalho aprendido (tools/overrides.py) pulam o File Search.
     
     Args:
         produtos: Lista de produtos para buscar
@@ -803,62 +846,19 @@ def busca_file_search_com_preco(produtos: list) -> str:
         String formatada com produtos e preços
     """
     from concurrent.futures import ThreadPoolExecutor, as_completed
-    import time
     
     start_time = time.time()
     logger.info(f"🚀 Iniciando busca File Search + Preço para {len(produtos)} produtos")
     
-    # Mapeamento de produtos críticos (Fallback)
-    # Garante que itens básicos sempre sejam encontrados
-    # Mapeamento de produtos críticos (Fallback)
-    # Mantendo apenas exceções técnicas essenciais
-    CRITICAL_MAPPING = {
-        "frango": "550",          # Frango Abatido (Commodity, muitas vezes ranking baixo)
-        "salsa": "751320919434",  # Salsinha Efraim
-        "salsinha": "751320919434",
-        "cebolinha": "751320919397",
-        "agua sanitaria": "7896221600012", 
-        "kiboa": "7896221600012",
-        "qboa": "7896221600012",
-        "quiboa": "7896221600012"
-        # Removidos: arroz, cafe, coca, monster, carne moida (deixar o search trabalhar)
-    }
-
-    # Identificar EANs extras para buscar diretamente
-    eans_extras = set()
-    for p in produtos:
-        p_norm = p.lower()
-        for k, ean in CRITICAL_MAPPING.items():
-            if k in p_norm:
-                # Evita falso positivo grosseiro (ex: evitar que "frango" pegue em "tempero de frango" se não for o foco, mas para MVP ok)
-                eans_extras.add(ean)
-    
-    if eans_extras:
-        logger.info(f"🛡️ Fallback ativado para EANs: {eans_extras}")
-
-    def buscar_ean_direto(ean: str) -> dict:
-        """Busca direta por EAN para o fallback."""
-        try:
-            preco_result = estoque_preco(ean)
-            preco_data = json.loads(preco_result)
-            if preco_data and isinstance(preco_data, list) and len(preco_data) > 0:
-                item = preco_data[0]
-                return {"produto": item.get("produto"), "preco": item.get("preco"), "ean": ean, "erro": None}
-        except:
-            pass
-        return {"produto": f"EAN {ean}", "preco": None, "ean": ean, "erro": "Não encontrado"}
-
     def buscar_produto(produto: str) -> dict:
         """Busca um produto no File Search e depois pega o preço."""
         try:
-            # 1. Buscar no File Search
-            fs_result = busca_file_search(produto)
-            
-            # 2. Extrair primeiro EAN da resposta
-            ean = None
-            preco = None
             nome = produto
+            # 1. Atalho aprendido (inclui as exceções técnicas, ex: frango -> 550)
+            ean = ean_overrides.lookup(produto)
+            fs_result = "" if ean else busca_file_search(produto)
             
+            # 2. Extrair primeiro EAN da resposta do File Search
             # Parse simples: buscar padrão "EAN | NOME | CATEGORIA"
             lines = fs_result.strip().split('\n')
             for line in lines:
@@ -878,21 +878,20 @@ def busca_file_search_com_preco(produtos: list) -> str:
                 ean_match = re.search(r'\b(\d{3,13})\b', fs_result)
                 if ean_match:
                     ean = ean_match.group(1)
+            if ean and fs_result:
+                # Candidato a atalho se o cliente confirmar no carrinho
+                ean_overrides.note_search(produto, [ean])
             
-            # 3. Consultar preço se encontrou EAN
             # 3. Consultar preço se encontrou EAN
             if ean:
-                preco_result = estoque_preco(ean)
                 try:
-                    preco_data = json.loads(preco_result)
-                    if preco_data and isinstance(preco_data, list) and len(preco_data) > 0:
-                        item = preco_data[0]
-                        nome = item.get("produto", item.get("nome", nome))
-                        preco = item.get("preco", 0)
-                        disponivel = item.get("disponibilidade", False)
-                        return {"produto": nome, "preco": preco, "ean": ean, "disponivel": disponivel, "erro": None}
-                except:
-                    pass
+                    itens = consultar_estoque_ean(ean)
+                except ToolError:
+                    itens = []
+                if itens:
+                    item = itens[0]
+                    return {"produto": item.produto or nome, "preco": item.preco or 0, "ean": ean,
+                            "disponivel": item.disponibilidade, "erro": None}
             
             return {"produto": nome, "preco": None, "ean": ean, "disponivel": False, "erro": "Preço não encontrado"}
             
@@ -903,26 +902,12 @@ def busca_file_search_com_preco(produtos: list) -> str:
     # Executar buscas em paralelo
     resultados = []
     with ThreadPoolExecutor(max_workers=5) as executor:
-        # Busca vetorial (File Search)
-        futures_fs = {executor.submit(buscar_produto, p): p for p in produtos}
-        
-        # Busca direta (Fallback)
-        futures_fb = {executor.submit(buscar_ean_direto, ean): ean for ean in eans_extras}
-        
-        # Coletar File Search
-        for future in as_completed(futures_fs):
+        futures = {executor.submit(tracing.wrap(buscar_produto), p): p for p in produtos}
+        for future in as_completed(futures):
             resultados.append(future.result())
-            
-        # Coletar Fallback (evitar duplicatas de EAN se possível, mas ok repetir na lista final)
-        found_eans = [r.get("ean") for r in resultados if r.get("ean")]
-        for future in as_completed(futures_fb):
-            res = future.result()
-            # Só adiciona se o EAN ainda não foi encontrado pelo File Search
-            if res.get("ean") not in found_eans and res.get("preco") is not None:
-                resultados.append(res)
     
     elapsed = time.time() - start_time
-    logger.info(f"✅ File Search + Fallback concluído em {elapsed:.2f}s")
+    logger.info(f"✅ File Search + Preço concluído em {elapsed:.2f}s (atalhos: {ean_overrides.stats()})")
     
     # Formatar resposta
     encontrados = []
@@ -937,9 +922,7 @@ def busca_file_search_com_preco(produtos: list) -> str:
                 # Produto Indisponível (mas encontrado)
                 encontrados.append(f"• {r['produto']} - INDISPONÍVEL (Sem estoque)")
         else:
-            # Só adiciona a lista de não encontrados se não for um EAN extra que falhou
-            if "EAN" not in r['produto']:
-                nao_encontrados.append(r['produto'])
+            nao_encontrados.append(r['produto'])
     
     resposta = []
     if encontrados:
@@ -947,9 +930,6 @@ def busca_file_search_com_preco(produtos: list) -> str:
         resposta.extend(list(set(encontrados))) # Remove duplicatas exatas de string
     
     if nao_encontrados:
-        # Filtrar não encontrados se algum forçado tiver dado certo para o mesmo termo? 
-        # Difícil saber qual termo gerou qual fallback aqui sem mapeamento reverso complexo.
-        # Deixa assim, o usuário vê o que achou.
         resposta.append(f"\nNÃO_ENCONTRADOS: {', '.join(set(nao_encontrados))}")
     
     return "\n".join(resposta) if resposta else "Nenhum produto encontrado."
@@ -0,0 +1,255 @@
+"""
+Armazenamento local (em memória) usado como fallback quando o Redis cai
+
+- Semântica de TTL por chave, como no Redis (expira sozinho).
+- Limite de chaves e de memória (aprox.), com despejo LRU.
+- Tipos suportados: string, list, hash e zset (o mínimo usado pelo agente).
+- Registra as chaves escritas durante a queda para reenviar ao Redis
+  (`replay`) quando a conexão voltar. O local só conhece o que foi escrito
+  durante a queda, então o replay soma ao Redis em vez de substituir:
+  listas são anexadas, chaves que já existem no Redis (escritas antes da
+  queda ou por outro processo) são mantidas, e quem chama pode mesclar
+  chaves específicas (carrinho, sessão) via `merge`.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from config.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def _approx_size(value: Any) -> int:
+    """Tamanho aproximado em bytes (strings dominam o consumo aqui)."""
+    if isinstance(value, str):
+        return len(value) + 49
+    if isinstance(value, (int, float)):
+        return 28
+    if isinstance(value, list):
+        return 56 + sum(_approx_size(v) for v in value)
+    if isinstance(value, dict):
+        return 64 + sum(_approx_size(k) + _approx_size(v) for k, v in value.items())
+    return 64
+
+
+class _Entry:
+    __slots__ = ("kind", "value", "expires_at", "size")
+
+    def __init__(self, kind: str, value: Any, expires_at: Optional[float]):
+        self.kind = kind
+        self.value = value
+        self.expires_at = expires_at
+        self.size = _approx_size(value)
+
+
+class LocalStore:
+    """Subconjunto de comandos do Redis em memória, com TTL, LRU e limite de bytes."""
+
+    def __init__(self, max_keys: int = 5000, max_bytes: int = 16 * 1024 * 1024):
+        self.max_keys = max_keys
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._dirty: set = set()      # chaves escritas durante a queda
+        self._deleted: set = set()    # chaves apagadas durante a queda
+        self._evictions = 0
+        self.lock = threading.RLock()
+
+    # --- infraestrutura ---
+
+    def _live(self, key: str) -> Optional[_Entry]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at is not None and entry.expires_at <= time.monotonic():
+            self._drop(key)
+            return None
+        self._data.move_to_end(key)
+        return entry
+
+    def _drop(self, key: str) -> None:
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def _store(self, key: str, kind: str, value: Any, ttl: Optional[float] = None, keep_ttl: bool = False) -> _Entry:
+        old = self._data.get(key)
+        expires_at = old.expires_at if (keep_ttl and old is not None) else (
+            time.monotonic() + ttl if ttl else None)
+        self._drop(key)
+        entry = _Entry(kind, value, expires_at)
+        self._data[key] = entry
+        self._bytes += entry.size
+        self._dirty.add(key)
+        self._deleted.discard(key)
+        self._evict()
+        return entry
+
+    def _touch(self, key: str, entry: _Entry) -> None:
+        """Recalcula o tamanho após mutação in-place."""
+        self._bytes -= entry.size
+        entry.size = _approx_size(entry.value)
+        self._bytes += entry.size
+        self._dirty.add(key)
+        self._evict()
+
+    def _evict(self) -> None:
+        while self._data and (len(self._data) > self.max_keys or self._bytes > self.max_bytes):
+            key, entry = self._data.popitem(last=False)
+            self._bytes -= entry.size
+            self._dirty.discard(key)
+            self._evictions += 1
+            logger.warning(f"[fallback] Chave despejada (limite de chaves/memória): {key}")
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "keys": len(self._data),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self._evictions,
+                "pending_replay": len(self._dirty) + len(self._deleted),
+            }
+
+    # --- chaves ---
+
+    def delete(self, *keys: str) -> int:
+        with self.lock:
+            n = 0
+            for key in keys:
+                if self._live(key) is not None:
+                    n += 1
+                self._drop(key)
+                self._dirty.discard(key)
+                self._deleted.add(key)
+            return n
+
+    def ttl(self, key: str) -> int:
+        with self.lock:
+            entry = self._live(key)
+            if entry is None:
+                return -2
+            if entry.expires_at is None:
+                return -1
+            return max(0, int(entry.expires_at - time.monotonic()))
+
+    def expire(self, key: str, ttl: float) -> bool:
+        with self.lock:
+            entry = self._live(key)
+            if entry is None:
+                return False
+            entry.expires_at = time.monotonic() + ttl
+            self._dirty.add(key)
+            return True
+
+    # --- string ---
+
+    def get(self, key: str) -> Optional[str]:
+        with self.lock:
+            entry = self._live(key)
+            return entry.value if entry is not None and entry.kind == "string" else None
+
+    def set(self, key: str, value: str, ex: Optional[float] = None) -> None:
+        with self.lock:
+            self._store(key, "string", value, ex)
+
+    # --- list ---
+
+    def rpush(self, key: str, value: str) -> int:
+        with self.lock:
+            entry = self._live(key)
+            if entry is None or entry.kind != "list":
+                entry = self._store(key, "list", [value])
+            else:
+                entry.value.append(value)
+                self._touch(key, entry)
+            return len(entry.value)
+
+    def lrange(self, key: str) -> List[str]:
+        with self.lock:
+            entry = self._live(key)
+            return list(entry.value) if entry is not None and entry.kind == "list" else []
+
+    def llen(self, key: str) -> int:
+        return len(self.lrange(key))
+
+    # --- hash / zset (valores são dicts) ---
+
+    def get_mapping(self, key: str, kind: str) -> Dict[str, Any]:
+        """Cópia do hash/zset (vazio se não existir)."""
+        with self.lock:
+            entry = self._live(key)
+            return dict(entry.value) if entry is not None and entry.kind == kind else {}
+
+    def set_mapping(self, key: str, kind: str, mapping: Dict[str, Any], ttl: Optional[float] = None) -> None:
+        """Substitui o hash/zset inteiro; sem `ttl` mantém a expiração atual."""
+        with self.lock:
+            if not mapping:
+                self.delete(key)
+                return
+            self._store(key, kind, dict(mapping), ttl, keep_ttl=ttl is None)
+
+    # --- recuperação ---
+
+    def replay(self, client, merge: Optional[Callable[[Any, str, str, Any, Optional[int], bool], bool]] = None) -> int:
+        """
+        Reenvia ao Redis as chaves escritas durante a queda, preservando o
+        TTL restante, sem apagar o que o Redis já tem:
+
+        - `merge(client, chave, tipo, valor, ttl, existe_no_redis)` decide
+          primeiro; True = chave tratada (ex: linhas de carrinho somadas).
+        - listas são anexadas (RPUSH) ao que estiver no Redis;
+        - string/hash/zset só são gravados se a chave não existir no Redis.
+
+        Apagamentos locais não são reenviados: o local nunca viu a versão do
+        Redis dessas chaves. Com sucesso, o Redis volta a ser a fonte da
+        verdade e o armazenamento local é esvaziado.
+
+        Returns:
+            Quantidade de chaves sincronizadas (exceções do Redis propagam).
+        """
+        with self.lock:
+            pending = []
+            for key in list(self._dirty):
+                entry = self._live(key)
+                if entry is None:
+                    continue
+                ttl = None if entry.expires_at is None else max(1, int(entry.expires_at - time.monotonic()))
+                pending.append((key, entry, ttl))
+            check = client.pipeline(transaction=False)
+            for key, _, _ in pending:
+                check.exists(key)
+            present = check.execute() if pending else []
+
+            pipe = client.pipeline(transaction=False)
+            synced = kept = 0
+            for (key, entry, ttl), exists in zip(pending, present):
+                if merge is not None and merge(client, key, entry.kind, entry.value, ttl, bool(exists)):
+                    synced += 1
+                    continue
+                if entry.kind == "list":
+                    pipe.rpush(key, *entry.value)
+                elif exists:
+                    # Redis tem versão própria (antes da queda ou de outro processo): ela vence
+                    kept += 1
+                    continue
+                elif entry.kind == "string":
+                    pipe.set(key, entry.value)
+                elif entry.kind == "hash":
+                    pipe.hset(key, mapping=entry.value)
+                elif entry.kind == "zset":
+                    pipe.zadd(key, entry.value)
+                if ttl is not None:
+                    pipe.expire(key, ttl)
+                synced += 1
+            pipe.execute()
+            if kept:
+                logger.info(f"♻️ {kept} chave(s) já existiam no Redis; versão do Redis mantida")
+
+            self._data.clear()
+            self._bytes = 0
+            self._dirty.clear()
+            self._deleted.clear()
+            return synced
@@ -0,0 +1,89 @@
+"""
+Pontuação de nomes de produto contra a consulta do cliente
+
+- A consulta é normalizada uma única vez (`Query`) em chave canônica;
+  nomes de candidatos são normalizados com cache (o catálogo se repete
+  muito entre buscas).
+- Seleção dos melhores em uma passada (`heapq.nlargest`, estável).
+
+Usado pelo `ean_lookup` (ranking dos candidatos do smart-responder) e pela
+busca em lote (escolha do melhor EAN por produto).
+"""
+import heapq
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple, TypeVar
+
+from tools.normalizer import normalize, product_key
+
+T = TypeVar("T")
+
+# Pontuação: token da consulta presente no nome / medida presente no nome
+TOKEN_WEIGHT = 1.0
+SIZE_WEIGHT = 1.5
+# Mínimo para considerar um candidato relevante (pelo menos um token)
+MIN_RELEVANT_SCORE = 1.0
+
+
+class Query:
+    """
+    Consulta pré-processada uma vez: chave canônica (tokens com sinônimos,
+    marca e medidas em unidade canônica, ver tools.normalizer).
+    """
+
+    __slots__ = ("raw", "norm", "key", "tokens")
+
+    def __init__(self, raw: str):
+        self.raw = raw or ""
+        self.norm = normalize(self.raw)
+        self.key = product_key(self.raw)
+        self.tokens = self.key.tokens + ((self.key.brand,) if self.key.brand else ())
+
+    def _hits(self, name: str) -> Tuple[int, int, "object"]:
+        nk = product_key(name)
+        nn = normalize(name)
+        name_tokens = set(nk.tokens)
+        if nk.brand:
+            name_tokens.add(nk.brand)
+        # Token canônico igual ou contido no nome (abreviações do catálogo)
+        tokens = sum(1 for tok in self.tokens if tok in name_tokens or tok in nn)
+        sizes = sum(1 for size in self.key.sizes if size in nk.sizes)
+        return tokens, sizes, nk
+
+    def score(self, name: Optional[str]) -> float:
+        """Tokens da consulta presentes no nome + bônus por medida equivalente (2l = 2000ml)."""
+        if not name:
+            return 0.0
+        tokens, sizes, _ = self._hits(name)
+        return TOKEN_WEIGHT * tokens + SIZE_WEIGHT * sizes
+
+    def containment(self, name: Optional[str]) -> int:
+        """Tokens da consulta presentes no nome (+5 se a chave canônica é a mesma)."""
+        if not name:
+            return 0
+        tokens, _, nk = self._hits(name)
+        same = nk.text == self.key.text or (not self.key.sizes and nk.base == self.key.base)
+        return tokens + (5 if same and self.key.tokens else 0)
+
+
+def top_k(query: Query, items: Iterable[T], name_of: Callable[[T], Optional[str]], k: int = 5,
+          min_score: float = MIN_RELEVANT_SCORE) -> List[Tuple[float, T]]:
+    """
+    Os `k` itens mais relevantes (score >= min_score) como (score, item), em
+    ordem decrescente; empates mantêm a ordem original. Sem nenhum relevante,
+    os `k` primeiros.
+    """
+    items = list(items)
+    scored = [(query.score(name_of(it)), i) for i, it in enumerate(items)]
+    best = heapq.nlargest(k, (si for si in scored if si[0] >= min_score), key=lambda si: (si[0], -si[1]))
+    return [(sc, items[i]) for sc, i in (best or scored[:k])]
+
+
+def best_match(query: Query, items: Sequence[T], name_of: Callable[[T], Optional[str]]) -> Optional[T]:
+    """Item com maior `containment` (o primeiro em caso de empate/nenhum casamento)."""
+    if not items:
+        return None
+    best, best_score = items[0], 0
+    for it in items:
+        score = query.containment(name_of(it))
+        if score > best_score:
+            best, best_score = it, score
+    return best
@@ -0,0 +1,300 @@
+"""
+Normalização de nomes de produto em uma chave canônica
+
+"2l", "2 litros" e "2000ml" viram a mesma medida (2000ml); sinônimos
+regionais ("macaxeira" -> "mandioca", "qboa" -> "agua sanitaria") e plurais
+são unificados; marcas conhecidas ficam separadas do nome base.
+
+    product_key("Café Pilão 0,5kg").text  ->  "cafe|pilao|500g"
+
+A mesma normalização é aplicada ao catálogo (pré-computada uma vez,
+`get_catalog_index`) e às consultas, então o ranking vira comparação de
+chaves e consultas equivalentes caem na mesma entrada de cache.
+"""
+import json
+import re
+import threading
+import unicodedata
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from config.settings import settings
+from config.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+
+@lru_cache(maxsize=8192)
+def normalize(text: str) -> str:
+    """Minúsculas e sem acentos (cacheado)."""
+    decomposed = unicodedata.normalize("NFD", (text or "").lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+# Quantidade + unidade ("2l", "2 litros", "0,5 kg", "12 un")
+SIZE_RE = re.compile(
+    r"(\d+(?:[.,]\d+)?)\s*"
+    r"(kgs?|quilos?|kilos?|gramas?|grs?|g|mg|litros?|lts?|l|ml|unidades?|unids?|und|un)\b"
+)
+WORD_RE = re.compile(r"[a-z0-9]+")
+
+# Unidade -> (unidade canônica, multiplicador)
+UNITS: Dict[str, Tuple[str, float]] = {
+    "kg": ("g", 1000), "kgs": ("g", 1000), "quilo": ("g", 1000), "quilos": ("g", 1000),
+    "kilo": ("g", 1000), "kilos": ("g", 1000),
+    "g": ("g", 1), "gr": ("g", 1), "grs": ("g", 1), "grama": ("g", 1), "gramas": ("g", 1),
+    "mg": ("g", 0.001),
+    "l": ("ml", 1000), "lt": ("ml", 1000), "lts": ("ml", 1000), "litro": ("ml", 1000), "litros": ("ml", 1000),
+    "ml": ("ml", 1),
+    "un": ("un", 1), "und": ("un", 1), "unid": ("un", 1), "unids": ("un", 1),
+    "unidade": ("un", 1), "unidades": ("un", 1),
+}
+
+# Sinônimos regionais (já normalizados: minúsculas, sem acento)
+REGIONAL_SYNONYMS: Dict[str, str] = {
+    "macaxeira": "mandioca",
+    "aipim": "mandioca",
+    "jerimum": "abobora",
+    "bolacha": "biscoito",
+    "salsinha": "salsa",
+    "refri": "refrigerante",
+    "coca": "coca cola",
+    "qboa": "agua sanitaria",
+    "kiboa": "agua sanitaria",
+    "quiboa": "agua sanitaria",
+    "que boa": "agua sanitaria",
+    "aqui boa": "agua sanitaria",
+    "leite de moca": "leite condensado",
+    "mucarela": "mussarela",
+    "muzzarela": "mussarela",
+    "salsichao": "linguica",
+    "feijao mulatinho": "feijao carioca",
+    "arroz agulhinha": "arroz parboilizado",
+    "xilito": "salgadinho",
+    "chilito": "salgadinho",
+}
+
+# Marcas frequentes no catálogo (separadas do nome base na chave)
+KNOWN_BRANDS: FrozenSet[str] = frozenset({
+    "pilao", "melitta", "camil", "tio joao", "sadia", "perdigao", "seara", "ype", "omo",
+    "ninho", "itambe", "nestle", "piracanjuba", "coca cola", "guarana antarctica", "dragao",
+    "efraim", "vitarella", "fortaleza", "santa amalia", "kicaldo", "marata",
+    "tres coracoes", "sao braz", "betania", "italac", "qualy", "doriana", "quero",
+})
+
+STOPWORDS: FrozenSet[str] = frozenset({
+    "de", "da", "do", "das", "dos", "com", "e", "o", "a", "os", "as", "um", "uma",
+    "pra", "para", "tipo", "pacote", "pct", "cx", "caixa", "garrafa", "lata", "mq",
+})
+
+
+class Size:
+    """Medida canônica (gramas, mililitros ou unidades)."""
+
+    __slots__ = ("amount", "unit")
+
+    def __init__(self, amount: float, unit: str):
+        self.amount = amount
+        self.unit = unit
+
+    @property
+    def text(self) -> str:
+        amount = round(self.amount, 3)
+        return f"{amount:g}{self.unit}"
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Size) and self.unit == other.unit and abs(self.amount - other.amount) < 1e-6
+
+    def __hash__(self) -> int:
+        return hash(self.text)
+
+    def __repr__(self) -> str:
+        return f"Size({self.text})"
+
+
+class ProductKey:
+    """Chave canônica: tokens base (sem marca/medida), marca e medidas."""
+
+    __slots__ = ("tokens", "brand", "sizes", "text")
+
+    def __init__(self, tokens: Tuple[str, ...], brand: Optional[str], sizes: Tuple[Size, ...]):
+        self.tokens = tokens
+        self.brand = brand
+        self.sizes = sizes
+        self.text = "|".join((" ".join(tokens), brand or "", ",".join(s.text for s in sizes)))
+
+    @property
+    def base(self) -> str:
+        """Chave sem a medida (ex: para agrupar embalagens do mesmo produto)."""
+        return f"{' '.join(self.tokens)}|{self.brand or ''}"
+
+    def __repr__(self) -> str:
+        return f"ProductKey({self.text!r})"
+
+
+def parse_sizes(text: str) -> Tuple[Size, ...]:
+    """Medidas encontradas no texto já normalizado, em unidade canônica."""
+    sizes = []
+    for amount, unit in SIZE_RE.findall(text):
+        base_unit, factor = UNITS[unit]
+        sizes.append(Size(float(amount.replace(",", ".")) * factor, base_unit))
+    return tuple(sizes)
+
+
+def _singular(token: str) -> str:
+    """Plural simples do português ("tomates" -> "tomate", "ovos" -> "ovo")."""
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss") and not token.isdigit():
+        return token[:-1]
+    return token
+
+
+class Normalizer:
+    """Aplica medidas, sinônimos e marcas (frase mais longa primeiro) e stopwords."""
+
+    def __init__(self, synonyms: Dict[str, str], brands: Iterable[str]):
+        self.synonyms = {normalize(k): normalize(v) for k, v in synonyms.items()}
+        self.brands = frozenset(normalize(b) for b in brands)
+        self._max_phrase = max([len(k.split()) for k in list(self.synonyms) + list(self.brands)] + [1])
+
+    def key(self, text: str) -> ProductKey:
+        norm = normalize(text)
+        sizes = parse_sizes(norm)
+        words = WORD_RE.findall(SIZE_RE.sub(" ", norm))
+
+        tokens: List[str] = []
+        brand: Optional[str] = None
+        i = 0
+        while i < len(words):
+            # Casa a frase mais longa primeiro ("que boa" antes de "boa")
+            for n in range(min(self._max_phrase, len(words) - i), 0, -1):
+                phrase = " ".join(words[i:i + n])
+                if phrase in self.synonyms:
+                    tokens.extend(self.synonyms[phrase].split())
+                    break
+                if phrase in self.brands and brand is None:
+                    brand = phrase
+                    break
+            else:
+                n = 1
+                if words[i] not in STOPWORDS:
+                    tokens.append(_singular(words[i]))
+            i += n
+
+        # Sinônimos podem trazer palavras de marca ("coca" -> "coca cola")
+        joined = " ".join(tokens)
+        if brand is None:
+            for b in self.brands:
+                if f" {b} " in f" {joined} ":
+                    brand = b
+                    joined = f" {joined} ".replace(f" {b} ", " ").strip()
+                    break
+        tokens = [t for t in joined.split() if t not in STOPWORDS]
+        return ProductKey(tuple(sorted(set(tokens))), brand, sizes)
+
+
+_default: Optional["Normalizer"] = None  # montado em _init_default()
+
+
+@lru_cache(maxsize=8192)
+def product_key(text: str) -> ProductKey:
+    """Chave canônica do texto (cacheada; catálogo e consultas se repetem)."""
+    return _default.key(text or "")
+
+
+def canonical_query(text: str) -> str:
+    """Texto usado como chave de cache de buscas (mesma chave = mesma busca)."""
+    return product_key(text).text
+
+
+# ============================================
+# Catálogo pré-computado
+# ============================================
+
+class CatalogIndex:
+    """Produtos do catálogo agrupados pela chave canônica (nome e sinônimos)."""
+
+    def __init__(self, products: List[Dict]):
+        self.by_key: Dict[str, List[Tuple[str, str]]] = {}
+        self.by_base: Dict[str, List[Tuple[str, str]]] = {}
+        for prod in products:
+            ean, nome = str(prod.get("ean") or "").strip(), prod.get("nome") or prod.get("produto") or ""
+            if not ean or not nome:
+                continue
+            for text in [nome, *(prod.get("sinonimos") or [])]:
+                key = product_key(text)
+                self._add(self.by_key, key.text, ean, nome)
+                self._add(self.by_base, key.base, ean, nome)
+        logger.info(f"Catálogo normalizado: {len(products)} produtos, {len(self.by_key)} chaves")
+
+    @staticmethod
+    def _add(index: Dict[str, List[Tuple[str, str]]], key: str, ean: str, nome: str) -> None:
+        bucket = index.setdefault(key, [])
+        if (ean, nome) not in bucket:
+            bucket.append((ean, nome))
+
+    def lookup(self, query: str) -> List[Tuple[str, str]]:
+        """(ean, nome) com chave idêntica; sem medida na consulta, aceita qualquer embalagem."""
+        key = product_key(query)
+        if not key.tokens:
+            return []
+        if key.sizes:
+            return list(self.by_key.get(key.text, []))
+        return list(self.by_base.get(key.base, []))
+
+
+_catalog: Optional[CatalogIndex] = None
+_catalog_lock = threading.Lock()
+
+
+def _load_kb_synonyms() -> Dict[str, str]:
+    """Sinônimos do dicionário da base de conhecimento ("'x' significa y.")."""
+    kb_path = Path(__file__).resolve().parent.parent / "knowledge_base_content.json"
+    synonyms: Dict[str, str] = {}
+    try:
+        for item in json.loads(kb_path.read_text(encoding="utf-8")):
+            if item.get("metadata", {}).get("type") != "dictionary":
+                continue
+            content = item.get("content", "")
+            if " significa " not in content:
+                continue  # "pode ser ..." é ambíguo: fica com o LLM
+            terms, target = content.split(" significa ", 1)
+            target = re.sub(r"\(.*?\)", "", target).strip(" .")
+            for term in re.findall(r"'([^']+)'", terms):
+                synonyms[term] = target
+    except Exception as e:
+        logger.warning(f"Dicionário da base de conhecimento indisponível para sinônimos: {e}")
+    return synonyms
+
+
+def get_catalog_index() -> Optional[CatalogIndex]:
+    """Índice do catálogo (PRODUCT_CATALOG_PATH), construído uma vez; None se não configurado."""
+    global _catalog
+    if _catalog is None and settings.product_catalog_path:
+        with _catalog_lock:
+            if _catalog is None:
+                try:
+                    products = json.loads(Path(settings.product_catalog_path).read_text(encoding="utf-8"))
+                    _catalog = CatalogIndex(products)
+                except Exception as e:
+                    logger.error(f"Erro ao carregar catálogo para normalização: {e}")
+                    return None
+    return _catalog
+
+
+def _init_default() -> None:
+    """Sinônimos fixos + dicionário da base, descartando expansões e ciclos."""
+    global _default
+    regional = {normalize(k): normalize(v) for k, v in REGIONAL_SYNONYMS.items()}
+    synonyms = {}
+    for term, target in _load_kb_synonyms().items():
+        term, target = normalize(term), normalize(target)
+        # "frango" -> "frango abatido" é detalhe de catálogo, não sinônimo
+        if set(term.split()) <= set(target.split()) or regional.get(target) == term:
+            continue
+        synonyms[term] = target
+    synonyms.update(regional)
+    _default = Normalizer(synonyms, KNOWN_BRANDS)
+
+
+_init_default()
@@ -0,0 +1,264 @@
+"""
+Outbox de pedidos: envio ao painel fora do turno do agente
+
+- O pedido é gravado no Redis com uma chave de idempotência
+  (sha256 do telefone + início da sessão de pedido + itens); finalizar
+  duas vezes o mesmo carrinho enquanto o primeiro está em envio não cria
+  um segundo pedido. Pedido já confirmado ou recusado não bloqueia um
+  novo com os mesmos itens (recompra no mesmo dia, nova tentativa).
+- Um worker em background envia ao painel com backoff exponencial.
+  O envio carrega o header `Idempotency-Key`, então reenvios após
+  timeout também não duplicam.
+- Quando o painel confirma (ou desiste após N tentativas), o notificador
+  registrado pelo servidor avisa o cliente.
+
+Estruturas no Redis:
+  order_outbox   ZSET  <chave> com score = próxima tentativa (epoch)
+  order:{chave}  HASH  telefone, payload, status, attempts, last_error, result
+"""
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import redis
+
+from config.settings import settings
+from config.logger import setup_logger
+from tools.http_tools import enviar_pedido
+from tools.redis_tools import get_redis_client, get_order_session, _script, _on_redis_error
+
+logger = setup_logger(__name__)
+
+OUTBOX_KEY = "order_outbox"
+ORDER_TTL = 24 * 60 * 60  # registro do pedido fica 24h para consulta/auditoria
+# Pedidos novos com o mesmo carrinho na mesma sessão (após confirmado/recusado)
+_MAX_REORDERS = 10
+
+# Notificador: (telefone, status, mensagem) -> None. Registrado pelo servidor.
+OrderNotifier = Callable[[str, str, str], None]
+_notifier: Optional[OrderNotifier] = None
+
+
+def order_key(idempotency_key: str) -> str:
+    """Chave do hash do pedido no Redis."""
+    return f"order:{idempotency_key}"
+
+
+def order_idempotency_key(telefone: str, itens: Any, session_id: str = "", generation: int = 0) -> str:
+    """
+    sha256(telefone + sessão + itens) com JSON canônico (ordem das chaves
+    fixa). `session_id` é o início da sessão de pedido: a mesma compra em
+    outra sessão é outro pedido. `generation` > 0 gera a chave de um novo
+    pedido na mesma sessão depois que o anterior terminou.
+    """
+    canonical = json.dumps(itens, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    raw = f"{telefone}|{session_id}|{canonical}" + (f"|{generation}" if generation else "")
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def set_order_notifier(fn: OrderNotifier) -> None:
+    """Registra quem avisa o cliente quando o pedido é confirmado/recusado."""
+    global _notifier
+    _notifier = fn
+
+
+# Enfileira o pedido se a chave ainda não existir (idempotente)
+# KEYS: order, outbox | ARGV: telefone, payload, agora_iso, agora_epoch, ttl, chave
+# Retorna {novo (0/1), status}
+_LUA_ENQUEUE = """
+local status = redis.call('HGET', KEYS[1], 'status')
+if status then return {0, status} end
+redis.call('HSET', KEYS[1], 'telefone', ARGV[1], 'payload', ARGV[2], 'status', 'pending',
+           'attempts', 0, 'created_at', ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+redis.call('ZADD', KEYS[2], ARGV[4], ARGV[6])
+return {1, 'pending'}
+"""
+
+# Reserva o pedido para este worker: só quem mover o score vence (lease)
+# KEYS: outbox | ARGV: chave, agora_epoch, fim_do_lease
+_LUA_CLAIM = """
+local score = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if not score or tonumber(score) > tonumber(ARGV[2]) then return 0 end
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+return 1
+"""
+
+
+def enqueue_order(telefone: str, payload: Dict[str, Any]) -> Tuple[str, str, bool]:
+    """
+    Grava o pedido na outbox.
+
+    Só um pedido ainda em envio ('pending') com a mesma chave é tratado
+    como duplicata; se o anterior já foi confirmado ou recusado, grava um
+    pedido novo (chave da próxima geração).
+
+    Returns:
+        (chave_idempotencia, status, novo). Status 'pending' quando o pedido
+        está na outbox (novo ou duplicata em envio); 'unavailable' quando o
+        Redis está fora (o chamador decide enviar direto).
+    """
+    session = get_order_session(telefone) or {}
+    session_id = str(session.get("started_at") or "")
+    itens = payload.get("itens", [])
+    key = order_idempotency_key(telefone, itens, session_id)
+    client = get_redis_client()
+    if client is None:
+        return key, "unavailable", False
+
+    try:
+        enqueue = _script(client, "order_enqueue", _LUA_ENQUEUE)
+        for generation in range(_MAX_REORDERS + 1):
+            key = order_idempotency_key(telefone, itens, session_id, generation)
+            new, status = enqueue(
+                keys=[order_key(key), OUTBOX_KEY],
+                args=[telefone, json.dumps(payload, ensure_ascii=False), datetime.now().isoformat(),
+                      time.time(), ORDER_TTL, key],
+            )
+            if int(new) or status == "pending":
+                break
+            logger.info(f"📮 Pedido {key[:12]} já terminou ({status}); registrando novo pedido")
+        else:
+            logger.error(f"Pedido de {telefone} repetido {_MAX_REORDERS} vezes na mesma sessão; não enfileirado")
+            return key, status, False
+
+        if int(new):
+            logger.info(f"📮 Pedido {key[:12]} enfileirado para {telefone}")
+        else:
+            logger.info(f"📮 Pedido {key[:12]} já está em envio; ignorando duplicata")
+        outbox_worker.wake()
+        return key, status, bool(int(new))
+    except redis.exceptions.RedisError as e:
+        _on_redis_error(e)
+        logger.error(f"Erro ao enfileirar pedido: {e}")
+        return key, "unavailable", False
+
+
+def get_order_status(idempotency_key: str) -> Optional[Dict[str, str]]:
+    """Registro do pedido (status, tentativas, último erro...)."""
+    client = get_redis_client()
+    if client is None:
+        return None
+    try:
+        data = client.hgetall(order_key(idempotency_key))
+        return data or None
+    except redis.exceptions.RedisError as e:
+        _on_redis_error(e)
+        logger.error(f"Erro ao consultar pedido: {e}")
+        return None
+
+
+def outbox_depth() -> int:
+    """Pedidos aguardando envio (ou nova tentativa); -1 se o Redis estiver fora."""
+    client = get_redis_client()
+    if client is None:
+        return -1
+    try:
+        return int(client.zcard(OUTBOX_KEY))
+    except redis.exceptions.RedisError as e:
+        _on_redis_error(e)
+        return -1
+
+
+def _notify(telefone: str, status: str, mensagem: str) -> None:
+    if _notifier is None:
+        logger.warning(f"Pedido de {telefone} {status}, mas nenhum notificador registrado")
+        return
+    try:
+        _notifier(telefone, status, mensagem)
+    except Exception as e:
+        logger.error(f"Erro ao notificar cliente sobre pedido: {e}")
+
+
+class OrderOutboxWorker:
+    """Thread única que drena a outbox (vários processos podem rodar juntos)."""
+
+    def __init__(self):
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="order-outbox", daemon=True)
+        self._thread.start()
+        logger.info("📮 Worker da outbox de pedidos iniciado")
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def wake(self) -> None:
+        """Acorda o worker (pedido novo não espera o próximo ciclo)."""
+        self._wake.set()
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.drain()
+            except Exception as e:
+                logger.error(f"Erro no worker da outbox: {e}")
+            self._wake.wait(settings.order_outbox_poll_interval)
+            self._wake.clear()
+
+    def drain(self, batch: int = 10) -> int:
+        """Processa os pedidos vencidos. Retorna quantos foram tentados."""
+        client = get_redis_client()
+        if client is None:
+            return 0
+        now = time.time()
+        try:
+            due = client.zrangebyscore(OUTBOX_KEY, "-inf", now, start=0, num=batch)
+        except redis.exceptions.RedisError as e:
+            _on_redis_error(e)
+            return 0
+
+        claim = _script(client, "order_claim", _LUA_CLAIM)
+        done = 0
+        for key in due:
+            if not claim(keys=[OUTBOX_KEY], args=[key, now, now + settings.order_lease_seconds]):
+                continue  # outro worker pegou
+            self._submit(client, key)
+            done += 1
+        return done
+
+    def _submit(self, client: redis.Redis, key: str) -> None:
+        record = client.hgetall(order_key(key))
+        if not record or record.get("status") != "pending":
+            client.zrem(OUTBOX_KEY, key)
+            return
+
+        telefone = record.get("telefone", "")
+        attempts = int(record.get("attempts") or 0) + 1
+        res = enviar_pedido(json.loads(record["payload"]), idempotency_key=key,
+                            timeout=settings.order_submit_timeout)
+        ok, msg, retryable = res.ok, res.mensagem, res.retryable
+
+        if ok:
+            client.hset(order_key(key), mapping={"status": "sent", "attempts": attempts, "result": msg,
+                                                 "sent_at": datetime.now().isoformat()})
+            client.zrem(OUTBOX_KEY, key)
+            logger.info(f"✅ Pedido {key[:12]} confirmado pelo painel ({attempts} tentativa(s))")
+            _notify(telefone, "sent", msg)
+            return
+
+        if retryable and attempts < settings.order_max_attempts:
+            delay = min(settings.order_retry_backoff_max, settings.order_retry_backoff_base * (2 ** (attempts - 1)))
+            client.hset(order_key(key), mapping={"attempts": attempts, "last_error": msg})
+            client.zadd(OUTBOX_KEY, {key: time.time() + delay})
+            logger.warning(f"Pedido {key[:12]} falhou ({msg}); nova tentativa em {delay:.0f}s ({attempts}/{settings.order_max_attempts})")
+            return
+
+        client.hset(order_key(key), mapping={"status": "failed", "attempts": attempts, "last_error": msg})
+        client.zrem(OUTBOX_KEY, key)
+        logger.error(f"❌ Pedido {key[:12]} de {telefone} desistido após {attempts} tentativa(s): {msg}")
+        _notify(telefone, "failed", msg)
+
+
+# Instância global (iniciada no startup do servidor)
+outbox_worker = OrderOutboxWorker()
@@ -0,0 +1,249 @@
+"""
+Índice de atalhos consulta -> EAN aprendido com o carrinho
+
+- Cada busca registra quais EANs ela devolveu (`note_search`).
+- Quando o cliente confirma um item no carrinho com EAN, as consultas
+  recentes que trouxeram aquele EAN viram atalhos (`learn_from_cart`).
+- Antes da busca remota (File Search / smart-responder) o produto é
+  procurado numa trie de tokens canônicos (tools/normalizer.py), em uma
+  passada. Só conta acerto se a frase aprendida cobre TODOS os tokens do
+  produto, exceto medidas: "frango" vale para "frango 2kg", mas não para
+  "tempero de frango" nem "frango inteiro" (esses vão para a busca).
+- Um atalho aprendido só entra no índice depois de MIN_CONFIRMATIONS
+  confirmações (de qualquer cliente), a menos que a frase já traga marca
+  e medida: uma compra só não fixa "arroz" numa marca para todo mundo.
+- Persistido no hash Redis `ean_overrides` (chave canônica -> "ean:contagem");
+  semeado com os atalhos que antes eram fixos no código.
+"""
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+import redis
+
+from config.logger import setup_logger
+from services.cache import TTLCache
+from tools.normalizer import product_key
+from tools.redis_tools import get_redis_client, _script, _on_redis_error
+
+logger = setup_logger(__name__)
+
+OVERRIDES_KEY = "ean_overrides"
+RELOAD_INTERVAL = 60  # segundos entre recargas do Redis (outros processos aprendem também)
+MIN_CONFIRMATIONS = 3  # confirmações no carrinho para um atalho genérico valer
+
+# Exceções técnicas essenciais (antes CRITICAL_MAPPING em busca_file_search_com_preco)
+SEED_OVERRIDES: Dict[str, str] = {
+    "frango": "550",          # Frango Abatido (Commodity, muitas vezes ranking baixo)
+    "salsa": "751320919434",  # Salsinha Efraim
+    "salsinha": "751320919434",
+    "cebolinha": "751320919397",
+    "agua sanitaria": "7896221600012",
+    "kiboa": "7896221600012",
+    "qboa": "7896221600012",
+    "quiboa": "7896221600012",
+}
+
+# Aprende/reforça um atalho. Mesmo EAN soma; EAN diferente só substitui
+# quando a contagem atual chega a zero (um clique errado não apaga o histórico)
+# KEYS: overrides | ARGV: chave, ean
+_LUA_LEARN = """
+local cur = redis.call('HGET', KEYS[1], ARGV[1])
+if not cur then
+  redis.call('HSET', KEYS[1], ARGV[1], ARGV[2] .. ':1')
+  return 1
+end
+local ean, count = string.match(cur, '^(.*):(%d+)$')
+count = tonumber(count) or 0
+if ean == ARGV[2] then
+  redis.call('HSET', KEYS[1], ARGV[1], ean .. ':' .. (count + 1))
+  return count + 1
+end
+if count <= 1 then
+  redis.call('HSET', KEYS[1], ARGV[1], ARGV[2] .. ':1')
+  return 1
+end
+redis.call('HSET', KEYS[1], ARGV[1], ean .. ':' .. (count - 1))
+return 0
+"""
+
+
+def key_tokens(text: str) -> Tuple[str, ...]:
+    """Sequência canônica usada na trie: tokens ordenados, marca e medidas."""
+    key = product_key(text)
+    seq = list(key.tokens)
+    if key.brand:
+        seq.append(f"@{key.brand}")
+    seq.extend(f"#{s.text}" for s in key.sizes)
+    return tuple(seq)
+
+
+def _is_specific(tokens: Tuple[str, ...]) -> bool:
+    """Frase com marca e medida (ex: "arroz @camil #5kg"): uma confirmação basta."""
+    return any(t.startswith("@") for t in tokens) and any(t.startswith("#") for t in tokens)
+
+
+class _Node:
+    __slots__ = ("children", "ean")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.ean: Optional[str] = None
+
+
+class TokenTrie:
+    """Trie de tokens canônicos -> EAN."""
+
+    def __init__(self):
+        self.root = _Node()
+        self.size = 0
+
+    def insert(self, tokens: Iterable[str], ean: str) -> None:
+        node = self.root
+        for tok in tokens:
+            node = node.children.setdefault(tok, _Node())
+        if node.ean is None:
+            self.size += 1
+        node.ean = ean
+
+    def match(self, tokens: Tuple[str, ...]) -> Tuple[Optional[str], bool]:
+        """
+        Uma passada pelos tokens.
+
+        Returns:
+            (ean, parcial): ean quando a frase cobre todos os tokens (ou
+            só sobraram medidas, "#..."); parcial=True quando um atalho
+            menor foi encontrado mas sobrou token sem cobertura (ex:
+            "tempero" em "tempero de frango").
+        """
+        node, partial, by_size = self.root, False, None
+        for i, tok in enumerate(tokens):
+            if node.ean is not None:
+                partial = True
+                if all(t.startswith("#") for t in tokens[i:]):
+                    by_size = node.ean
+            node = node.children.get(tok)
+            if node is None:
+                return by_size, partial and by_size is None
+        if node.ean is None:
+            return by_size, partial and by_size is None
+        return node.ean, False
+
+
+class OverrideIndex:
+    """Atalhos consulta -> EAN com recarga periódica do Redis e métricas."""
+
+    def __init__(self, seeds: Dict[str, str]):
+        self.seeds = seeds
+        self._seed_keys = {key_tokens(text) for text in seeds}
+        self._trie = TokenTrie()
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        # EAN -> consultas recentes que o devolveram (aguardando confirmação no carrinho)
+        self._recent = TTLCache(max_items=2048, ttl_seconds=30 * 60)
+        self.hits = 0
+        self.misses = 0
+        self.partial = 0
+        self.learned = 0
+
+    def _build(self, stored: Dict[str, str]) -> TokenTrie:
+        trie = TokenTrie()
+        for field, value in stored.items():
+            ean, _, count = value.rpartition(":")
+            if not field or not ean:
+                continue
+            tokens = tuple(field.split(" "))
+            if _is_specific(tokens) or (int(count) if count.isdigit() else 0) >= MIN_CONFIRMATIONS:
+                trie.insert(tokens, ean)
+        # Sementes por último: exceções técnicas não são trocadas por aprendizado
+        for text, ean in self.seeds.items():
+            trie.insert(key_tokens(text), ean)
+        return trie
+
+    def _ensure_loaded(self) -> None:
+        if time.monotonic() - self._loaded_at < RELOAD_INTERVAL:
+            return
+        with self._lock:
+            if time.monotonic() - self._loaded_at < RELOAD_INTERVAL:
+                return
+            stored: Dict[str, str] = {}
+            client = get_redis_client()
+            if client is not None:
+                try:
+                    stored = client.hgetall(OVERRIDES_KEY)
+                except redis.exceptions.RedisError as e:
+                    _on_redis_error(e)
+                    logger.error(f"Erro ao carregar atalhos de EAN: {e}")
+            self._trie = self._build(stored)
+            self._loaded_at = time.monotonic()
+
+    def lookup(self, query: str) -> Optional[str]:
+        """EAN aprendido para a consulta (cobertura total) ou None."""
+        self._ensure_loaded()
+        tokens = key_tokens(query)
+        if not tokens:
+            return None
+        ean, partial = self._trie.match(tokens)
+        if ean:
+            self.hits += 1
+            logger.info(f"🎯 Atalho de EAN: '{query}' -> {ean}")
+        else:
+            self.misses += 1
+            if partial:
+                self.partial += 1
+        return ean
+
+    def note_search(self, query: str, eans: Iterable[Optional[str]]) -> None:
+        """Registra que `query` devolveu estes EANs (candidatos a aprendizado)."""
+        for ean in eans:
+            if not ean:
+                continue
+            queries = self._recent.get(ean) or []
+            if query not in queries:
+                self._recent.set(ean, (queries + [query])[-5:])
+
+    def learn_from_cart(self, produto: str, ean: str) -> int:
+        """Item confirmado no carrinho: consultas recentes que trouxeram o EAN viram atalho."""
+        ean = "".join(ch for ch in (ean or "") if ch.isdigit())
+        if not ean:
+            return 0
+        texts = set(self._recent.get(ean) or []) | {produto}
+        client = get_redis_client()
+        if client is None:
+            return 0
+        learn = _script(client, "override_learn", _LUA_LEARN)
+        learned = 0
+        try:
+            for text in texts:
+                field = " ".join(key_tokens(text))
+                if not field:
+                    continue
+                count = int(learn(keys=[OVERRIDES_KEY], args=[field, ean]))
+                if not count:
+                    continue
+                learned += 1
+                # Mesma regra do _build: genérico só com confirmações suficientes; semente não muda
+                tokens = tuple(field.split(" "))
+                if tokens not in self._seed_keys and (_is_specific(tokens) or count >= MIN_CONFIRMATIONS):
+                    with self._lock:
+                        self._trie.insert(tokens, ean)
+        except redis.exceptions.RedisError as e:
+            _on_redis_error(e)
+            logger.error(f"Erro ao aprender atalho de EAN: {e}")
+        self.learned += learned
+        return learned
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "entries": self._trie.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "rejected_partial": self.partial,
+            "learned": self.learned,
+            "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+# Instância global
+ean_overrides = OverrideIndex(SEED_OVERRIDES)
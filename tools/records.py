@@ -0,0 +1,64 @@
+"""
+Registros tipados das ferramentas HTTP
+
+As funções internas (busca de EAN, preço/estoque, pedidos) trocam estes
+registros entre si sem serializar/parsear texto. A conversão para texto
+acontece uma única vez, na borda da tool do LLM, com `to_tool_json`
+(JSON compacto, sem indentação e sem campos vazios).
+"""
+import json
+from dataclasses import dataclass, fields, is_dataclass
+from typing import Any, Optional
+
+
+class ToolError(Exception):
+    """Falha de ferramenta com mensagem já pronta para o agente."""
+
+
+@dataclass(slots=True)
+class ProductCandidate:
+    """Par EAN/nome devolvido pela busca de produtos (smart-responder)."""
+    ean: Optional[str]
+    nome: Optional[str]
+    score: float = 0.0
+
+
+@dataclass(slots=True)
+class StockItem:
+    """Produto consultado por EAN, já com preço e disponibilidade normalizados."""
+    produto: Optional[str] = None
+    ean: Optional[str] = None
+    id: Any = None
+    disponibilidade: bool = False
+    preco: Optional[float] = None
+    quantidade: Optional[float] = None
+
+
+@dataclass(slots=True)
+class OrderResult:
+    """Resposta do painel para envio/alteração de pedido."""
+    ok: bool
+    mensagem: str
+    retryable: bool = False
+    resposta: Any = None
+
+
+def _plain(obj: Any) -> Any:
+    """Converte registros em dict/list, omitindo campos None (menos tokens)."""
+    if is_dataclass(obj):
+        out = {}
+        for f in fields(obj):
+            value = getattr(obj, f.name)
+            if value is not None:
+                out[f.name] = _plain(value)
+        return out
+    if isinstance(obj, (list, tuple)):
+        return [_plain(v) for v in obj]
+    if isinstance(obj, dict):
+        return {k: _plain(v) for k, v in obj.items()}
+    return obj
+
+
+def to_tool_json(obj: Any) -> str:
+    """Serializador único da borda LLM: JSON compacto em UTF-8."""
+    return json.dumps(_plain(obj), ensure_ascii=False, separators=(",", ":"))
@@ -3,50 +3,236 @@ Ferramentas Redis para buffer de mensagens e cooldown
 Apenas funcionalidades essenciais mantidas
 """
 import redis
-from typing import Optional, Dict, List, Tuple
+import threading
+import time
+from datetime import datetime
+from typing import Any, Optional, Dict, List, Tuple
+from redis.backoff import ExponentialBackoff
+from redis.retry import Retry
 from config.settings import settings
 from config.logger import setup_logger
+from config import tracing
+from tools.local_store import LocalStore
 
 logger = setup_logger(__name__)
 
 # Conexão global com Redis
 _redis_client: Optional[redis.Redis] = None
-# Buffer local em memória (fallback quando Redis não está disponível)
-_local_buffer: Dict[str, List[str]] = {}
+# Armazenamento local (fallback quando Redis não está disponível): TTL + LRU,
+# reenviado ao Redis quando a conexão volta
+_local = LocalStore(settings.local_store_max_keys, settings.local_store_max_bytes)
+
+
+class RedisCircuitBreaker:
+    """
+    Circuit breaker da conexão com o Redis.
+
+    - closed: opera normalmente.
+    - open: após `threshold` falhas seguidas (qualquer comando bem-sucedido
+      zera a contagem), falha rápido (sem tentar conectar)
+      por um período que cresce exponencialmente a cada nova abertura.
+    - half_open: período expirou; a próxima chamada testa a conexão (PING).
+    """
+
+    def __init__(self, threshold: int, backoff_base: float, backoff_max: float):
+        self.threshold = max(1, threshold)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.failures = 0
+        self.opens = 0
+        self.open_until = 0.0
+        self.last_error: Optional[str] = None
+        self.last_success: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.failures < self.threshold:
+            return "closed"
+        return "open" if time.monotonic() < self.open_until else "half_open"
+
+    def allow(self) -> bool:
+        return self.state != "open"
+
+    def success(self) -> None:
+        self.last_success = time.time()
+        if self.failures == 0:
+            return  # caminho comum: nada a zerar, sem lock
+        with self._lock:
+            if self.failures >= self.threshold:
+                logger.info("Redis recuperado; circuit breaker fechado")
+            self.failures = 0
+            self.opens = 0
+
+    def failure(self, error: Exception) -> None:
+        with self._lock:
+            self.failures += 1
+            self.last_error = f"{type(error).__name__}: {error}"
+            if self.failures >= self.threshold:
+                delay = min(self.backoff_max, self.backoff_base * (2 ** self.opens))
+                self.opens += 1
+                self.open_until = time.monotonic() + delay
+                logger.error(f"Redis indisponível ({self.last_error}); circuit breaker aberto por {delay:.0f}s")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "retry_in_s": round(max(0.0, self.open_until - time.monotonic()), 1),
+            "last_error": self.last_error,
+            "last_success": datetime.fromtimestamp(self.last_success).isoformat() if self.last_success else None,
+        }
+
+
+_breaker = RedisCircuitBreaker(
+    threshold=settings.redis_breaker_threshold,
+    backoff_base=settings.redis_reconnect_backoff_base,
+    backoff_max=settings.redis_reconnect_backoff_max,
+)
+
+
+class _BreakerRedis(redis.Redis):
+    """Cliente que avisa o circuit breaker a cada comando bem-sucedido."""
+
+    def execute_command(self, *args, **options):
+        result = super().execute_command(*args, **options)
+        _breaker.success()
+        return result
+
+
+def _create_redis_client() -> redis.Redis:
+    """Cliente com pool dimensionado, conexões verificadas e retry curto."""
+    pool = redis.ConnectionPool(
+        host=settings.redis_host,
+        port=settings.redis_port,
+        db=settings.redis_db,
+        password=settings.redis_password if settings.redis_password else None,
+        decode_responses=True,
+        max_connections=settings.redis_max_connections,
+        socket_connect_timeout=settings.redis_connect_timeout,
+        socket_timeout=settings.redis_socket_timeout,
+        socket_keepalive=True,
+        health_check_interval=settings.redis_health_check_interval,
+        retry_on_timeout=True,
+        retry=Retry(ExponentialBackoff(cap=0.5, base=0.05), 2),
+    )
+    return _BreakerRedis(connection_pool=pool)
+
+
+def _on_redis_error(error: Exception) -> None:
+    """Falhas de conexão/timeout alimentam o circuit breaker (erros de comando não)."""
+    if isinstance(error, (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError)):
+        _breaker.failure(error)
 
 
 def get_redis_client() -> Optional[redis.Redis]:
     """
-    Retorna a conexão com o Redis (singleton)
+    Retorna a conexão com o Redis (singleton com pool).
+    Com o circuit breaker aberto retorna None na hora (fallback em memória),
+    sem pagar timeout de conexão a cada requisição.
     """
     global _redis_client
-    
-    if _redis_client is None:
+
+    state = _breaker.state
+    if state == "open":
+        return None
+
+    if _redis_client is None or state == "half_open":
         try:
-            _redis_client = redis.Redis(
-                host=settings.redis_host,
-                port=settings.redis_port,
-                db=settings.redis_db,
-                password=settings.redis_password if settings.redis_password else None,
-                decode_responses=True,
-                socket_connect_timeout=5,
-                socket_timeout=5
-            )
+            client = _redis_client or _create_redis_client()
             # Testar conexão
-            _redis_client.ping()
-            logger.info(f"Conectado ao Redis: {settings.redis_host}:{settings.redis_port}")
-        
-        except redis.exceptions.ConnectionError as e:
+            client.ping()
+            if _redis_client is None:
+                logger.info(f"Conectado ao Redis: {settings.redis_host}:{settings.redis_port}")
+            _redis_client = client
+            _breaker.success()
+            _replay_local_writes(client)
+        except redis.exceptions.RedisError as e:
             logger.error(f"Erro ao conectar ao Redis: {e}")
-            _redis_client = None
-        
+            _breaker.failure(e)
+            return None
         except Exception as e:
             logger.error(f"Erro inesperado ao conectar ao Redis: {e}")
-            _redis_client = None
-    
+            _breaker.failure(e)
+            return None
+
     return _redis_client
 
 
+def _replay_local_writes(client: redis.Redis) -> None:
+    """Reenvia ao Redis o que foi gravado no fallback em memória durante a queda."""
+    if not _local.stats()["pending_replay"]:
+        return
+    try:
+        synced = _local.replay(client, merge=_merge_local_key)
+        logger.info(f"♻️ Fallback em memória sincronizado com o Redis ({synced} chaves)")
+    except redis.exceptions.RedisError as e:
+        _on_redis_error(e)
+        logger.error(f"Erro ao sincronizar fallback com o Redis: {e}")
+
+
+def _merge_local_key(client: redis.Redis, key: str, kind: str, value: Any,
+                     ttl: Optional[int], exists: bool) -> bool:
+    """
+    Mescla do replay para carrinho e sessão (demais chaves: regra padrão do LocalStore).
+
+    - cart_items: cada linha local entra pelo mesmo script do add_item_to_cart
+      (soma com as linhas que o Redis já tinha); cart_index é refeito por ele.
+    - order_session: nunca rebaixa; a local só substitui a do Redis se for 'sent'.
+    """
+    if key.startswith("cart_index:"):
+        return True
+    if key.startswith("cart_items:") and kind == "hash":
+        telefone = key.split(":", 1)[1]
+        add = _script(client, "add_item", _LUA_ADD_ITEM)
+        items = sorted((json.loads(v) for k, v in value.items() if k not in CART_META_FIELDS),
+                       key=lambda item: item.get("seq", 0))
+        for item in items:
+            add(keys=[order_session_key(telefone), cart_key(telefone), cart_index_key(telefone)],
+                args=[item["linha"], item.get("produto", ""), item.get("ean", ""), float(item.get("quantidade", 1)),
+                      float(item.get("preco", 0)), item.get("observacao", ""), _new_session_json(), SESSION_TTL])
+        return True
+    if key.startswith("order_session:") and kind == "string":
+        try:
+            status = json.loads(value).get("status")
+        except (ValueError, AttributeError):
+            status = None
+        if exists and status != "sent":
+            return True  # Redis mantém a sessão dele (ex: já 'sent')
+        client.set(key, value, ex=ttl)
+        return True
+    return False
+
+
+def redis_health() -> Dict[str, Any]:
+    """Estado do Redis para o /health (sem abrir conexão nova)."""
+    info = _breaker.snapshot()
+    info["connected"] = _redis_client is not None and info["state"] == "closed"
+    if _redis_client is not None:
+        pool = _redis_client.connection_pool
+        info["pool"] = {
+            "max_connections": pool.max_connections,
+            "in_use": len(getattr(pool, "_in_use_connections", ())),
+            "idle": len(getattr(pool, "_available_connections", ())),
+        }
+    info["fallback"] = _local.stats()
+    return info
+
+
+# Scripts Lua registrados por cliente (EVALSHA; recarrega sozinho se o Redis reiniciar)
+_scripts: Dict[str, "redis.commands.core.Script"] = {}
+
+
+def _script(client: redis.Redis, name: str, source: str):
+    """Registra (uma vez por cliente) e retorna o script Lua `name`."""
+    key = f"{id(client)}:{name}"
+    script = _scripts.get(key)
+    if script is None:
+        script = client.register_script(source)
+        _scripts[key] = script
+    return script
+
+
 # ============================================
 # Buffer de mensagens (concatenação por janela)
 # ============================================
@@ -56,6 +242,7 @@ def buffer_key(telefone: str) -> str:
     return f"msgbuf:{telefone}"
 
 
+@tracing.traced("redis.push_message_to_buffer")
 def push_message_to_buffer(telefone: str, mensagem: str, ttl_seconds: int = 300) -> bool:
     """
     Empilha a mensagem recebida em uma lista no Redis para o telefone.
@@ -63,18 +250,16 @@ def push_message_to_buffer(telefone: str, mensagem: str, ttl_seconds: int = 300)
     - Usa `RPUSH` para adicionar ao final da lista `msgbuf:{telefone}`.
     - Define TTL na primeira inserção (mantém janela de expiração de 5 minutos).
     """
+    key = buffer_key(telefone)
     client = get_redis_client()
     if client is None:
-        # Fallback em memória
-        msgs = _local_buffer.get(telefone)
-        if msgs is None:
-            _local_buffer[telefone] = [mensagem]
-        else:
-            msgs.append(mensagem)
+        # Fallback em memória (mesma chave e TTL do Redis)
+        with _local.lock:
+            if _local.rpush(key, mensagem) == 1:
+                _local.expire(key, ttl_seconds)
         logger.info(f"[fallback] Mensagem empilhada em memória para {telefone}")
         return True
 
-    key = buffer_key(telefone)
     try:
         client.rpush(key, mensagem)
         # Se não houver TTL, definir um TTL padrão para evitar lixo acumulado
@@ -83,6 +268,7 @@ def push_message_to_buffer(telefone: str, mensagem: str, ttl_seconds: int = 300)
         logger.info(f"Mensagem empilhada no buffer: {key}")
         return True
     except redis.exceptions.RedisError as e:
+        _on_redis_error(e)
         logger.error(f"Erro ao empilhar mensagem no Redis: {e}")
         return False
 
@@ -92,15 +278,16 @@ def get_buffer_length(telefone: str) -> int:
     client = get_redis_client()
     if client is None:
         # Fallback em memória
-        msgs = _local_buffer.get(telefone) or []
-        return len(msgs)
+        return _local.llen(buffer_key(telefone))
     try:
         return int(client.llen(buffer_key(telefone)))
     except redis.exceptions.RedisError as e:
+        _on_redis_error(e)
         logger.error(f"Erro ao consultar tamanho do buffer: {e}")
         return 0
 
 
+@tracing.traced("redis.pop_all_messages")
 def pop_all_messages(telefone: str) -> list[str]:
     """
     Obtém todas as mensagens do buffer e limpa a chave.
@@ -108,8 +295,9 @@ def pop_all_messages(telefone: str) -> list[str]:
     client = get_redis_client()
     if client is None:
         # Fallback em memória
-        msgs = _local_buffer.get(telefone) or []
-        _local_buffer.pop(telefone, None)
+        with _local.lock:
+            msgs = _local.lrange(buffer_key(telefone))
+            _local.delete(buffer_key(telefone))
         logger.info(f"[fallback] Buffer consumido para {telefone}: {len(msgs)} mensagens")
         return msgs
     key = buffer_key(telefone)
@@ -122,6 +310,7 @@ def pop_all_messages(telefone: str) -> list[str]:
         logger.info(f"Buffer consumido para {telefone}: {len(msgs)} mensagens")
         return msgs
     except redis.exceptions.RedisError as e:
+        _on_redis_error(e)
         logger.error(f"Erro ao consumir buffer: {e}")
         return []
 
@@ -143,15 +332,16 @@ def set_agent_cooldown(telefone: str, ttl_seconds: int = 60) -> bool:
     """
     client = get_redis_client()
     if client is None:
-        # Fallback: não há persistência real, apenas log
-        logger.warning(f"[fallback] Cooldown não persistido (Redis indisponível) para {telefone}")
-        return False
+        _local.set(cooldown_key(telefone), "1", ex=ttl_seconds)
+        logger.warning(f"[fallback] Cooldown em memória para {telefone} por {ttl_seconds}s")
+        return True
     try:
         key = cooldown_key(telefone)
         client.set(key, "1", ex=ttl_seconds)
         logger.info(f"Cooldown definido para {telefone} por {ttl_seconds}s")
         return True
     except redis.exceptions.RedisError as e:
+        _on_redis_error(e)
         logger.error(f"Erro ao definir cooldown: {e}")
         return False
 
@@ -162,16 +352,17 @@ def is_agent_in_cooldown(telefone: str) -> Tuple[bool, int]:
     """
     client = get_redis_client()
     if client is None:
-        return (False, -1)
+        ttl = _local.ttl(cooldown_key(telefone))
+        return (False, -1) if ttl == -2 else (True, ttl)
     try:
-        key = cooldown_key(telefone)
-        val = client.get(key)
-        if val is None:
+        # TTL sozinho responde as duas perguntas: -2 = sem chave, -1 = sem expiração
+        ttl = client.ttl(cooldown_key(telefone))
+        ttl = ttl if isinstance(ttl, int) else -2
+        if ttl == -2:
             return (False, -1)
-        ttl = client.ttl(key)
-        ttl = ttl if isinstance(ttl, int) else -1
         return (True, ttl)
     except redis.exceptions.RedisError as e:
+        _on_redis_error(e)
         logger.error(f"Erro ao consultar cooldown: {e}")
         return (False, -1)
 
@@ -188,6 +379,38 @@ SESSION_TTL = 40 * 60  # 40 minutos para montar pedido
 MODIFICATION_TTL = 15 * 60  # 15 minutos para alterar após envio
 
 
+# Renova o TTL da sessão apenas se ainda estiver em 'building'
+# KEYS: session | ARGV: ttl
+_LUA_REFRESH_SESSION = """
+local raw = redis.call('GET', KEYS[1])
+if not raw then return 0 end
+local ok, data = pcall(cjson.decode, raw)
+if ok and type(data) == 'table' and data['status'] == 'building' then
+  redis.call('EXPIRE', KEYS[1], ARGV[1])
+  return 1
+end
+return 0
+"""
+
+# Marca pedido como enviado (sessão + histórico) numa única ida ao Redis
+# KEYS: session, history | ARGV: agora_iso, order_id, ttl_modificacao, ttl_historico
+_LUA_MARK_SENT = """
+local raw = redis.call('GET', KEYS[1])
+local data = nil
+if raw then
+  local ok, decoded = pcall(cjson.decode, raw)
+  if ok and type(decoded) == 'table' then data = decoded end
+end
+if not data then data = {started_at = ARGV[1]} end
+data['status'] = 'sent'
+data['sent_at'] = ARGV[1]
+if ARGV[2] ~= '' then data['order_id'] = ARGV[2] else data['order_id'] = cjson.null end
+redis.call('SET', KEYS[1], cjson.encode(data), 'EX', ARGV[3])
+redis.call('SET', KEYS[2], 'sent', 'EX', ARGV[4])
+return 1
+"""
+
+
 def order_session_key(telefone: str) -> str:
     """Chave da sessão de pedido no Redis."""
     return f"order_session:{telefone}"
@@ -206,7 +429,8 @@ def get_order_session(telefone: str) -> Optional[Dict]:
     """
     client = get_redis_client()
     if client is None:
-        return None
+        data = _local.get(order_session_key(telefone))
+        return json.loads(data) if data else None
     
     try:
         key = order_session_key(telefone)
@@ -215,10 +439,21 @@ def get_order_session(telefone: str) -> Optional[Dict]:
             return json.loads(data)
         return None
     except Exception as e:
+        _on_redis_error(e)
         logger.error(f"Erro ao obter sessão de pedido: {e}")
         return None
 
 
+def _new_session_json() -> str:
+    """JSON de uma sessão nova (status: building)."""
+    return json.dumps({
+        "status": "building",
+        "started_at": datetime.now().isoformat(),
+        "sent_at": None,
+        "order_id": None
+    })
+
+
 def start_order_session(telefone: str) -> bool:
     """
     Inicia uma nova sessão de pedido (status: building).
@@ -226,24 +461,21 @@ def start_order_session(telefone: str) -> bool:
     """
     client = get_redis_client()
     if client is None:
-        return False
+        _local.set(order_session_key(telefone), _new_session_json(), ex=SESSION_TTL)
+        return True
     
     try:
         key = order_session_key(telefone)
-        session = {
-            "status": "building",
-            "started_at": datetime.now().isoformat(),
-            "sent_at": None,
-            "order_id": None
-        }
-        client.set(key, json.dumps(session), ex=SESSION_TTL)
+        client.set(key, _new_session_json(), ex=SESSION_TTL)
         logger.info(f"📦 Nova sessão de pedido iniciada para {telefone} (TTL: {SESSION_TTL//60}min)")
         return True
     except Exception as e:
+        _on_redis_error(e)
         logger.error(f"Erro ao iniciar sessão de pedido: {e}")
         return False
 
 
+@tracing.traced("redis.mark_order_sent")
 def mark_order_sent(telefone: str, order_id: str = None) -> bool:
     """
     Marca o pedido como enviado. 
@@ -251,28 +483,19 @@ def mark_order_sent(telefone: str, order_id: str = None) -> bool:
     """
     client = get_redis_client()
     if client is None:
-        return False
+        _local_mark_sent(telefone, order_id)
+        return True
     
     try:
-        key = order_session_key(telefone)
-        session = get_order_session(telefone)
-        
-        if session is None:
-            session = {"started_at": datetime.now().isoformat()}
-        
-        session["status"] = "sent"
-        session["sent_at"] = datetime.now().isoformat()
-        session["order_id"] = order_id
-        
-        client.set(key, json.dumps(session), ex=MODIFICATION_TTL)
-        
-        # Marcar histórico como enviado
-        history_key = f"order_history:{telefone}"
-        client.set(history_key, "sent", ex=7200) # 2 horas
+        _script(client, "mark_sent", _LUA_MARK_SENT)(
+            keys=[order_session_key(telefone), f"order_history:{telefone}"],
+            args=[datetime.now().isoformat(), order_id or "", MODIFICATION_TTL, 7200],  # histórico: 2 horas
+        )
         
         logger.info(f"✅ Pedido marcado como enviado para {telefone} (TTL modificação: {MODIFICATION_TTL//60}min)")
         return True
     except Exception as e:
+        _on_redis_error(e)
         logger.error(f"Erro ao marcar pedido como enviado: {e}")
         return False
 
@@ -281,17 +504,90 @@ def clear_order_session(telefone: str) -> bool:
     """Remove a sessão de pedido."""
     client = get_redis_client()
     if client is None:
-        return False
+        _local.delete(order_session_key(telefone))
+        return True
     
     try:
         client.delete(order_session_key(telefone))
         logger.info(f"🗑️ Sessão de pedido removida para {telefone}")
         return True
     except Exception as e:
+        _on_redis_error(e)
         logger.error(f"Erro ao limpar sessão de pedido: {e}")
         return False
 
 
+# Máquina de estados da sessão + cooldown numa única chamada
+# KEYS: session, history, cooldown | ARGV: nova_sessao_json, ttl_sessao, ttl_historico
+# Retorna {codigo, cooldown_ativo (0/1), ttl_cooldown}
+_LUA_ORDER_STATE = """
+local cd_ttl = redis.call('TTL', KEYS[3])
+if cd_ttl ~= -2 then return {'cooldown', 1, cd_ttl} end
+
+local raw = redis.call('GET', KEYS[1])
+if raw then
+  local status = 'building'
+  local ok, data = pcall(cjson.decode, raw)
+  if ok and type(data) == 'table' and type(data['status']) == 'string' then status = data['status'] end
+  if status == 'building' then redis.call('EXPIRE', KEYS[1], ARGV[2]) end
+  return {status, 0, -1}
+end
+
+local previous = redis.call('GET', KEYS[2])
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+redis.call('SET', KEYS[2], '1', 'EX', ARGV[3])
+if not previous then return {'new', 0, -1} end
+if previous == 'sent' then return {'expired_sent', 0, -1} end
+return {'expired', 0, -1}
+"""
+
+# Contexto injetado no agente para cada código de estado
+ORDER_CONTEXT_MESSAGES = {
+    # Conversa nova
+    "new": "[SESSÃO] Nova conversa. Monte o pedido normalmente.",
+    # Sessão expirou após pedido finalizado
+    "expired_sent": "[SESSÃO] Janela de modificação expirou. Iniciando novo pedido do zero.",
+    # Sessão expirou com pedido abandonado
+    "expired": "[SESSÃO] Sessão anterior expirou. Iniciando novo pedido. Avise que o anterior não foi finalizado.",
+    # Ainda montando pedido (TTL renovado)
+    "building": "",
+    # Pedido já foi enviado - está na janela de modificação
+    "sent": "[SESSÃO] Pedido já enviado. Se cliente quiser adicionar algo, use alterar_tool.",
+}
+
+
+@tracing.traced("redis.get_order_state")
+def get_order_state(telefone: str) -> Tuple[str, bool, int]:
+    """
+    Avalia a sessão de pedido (new / building / sent / expired) e o cooldown
+    numa única chamada ao Redis (script Lua).
+
+    - Sem sessão: inicia uma nova (building) e marca o histórico (2 horas).
+    - Em 'building': renova o TTL da sessão.
+    - Com cooldown ativo: não altera nada e retorna o código "cooldown".
+
+    Returns:
+        (codigo, cooldown_ativo, ttl_cooldown)
+    """
+    client = get_redis_client()
+    if client is None:
+        return _local_order_state(telefone)
+
+    try:
+        code, cooldown, ttl = _script(client, "order_state", _LUA_ORDER_STATE)(
+            keys=[order_session_key(telefone), f"order_history:{telefone}", cooldown_key(telefone)],
+            args=[_new_session_json(), SESSION_TTL, 7200],
+        )
+        if code in ("new", "expired", "expired_sent"):
+            logger.info(f"📦 Nova sessão de pedido iniciada para {telefone} (TTL: {SESSION_TTL//60}min)")
+        return (code, bool(int(cooldown)), int(ttl))
+    except Exception as e:
+        _on_redis_error(e)
+        logger.error(f"Erro ao avaliar sessão de pedido: {e}")
+        return ("building", False, -1)
+
+
+@tracing.traced("redis.get_order_context")
 def get_order_context(telefone: str) -> str:
     """
     Retorna o contexto de pedido para injetar no agente.
@@ -299,57 +595,8 @@ def get_order_context(telefone: str) -> str:
     Returns:
         String com instrução para o agente baseada no estado da sessão.
     """
-    client = get_redis_client()
-    session = get_order_session(telefone)
-    
-    # Chave para rastrear se cliente já teve pedido recente
-    history_key = f"order_history:{telefone}"
-    
-    if session is None:
-        # Verificar se tinha sessão anterior (expirou)
-        had_previous = False
-        previous_status = None
-        
-        if client:
-            try:
-                previous_status = client.get(history_key)
-                had_previous = previous_status is not None
-            except:
-                pass
-        
-        # Iniciar nova sessão
-        start_order_session(telefone)
-        
-        # Marcar que cliente tem histórico (TTL de 2 horas)
-        # Reseta para "1" (active) para indicar que agora tem sessão ativa
-        if client:
-            try:
-                client.set(history_key, "1", ex=7200)  # 2 horas
-            except:
-                pass
-        
-        if had_previous:
-            # Sessão expirou - verificar se foi finalizado ou abandonado
-            if previous_status == "sent":
-                return "[SESSÃO] Janela de modificação expirou. Iniciando novo pedido do zero."
-            else:
-                return "[SESSÃO] Sessão anterior expirou. Iniciando novo pedido. Avise que o anterior não foi finalizado."
-        else:
-            # Conversa nova
-            return "[SESSÃO] Nova conversa. Monte o pedido normalmente."
-    
-    status = session.get("status", "building")
-    
-    if status == "building":
-        # Ainda montando pedido - renovar TTL
-        refresh_session_ttl(telefone)
-        return ""
-    
-    elif status == "sent":
-        # Pedido já foi enviado - está na janela de modificação
-        return "[SESSÃO] Pedido já enviado. Se cliente quiser adicionar algo, use alterar_tool."
-    
-    return ""
+    code, _, _ = get_order_state(telefone)
+    return ORDER_CONTEXT_MESSAGES.get(code, "")
 
 
 def check_can_modify_order(telefone: str) -> Tuple[bool, str]:
@@ -376,133 +623,464 @@ def check_can_modify_order(telefone: str) -> Tuple[bool, str]:
     return (False, "Sessão expirada. Novo pedido será criado.")
 
 
+def get_order_phase(telefone: str) -> str:
+    """
+    Fase do pedido para escolher as tools do agente:
+    'sent' (na janela de alteração), 'building' (carrinho com itens)
+    ou 'browsing' (sessão aberta, carrinho vazio).
+    """
+    session = get_order_session(telefone)
+    if session and session.get("status") == "sent":
+        return "sent"
+    return "building" if get_cart_count(telefone) > 0 else "browsing"
+
+
 def refresh_session_ttl(telefone: str) -> bool:
     """
     Renova o TTL da sessão quando o cliente interage (se ainda em building).
     """
     client = get_redis_client()
     if client is None:
+        with _local.lock:
+            raw = _local.get(order_session_key(telefone))
+            if raw and json.loads(raw).get("status") == "building":
+                return _local.expire(order_session_key(telefone), SESSION_TTL)
         return False
     
     try:
-        session = get_order_session(telefone)
-        if session and session.get("status") == "building":
-            key = order_session_key(telefone)
-            client.expire(key, SESSION_TTL)
+        refreshed = _script(client, "refresh_session", _LUA_REFRESH_SESSION)(
+            keys=[order_session_key(telefone)], args=[SESSION_TTL]
+        )
+        if refreshed:
             logger.debug(f"TTL da sessão renovado para {telefone}")
             return True
         return False
     except Exception as e:
+        _on_redis_error(e)
         logger.error(f"Erro ao renovar TTL da sessão: {e}")
         return False
 
 
 # ============================================
-# Carrinho de Compras (Redis List)
+# Carrinho de Compras (Redis Hash + índice ordenado)
 # ============================================
+#
+# cart_items:{telefone}  HASH  <linha> -> JSON do item (com subtotal e seq)
+#                              _total / _count / _seq -> agregados mantidos no servidor
+# cart_index:{telefone}  ZSET  <linha> com score = seq (ordem de inserção)
+#
+# A linha é o EAN (quando informado) ou o nome normalizado do produto, então
+# o mesmo produto adicionado duas vezes soma a quantidade na mesma linha.
+
+CART_META_FIELDS = ("_total", "_count", "_seq")
+
 
 def cart_key(telefone: str) -> str:
-    """Chave da lista de itens do carrinho no Redis."""
-    return f"cart:{telefone}"
+    """Chave do hash de itens do carrinho no Redis."""
+    return f"cart_items:{telefone}"
+
+
+def cart_index_key(telefone: str) -> str:
+    """Chave do índice ordenado (ZSET) das linhas do carrinho."""
+    return f"cart_index:{telefone}"
+
+
+def cart_line_id(produto: str, ean: str = "") -> str:
+    """Identificador da linha: EAN se houver, senão o nome normalizado."""
+    ean_digits = "".join(ch for ch in (ean or "") if ch.isdigit())
+    if ean_digits:
+        return f"ean:{ean_digits}"
+    return "nome:" + " ".join((produto or "").lower().split())
+
 
+# Adiciona/mescla item: garante sessão 'building', atualiza linha e agregados, renova TTLs
+# KEYS: session, items, index | ARGV: linha, produto, ean, quantidade, preco, observacao, nova_sessao_json, ttl
+_LUA_ADD_ITEM = """
+local raw = redis.call('GET', KEYS[1])
+local building = false
+if raw then
+  local ok, data = pcall(cjson.decode, raw)
+  building = ok and type(data) == 'table' and data['status'] == 'building'
+end
+if building then
+  redis.call('EXPIRE', KEYS[1], ARGV[8])
+else
+  redis.call('SET', KEYS[1], ARGV[7], 'EX', ARGV[8])
+end
 
-def add_item_to_cart(telefone: str, item_json: str) -> bool:
+local qty = tonumber(ARGV[4]) or 1
+local preco = tonumber(ARGV[5]) or 0
+local existing = redis.call('HGET', KEYS[2], ARGV[1])
+local item
+local old_subtotal = 0
+if existing then
+  item = cjson.decode(existing)
+  old_subtotal = tonumber(item['subtotal']) or 0
+  item['quantidade'] = (tonumber(item['quantidade']) or 0) + qty
+  if preco > 0 then item['preco'] = preco end
+  if ARGV[6] ~= '' then item['observacao'] = ARGV[6] end
+else
+  local seq = redis.call('HINCRBY', KEYS[2], '_seq', 1)
+  item = {linha = ARGV[1], produto = ARGV[2], ean = ARGV[3], quantidade = qty,
+          preco = preco, observacao = ARGV[6], seq = seq}
+  redis.call('ZADD', KEYS[3], seq, ARGV[1])
+  redis.call('HINCRBY', KEYS[2], '_count', 1)
+end
+item['subtotal'] = (tonumber(item['preco']) or 0) * item['quantidade']
+redis.call('HSET', KEYS[2], ARGV[1], cjson.encode(item))
+local total = redis.call('HINCRBYFLOAT', KEYS[2], '_total', item['subtotal'] - old_subtotal)
+redis.call('EXPIRE', KEYS[2], ARGV[8])
+redis.call('EXPIRE', KEYS[3], ARGV[8])
+return {redis.call('HGET', KEYS[2], '_count'), total}
+"""
+
+# Remove uma linha (pelo id ou pela posição no índice) e ajusta os agregados
+# KEYS: items, index | ARGV: modo ('line' | 'index'), valor
+_LUA_REMOVE_LINE = """
+local line = ARGV[2]
+if ARGV[1] == 'index' then
+  -- Índice negativo no ZRANGE conta do fim: nunca aceitar
+  if tonumber(ARGV[2]) < 0 then return {-1, '0'} end
+  line = redis.call('ZRANGE', KEYS[2], ARGV[2], ARGV[2])[1]
+end
+if not line then return {-1, '0'} end
+local raw = redis.call('HGET', KEYS[1], line)
+if not raw then return {-1, '0'} end
+local item = cjson.decode(raw)
+redis.call('HDEL', KEYS[1], line)
+redis.call('ZREM', KEYS[2], line)
+local count = redis.call('HINCRBY', KEYS[1], '_count', -1)
+local total = redis.call('HINCRBYFLOAT', KEYS[1], '_total', -(tonumber(item['subtotal']) or 0))
+return {count, total}
+"""
+
+# Define a quantidade de uma linha (0 remove) e ajusta os agregados
+# KEYS: items, index | ARGV: linha, quantidade
+_LUA_SET_QTY = """
+local raw = redis.call('HGET', KEYS[1], ARGV[1])
+if not raw then return {-1, '0'} end
+local item = cjson.decode(raw)
+local old_subtotal = tonumber(item['subtotal']) or 0
+local qty = tonumber(ARGV[2]) or 0
+local count
+if qty <= 0 then
+  redis.call('HDEL', KEYS[1], ARGV[1])
+  redis.call('ZREM', KEYS[2], ARGV[1])
+  count = redis.call('HINCRBY', KEYS[1], '_count', -1)
+  item['subtotal'] = 0
+else
+  item['quantidade'] = qty
+  item['subtotal'] = (tonumber(item['preco']) or 0) * qty
+  redis.call('HSET', KEYS[1], ARGV[1], cjson.encode(item))
+  count = redis.call('HGET', KEYS[1], '_count')
+end
+local total = redis.call('HINCRBYFLOAT', KEYS[1], '_total', item['subtotal'] - old_subtotal)
+return {count, total}
+"""
+
+
+def _cart_result(res) -> Optional[Tuple[int, float]]:
+    n, total = res
+    if int(n) < 0:
+        return None
+    return int(n), round(float(total), 2)
+
+
+@tracing.traced("redis.add_item_to_cart")
+def add_item_to_cart(telefone: str, produto: str, quantidade: float = 1.0, preco: float = 0.0,
+                     observacao: str = "", ean: str = "") -> Optional[Tuple[int, float]]:
     """
-    Adiciona um item (JSON string) ao carrinho.
-    Inicia sessão se não existir e renova TTL (40min).
+    Adiciona um item ao carrinho (mesmo EAN/produto soma na mesma linha).
+    Inicia sessão se não existir e renova TTL (40min) - tudo numa única
+    chamada atômica ao Redis (script Lua).
+
+    Returns:
+        (quantidade_de_linhas, total_estimado) ou None em caso de erro.
     """
     client = get_redis_client()
     if client is None:
-        return False
+        return _local_add_item(telefone, produto, float(quantidade), float(preco or 0), observacao or "", ean or "")
 
     try:
-        # Garante que existe sessão ativa
-        session = get_order_session(telefone)
-        if not session or session.get("status") != "building":
-            start_order_session(telefone)
-
-        key = cart_key(telefone)
-        # RPUSH adiciona ao final da lista
-        client.rpush(key, item_json)
-        
-        # Renova TTL do carrinho e da sessão para 40min
-        client.expire(key, SESSION_TTL)
-        refresh_session_ttl(telefone)
-        
+        res = _script(client, "add_item", _LUA_ADD_ITEM)(
+            keys=[order_session_key(telefone), cart_key(telefone), cart_index_key(telefone)],
+            args=[cart_line_id(produto, ean), produto, ean or "", float(quantidade), float(preco or 0),
+                  observacao or "", _new_session_json(), SESSION_TTL],
+        )
         logger.info(f"🛒 Item adicionado ao carrinho de {telefone}")
-        return True
+        return _cart_result(res)
     except Exception as e:
+        _on_redis_error(e)
         logger.error(f"Erro ao adicionar item ao carrinho: {e}")
-        return False
+        return None
 
 
-def get_cart_items(telefone: str) -> List[Dict]:
+def _parse_cart(raw: Dict[str, str]) -> Dict:
+    """Converte o HGETALL do carrinho em itens ordenados + agregados."""
+    items = []
+    for field, value in raw.items():
+        if field in CART_META_FIELDS:
+            continue
+        try:
+            items.append(json.loads(value))
+        except Exception:
+            continue
+    items.sort(key=lambda it: it.get("seq", 0))
+    return {
+        "itens": items,
+        "total": round(float(raw.get("_total") or 0), 2),
+        "count": int(raw.get("_count") or 0),
+    }
+
+
+@tracing.traced("redis.get_cart")
+def get_cart(telefone: str) -> Dict:
     """
-    Retorna todos os itens do carrinho como lista de dicionários.
+    Retorna o carrinho com um único HGETALL: itens na ordem de inserção
+    e agregados já mantidos no servidor.
+
+    Returns:
+        {"itens": [...], "total": float, "count": int}
     """
     client = get_redis_client()
     if client is None:
-        return []
+        return _parse_cart(_local.get_mapping(cart_key(telefone), "hash"))
 
     try:
-        key = cart_key(telefone)
-        # LRANGE 0 -1 pega toda a lista
-        items_raw = client.lrange(key, 0, -1)
-        
-        items = []
-        for raw in items_raw:
-            try:
-                if isinstance(raw, str):
-                    items.append(json.loads(raw))
-            except:
-                continue
-                
-        return items
+        return _parse_cart(client.hgetall(cart_key(telefone)))
     except Exception as e:
+        _on_redis_error(e)
         logger.error(f"Erro ao ler carrinho: {e}")
-        return []
+        return {"itens": [], "total": 0.0, "count": 0}
+
+
+@tracing.traced("redis.get_cart_count")
+def get_cart_count(telefone: str) -> int:
+    """Nº de itens do carrinho (só o agregado `_count`, sem ler os itens)."""
+    client = get_redis_client()
+    if client is None:
+        return int(_local.get_mapping(cart_key(telefone), "hash").get("_count") or 0)
+
+    try:
+        return int(client.hget(cart_key(telefone), "_count") or 0)
+    except Exception as e:
+        _on_redis_error(e)
+        logger.error(f"Erro ao ler tamanho do carrinho: {e}")
+        return 0
 
 
-def remove_item_from_cart(telefone: str, index: int) -> bool:
+def get_cart_items(telefone: str) -> List[Dict]:
     """
-    Remove item pelo índice (0-based).
-    NOTA: Redis Lists não são ideais para remover por índice concorrente, 
-    mas para este caso de uso simples (1 usuário), funciona usando LSET + LREM 
-    ou apenas recriando a lista.
-    
-    Abordagem segura: Ler tudo, remover no python, reescrever.
+    Retorna todos os itens do carrinho como lista de dicionários (ordem de inserção).
     """
+    return get_cart(telefone)["itens"]
+
+
+@tracing.traced("redis.remove_item_from_cart")
+def remove_item_from_cart(telefone: str, index: int) -> Optional[Tuple[int, float]]:
+    """
+    Remove item pela posição (0-based, ordem mostrada no view_cart).
+    Script Lua atômico: resolve a linha no índice e ajusta os agregados.
+
+    Returns:
+        (linhas_restantes, total_estimado) ou None se o índice for inválido/erro.
+    """
+    index = int(index)
+    if index < 0:
+        return None
     client = get_redis_client()
     if client is None:
-        return False
+        return _local_remove_line(telefone, index=index)
 
     try:
-        key = cart_key(telefone)
-        items = client.lrange(key, 0, -1)
-        
-        if 0 <= index < len(items):
-            # Elemento placeholder para marcar remoção
-            deleted_marker = "__DELETED__"
-            client.lset(key, index, deleted_marker)
-            client.lrem(key, 0, deleted_marker)
-            return True
-            
-        return False
+        res = _script(client, "remove_line", _LUA_REMOVE_LINE)(
+            keys=[cart_key(telefone), cart_index_key(telefone)], args=["index", index]
+        )
+        return _cart_result(res)
     except Exception as e:
+        _on_redis_error(e)
         logger.error(f"Erro ao remover item do carrinho: {e}")
-        return False
+        return None
+
+
+def remove_cart_line(telefone: str, line_id: str) -> Optional[Tuple[int, float]]:
+    """Remove uma linha pelo id (O(1))."""
+    client = get_redis_client()
+    if client is None:
+        return _local_remove_line(telefone, line_id=line_id)
+
+    try:
+        res = _script(client, "remove_line", _LUA_REMOVE_LINE)(
+            keys=[cart_key(telefone), cart_index_key(telefone)], args=["line", line_id]
+        )
+        return _cart_result(res)
+    except Exception as e:
+        _on_redis_error(e)
+        logger.error(f"Erro ao remover linha do carrinho: {e}")
+        return None
+
+
+def update_cart_line(telefone: str, line_id: str, quantidade: float) -> Optional[Tuple[int, float]]:
+    """Define a quantidade de uma linha (0 remove) em O(1)."""
+    client = get_redis_client()
+    if client is None:
+        return _local_set_qty(telefone, line_id, float(quantidade))
+
+    try:
+        res = _script(client, "set_qty", _LUA_SET_QTY)(
+            keys=[cart_key(telefone), cart_index_key(telefone)], args=[line_id, float(quantidade)]
+        )
+        return _cart_result(res)
+    except Exception as e:
+        _on_redis_error(e)
+        logger.error(f"Erro ao atualizar linha do carrinho: {e}")
+        return None
 
 
+@tracing.traced("redis.clear_cart")
 def clear_cart(telefone: str) -> bool:
     """Remove todo o carrinho."""
     client = get_redis_client()
     if client is None:
-        return False
+        _local.delete(cart_key(telefone), cart_index_key(telefone))
+        return True
 
     try:
-        client.delete(cart_key(telefone))
+        client.delete(cart_key(telefone), cart_index_key(telefone))
         logger.info(f"🛒 Carrinho limpo para {telefone}")
         return True
     except Exception as e:
+        _on_redis_error(e)
         logger.error(f"Erro ao limpar carrinho: {e}")
-        return False
\ No newline at end of file
+        return False
+
+
+# ============================================
+# Fallback em memória (mesma semântica dos scripts Lua)
+# ============================================
+
+def _local_session_status(telefone: str) -> Optional[str]:
+    raw = _local.get(order_session_key(telefone))
+    if not raw:
+        return None
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        return "building"
+    return (data.get("status") or "building") if isinstance(data, dict) else "building"
+
+
+def _local_mark_sent(telefone: str, order_id: Optional[str]) -> None:
+    key = order_session_key(telefone)
+    with _local.lock:
+        raw = _local.get(key)
+        try:
+            data = json.loads(raw) if raw else None
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            data = {"started_at": datetime.now().isoformat()}
+        data.update(status="sent", sent_at=datetime.now().isoformat(), order_id=order_id or None)
+        _local.set(key, json.dumps(data), ex=MODIFICATION_TTL)
+        _local.set(f"order_history:{telefone}", "sent", ex=7200)
+    logger.warning(f"[fallback] Pedido marcado como enviado em memória para {telefone}")
+
+
+def _local_order_state(telefone: str) -> Tuple[str, bool, int]:
+    with _local.lock:
+        cd_ttl = _local.ttl(cooldown_key(telefone))
+        if cd_ttl != -2:
+            return ("cooldown", True, cd_ttl)
+
+        status = _local_session_status(telefone)
+        if status is not None:
+            if status == "building":
+                _local.expire(order_session_key(telefone), SESSION_TTL)
+            return (status, False, -1)
+
+        history_key = f"order_history:{telefone}"
+        previous = _local.get(history_key)
+        _local.set(order_session_key(telefone), _new_session_json(), ex=SESSION_TTL)
+        _local.set(history_key, "1", ex=7200)
+    if previous is None:
+        return ("new", False, -1)
+    return ("expired_sent" if previous == "sent" else "expired", False, -1)
+
+
+def _local_cart_save(telefone: str, items: Dict[str, str], index: Dict[str, float]) -> None:
+    _local.set_mapping(cart_key(telefone), "hash", items, ttl=SESSION_TTL)
+    _local.set_mapping(cart_index_key(telefone), "zset", index, ttl=SESSION_TTL)
+
+
+def _local_cart_totals(items: Dict[str, str]) -> Tuple[int, float]:
+    return int(items.get("_count") or 0), round(float(items.get("_total") or 0), 2)
+
+
+def _local_add_item(telefone: str, produto: str, quantidade: float, preco: float,
+                    observacao: str, ean: str) -> Tuple[int, float]:
+    line = cart_line_id(produto, ean)
+    with _local.lock:
+        if _local_session_status(telefone) == "building":
+            _local.expire(order_session_key(telefone), SESSION_TTL)
+        else:
+            _local.set(order_session_key(telefone), _new_session_json(), ex=SESSION_TTL)
+
+        items = _local.get_mapping(cart_key(telefone), "hash")
+        index = _local.get_mapping(cart_index_key(telefone), "zset")
+        old_subtotal = 0.0
+        if line in items:
+            item = json.loads(items[line])
+            old_subtotal = float(item.get("subtotal") or 0)
+            item["quantidade"] = float(item.get("quantidade") or 0) + quantidade
+            if preco > 0:
+                item["preco"] = preco
+            if observacao:
+                item["observacao"] = observacao
+        else:
+            seq = int(items.get("_seq") or 0) + 1
+            items["_seq"] = str(seq)
+            items["_count"] = str(int(items.get("_count") or 0) + 1)
+            index[line] = float(seq)
+            item = {"linha": line, "produto": produto, "ean": ean, "quantidade": quantidade,
+                    "preco": preco, "observacao": observacao, "seq": seq}
+        item["subtotal"] = float(item.get("preco") or 0) * item["quantidade"]
+        items[line] = json.dumps(item, ensure_ascii=False)
+        items["_total"] = str(float(items.get("_total") or 0) + item["subtotal"] - old_subtotal)
+        _local_cart_save(telefone, items, index)
+    logger.info(f"[fallback] 🛒 Item adicionado ao carrinho em memória de {telefone}")
+    return _local_cart_totals(items)
+
+
+def _local_remove_line(telefone: str, index: Optional[int] = None,
+                       line_id: Optional[str] = None) -> Optional[Tuple[int, float]]:
+    with _local.lock:
+        items = _local.get_mapping(cart_key(telefone), "hash")
+        order = _local.get_mapping(cart_index_key(telefone), "zset")
+        if index is not None:
+            lines = sorted(order, key=order.get)
+            line_id = lines[index] if 0 <= index < len(lines) else None
+        if not line_id or line_id not in items:
+            return None
+        item = json.loads(items.pop(line_id))
+        order.pop(line_id, None)
+        items["_count"] = str(int(items.get("_count") or 0) - 1)
+        items["_total"] = str(float(items.get("_total") or 0) - float(item.get("subtotal") or 0))
+        _local_cart_save(telefone, items, order)
+    return _local_cart_totals(items)
+
+
+def _local_set_qty(telefone: str, line_id: str, quantidade: float) -> Optional[Tuple[int, float]]:
+    if quantidade <= 0:
+        return _local_remove_line(telefone, line_id=line_id)
+    with _local.lock:
+        items = _local.get_mapping(cart_key(telefone), "hash")
+        if line_id not in items:
+            return None
+        item = json.loads(items[line_id])
+        old_subtotal = float(item.get("subtotal") or 0)
+        item["quantidade"] = quantidade
+        item["subtotal"] = float(item.get("preco") or 0) * quantidade
+        items[line_id] = json.dumps(item, ensure_ascii=False)
+        items["_total"] = str(float(items.get("_total") or 0) + item["subtotal"] - old_subtotal)
+        _local.set_mapping(cart_key(telefone), "hash", items)
+    return _local_cart_totals(items)